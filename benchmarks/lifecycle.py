@@ -0,0 +1,84 @@
+"""
+Measures every trigger and every transition against a seeded table.
+
+Triggers are run once each over the seeded table, in an order that leaves each one's
+candidates untouched by the triggers before it. Latency samples are the time taken per
+subscription (or per chunk with `bulk`), taken from the transition signals.
+
+Transitions are run `samples` times each, on subscriptions created in the transition's
+source state inside the seeded table.
+"""
+
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+from django_fsm.signals import post_transition
+from subscriptions import signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+from .utils import Stopwatch, analyze, count_queries, result, seed
+
+TRIGGERS = [
+    ("stuck", "trigger_stuck", signals.bulk_subscription_error),
+    ("suspended_timeout", "trigger_suspended_timeout", signals.bulk_subscription_ended),
+    ("suspended", "trigger_suspended", signals.bulk_subscription_due),
+    ("renewals", "trigger_renewals", signals.bulk_subscription_due),
+    ("expiring", "trigger_expiring", signals.bulk_subscription_ended),
+]
+
+TRANSITIONS = [
+    ("cancel_autorenew", State.ACTIVE, lambda sub: sub.cancel_autorenew()),
+    ("enable_autorenew", State.EXPIRING, lambda sub: sub.enable_autorenew()),
+    ("renew", State.ACTIVE, lambda sub: sub.renew()),
+    (
+        "renewed",
+        State.RENEWING,
+        lambda sub: sub.renewed(sub.end + timedelta(days=30), sub.reference, description="bench"),
+    ),
+    ("renewal_failed", State.RENEWING, lambda sub: sub.renewal_failed(description="bench")),
+    ("end_subscription", State.ACTIVE, lambda sub: sub.end_subscription(description="bench")),
+    ("state_unknown", State.RENEWING, lambda sub: sub.state_unknown(description="bench")),
+]
+
+
+def run_trigger(name, method, bulk_signal, bulk):
+    stopwatch = Stopwatch()
+    signal = bulk_signal if bulk else post_transition
+    signal.connect(stopwatch.lap)
+    try:
+        with count_queries() as queries:
+            started = time.perf_counter()
+            count = getattr(Subscription.objects, method)(bulk=bulk)
+            seconds = time.perf_counter() - started
+    finally:
+        signal.disconnect(stopwatch.lap)
+    kind = "trigger.bulk" if bulk else "trigger"
+    return result(name, kind, count, seconds, queries.count, stopwatch.laps)
+
+
+def run_transition(name, source, call, samples):
+    end = timezone.now() + timedelta(days=30)
+    Subscription.objects.bulk_create(
+        Subscription(state=source, end=end, reference="bench-{}".format(name))
+        for _ in range(samples)
+    )
+    subscriptions = list(
+        Subscription.objects.filter(reference="bench-{}".format(name), state=source)
+    )
+    latencies = []
+    with count_queries() as queries:
+        for subscription in subscriptions:
+            started = time.perf_counter()
+            call(subscription)
+            latencies.append(time.perf_counter() - started)
+    return result(name, "transition", len(latencies), sum(latencies), queries.count, latencies)
+
+
+def run(rows, bulk=False, samples=1000, **options):
+    seed(rows)
+    results = [run_transition(*transition, samples=samples) for transition in TRANSITIONS]
+    analyze()
+    results.extend(run_trigger(*trigger, bulk=bulk) for trigger in TRIGGERS)
+    return results
@@ -0,0 +1,41 @@
+"""
+Compares `suspended_timeout()` against the query it replaced, which added the timeout to
+`end` for every row rather than comparing `end` against a precomputed cutoff.
+"""
+
+import time
+from datetime import timedelta
+
+from django.db import models
+from django.db.models.expressions import ExpressionWrapper as E
+from django.utils import timezone
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+from .utils import count_queries, result, seed
+
+
+def legacy_suspended_timeout(timeout_hours):
+    return Subscription.objects.annotate(
+        cutoff=E(
+            models.F("end") + timedelta(hours=timeout_hours), output_field=models.DateTimeField()
+        )
+    ).filter(state=State.SUSPENDED, cutoff__lte=timezone.now())
+
+
+def measure(name, queryset, repeat=5):
+    latencies = []
+    with count_queries() as queries:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = len(queryset.all().values_list("pk", flat=True))
+            latencies.append(time.perf_counter() - started)
+    return result(name, "query", count * repeat, sum(latencies), queries.count, latencies)
+
+
+def run(rows, **options):
+    seed(rows)
+    return [
+        measure("suspended_timeout.end_plus_interval", legacy_suspended_timeout(48)),
+        measure("suspended_timeout.end_before_cutoff", Subscription.objects.suspended_timeout(48)),
+    ]
@@ -0,0 +1,110 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+# Mostly ENDED, like a table that has been running for a few years
+WEIGHTS = {
+    State.ENDED: 80,
+    State.ACTIVE: 12,
+    State.EXPIRING: 3,
+    State.SUSPENDED: 2,
+    State.RENEWING: 2,
+    State.ERROR: 1,
+}
+
+
+def seed(rows, batch_size=10000):
+    """
+    Creates `rows` subscriptions spread across every state, with `end` up to a year either side
+    of now so that some of each are due. Subscriptions are created a batch at a time, so memory
+    use doesn't grow with `rows`. RENEWING subscriptions are backdated so that half are stuck.
+    """
+    now = timezone.now()
+    states = random.Random(0)
+    ends = random.Random(1)
+    for offset in range(0, rows, batch_size):
+        size = min(batch_size, rows - offset)
+        Subscription.objects.bulk_create(
+            Subscription(
+                state=state,
+                end=now + timedelta(hours=ends.randint(-24 * 365, 24 * 365)),
+                reference="bench-{}".format(offset + i),
+            )
+            for i, state in enumerate(states.choices(list(WEIGHTS), list(WEIGHTS.values()), k=size))
+        )
+    renewing = Subscription.objects.filter(state=State.RENEWING)
+    renewing.filter(pk__in=renewing.values("pk")[: renewing.count() // 2]).update(
+        last_updated=now - timedelta(hours=6)
+    )
+    analyze()
+
+
+def analyze():
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+class QueryCounter:
+    """
+    Counts the queries run on the default connection, without keeping them around.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def result(name, kind, count, seconds, queries, latencies):
+    """
+    A single measurement, in the shape written to the results file. Latencies are in seconds.
+    """
+    return {
+        "name": name,
+        "kind": kind,
+        "count": count,
+        "seconds": round(seconds, 6),
+        "throughput": round(count / seconds, 2) if seconds else None,
+        "queries": queries,
+        "queries_per_item": round(queries / count, 3) if count else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+class Stopwatch:
+    """
+    Records the time between successive calls to `lap`.
+    """
+
+    def __init__(self):
+        self.laps = []
+        self.last = time.perf_counter()
+
+    def lap(self, *args, **kwargs):
+        now = time.perf_counter()
+        self.laps.append(now - self.last)
+        self.last = now
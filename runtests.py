@@ -10,6 +10,7 @@ Script copied, blatantly, from https://github.com/ubernostrum/pwned-passwords-dj
 
 import os
 import sys
+import tempfile
 
 # Make sure the app is (at least temporarily) on the import path.
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -22,7 +23,24 @@ SETTINGS_DICT = {
         "django_fsm_log",
         "subscriptions.apps.SubscriptionsConfig",
     ],
-    "DATABASES": {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    "DATABASES": {
+        # A file rather than memory, so that threads lock it the way they would a real database
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+            "TEST": {
+                "NAME": os.path.join(
+                    tempfile.gettempdir(), "subscriptions-test-{}.sqlite3".format(os.getpid())
+                )
+            },
+        },
+        # Stands in for a read replica in tests/test_replicas.py
+        "replica": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+            "TEST": {"MIRROR": "default"},
+        },
+    },
     "TEST_RUNNER": "xmlrunner.extra.djangotestrunner.XMLTestRunner",
     "TEST_OUTPUT_VERBOSE": 2,
     "TEST_OUTPUT_DIR": "test-results",
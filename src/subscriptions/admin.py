@@ -3,7 +3,19 @@ from django.db.models import TextField
 from django.forms import Textarea
 from django_fsm_log.admin import StateLogInline
 
-from . import models
+from . import history, models
+
+
+class StateChangeInline(admin.TabularInline):
+    model = models.StateChange
+    fields = ("timestamp", "source_state", "state", "transition", "by", "description")
+    readonly_fields = fields
+    ordering = ("-timestamp",)
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(models.Subscription)
@@ -16,4 +28,19 @@ class SubscriptionAdmin(admin.ModelAdmin):
     formfield_overrides = {TextField: {"widget": Textarea(attrs={"cols": "100", "rows": 1})}}
     readonly_fields = ("state", "start", "end", "reference", "last_updated", "reason")
     fields = ("state", "start", "end", "reference", "last_updated", "reason")
-    inlines = [StateLogInline]
+    inlines = [StateChangeInline if history.enabled() else StateLogInline]
+
+
+@admin.register(models.ArchivedSubscription)
+class ArchivedSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ("id", "state", "start", "end", "archived", "reference")
+    list_filter = ("end", "archived")
+    list_per_page = 50
+    ordering = ("-archived",)
+    search_fields = ("reference__startswith",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
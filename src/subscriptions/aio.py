@@ -0,0 +1,92 @@
+import asyncio
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import signals
+from .sweeps import Progress, after, chunk_size, stopped
+
+__all__ = ["asweep", "atransition"]
+
+"""
+Async counterparts of the transitions and triggers, for projects served over ASGI.
+
+The ORM is synchronous, so the database work of a transition is run in a thread with
+`sync_to_async`. The signals sent by its post transition hook are collected while it runs,
+and sent from the event loop once it has saved, so coroutine receivers are awaited directly
+and an async sweep can have many transitions waiting on their receivers at once.
+
+Requires `asgiref`, which is installed with Django 3.0 and later.
+
+Usage:
+
+    await subscription.arenewed(new_end, reference)
+    await Subscription.objects.atrigger_renewals(concurrency=20)
+"""
+
+
+DEFAULT_CONCURRENCY = 10
+
+
+def max_concurrency():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_ASYNC_CONCURRENCY", DEFAULT_CONCURRENCY)
+
+
+async def atransition(transition_method, *args, **kwargs):
+    """
+    Calls the bound `transition_method` in a thread, then sends the signals of its post
+    transition hook with `asend_robust`, and returns the result of the transition.
+    """
+    from asgiref.sync import sync_to_async
+
+    with signals.deferred() as pending:
+        result = await sync_to_async(transition_method)(*args, **kwargs)
+    for signal, sender, named in pending:
+        await signal.asend_robust(sender, **named)
+    return result
+
+
+async def asweep(queryset, action, size=None, concurrency=None, throttle=None):
+    """
+    Walks `queryset` in chunks of `size` ordered by (last_updated, pk), awaiting
+    `action(subscription)` for every subscription with at most `concurrency` in flight, and
+    returns the number of subscriptions processed.
+
+    Unlike `subscriptions.sweeps.sweep`, chunks are not processed in a transaction and no
+    cursor is kept. Each transition commits on its own, so an interrupted sweep simply finds
+    the remaining candidates next time. A `throttle` sizes and filters the chunks as it does
+    for `subscriptions.sweeps.sweep`.
+    """
+    from asgiref.sync import sync_to_async
+
+    size = size or chunk_size()
+    limit = asyncio.Semaphore(concurrency or max_concurrency())
+    candidates = queryset.filter(last_updated__lte=timezone.now()).order_by("last_updated", "pk")
+
+    async def run(subscription):
+        async with limit:
+            await action(subscription)
+
+    count = 0
+    position = None
+    while True:
+        wanted = await sync_to_async(throttle.grant)(size) if throttle else size
+        if not wanted:
+            remaining = await sync_to_async(after(candidates, position).count)()
+            return stopped(None, count, remaining)
+        chunk = await sync_to_async(list)(after(candidates, position)[:wanted])
+        if not chunk:
+            break
+        # Saving moves last_updated on, so take the position before running the chunk.
+        position = (chunk[-1].last_updated, chunk[-1].pk)
+        if throttle:
+            rows = [(subscription.pk, subscription.state) for subscription in chunk]
+            admitted = set(await sync_to_async(throttle.admit)(queryset.model, rows))
+            throttle.refund(wanted - len(admitted))
+            chunk = [sub for sub in chunk if (sub.pk, sub.state) in admitted]
+        await asyncio.gather(*(run(subscription) for subscription in chunk))
+        count += len(chunk)
+    if throttle:
+        throttle.refund(wanted)
+    return Progress(count)
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters
+from .states import SubscriptionState as State
+from .sweeps import chunk_size
+
+__all__ = ["archive_ended"]
+
+"""
+Moves ENDED subscriptions out of the subscription table.
+
+ENDED is terminal, so once a subscription has been ended for longer than the retention
+window nothing will transition it again, and it only makes the table and its indexes
+larger for every trigger. `archive_ended()` copies those subscriptions into
+ArchivedSubscription, keeping their ids, and deletes them from Subscription, a chunk at a
+time. Their StateLog history is left where it is.
+
+Usage:
+
+    archive_ended(days=365, pause=0.5)
+"""
+
+
+DEFAULT_ARCHIVE_DAYS = 365
+
+
+def archive_days():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_ARCHIVE_DAYS", DEFAULT_ARCHIVE_DAYS)
+
+
+def archive_pause():
+    # type: () -> float
+    return getattr(settings, "SUBSCRIPTIONS_ARCHIVE_PAUSE", 0)
+
+
+def archive_ended(days=None, size=None, pause=None):
+    """
+    Archives subscriptions that ended more than `days` ago in chunks of `size`, sleeping for
+    `pause` seconds between chunks to spread the load, and returns the number archived.
+    """
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    ArchivedSubscription = apps.get_model("subscriptions", "ArchivedSubscription")
+    days = archive_days() if days is None else days
+    size = size or chunk_size()
+    pause = archive_pause() if pause is None else pause
+    candidates = (
+        Subscription._base_manager.filter(state=State.ENDED)
+        .filter(end__lte=timezone.now() - timedelta(days=days))
+        .order_by("pk")
+    )
+    fields = [field.attname for field in ArchivedSubscription._meta.concrete_fields]
+    fields.remove("archived")
+
+    count = 0
+    while True:
+        with transaction.atomic(), counters.buffered():
+            rows = list(candidates.select_for_update().values(*fields)[:size])
+            if not rows:
+                break
+            ArchivedSubscription.objects.bulk_create([ArchivedSubscription(**row) for row in rows])
+            Subscription._base_manager.filter(pk__in=[row["id"] for row in rows]).delete()
+        count += len(rows)
+        if pause and len(rows) == size:
+            time.sleep(pause)
+    return count
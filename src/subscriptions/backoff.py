@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+__all__ = ["delay", "next_retry", "retry_values"]
+
+"""
+Exponential backoff between the renewal retries of SUSPENDED subscriptions.
+
+Each `renewal_failed()` counts an attempt in `retry_attempts`, and schedules the next retry at
+`next_retry_at`. `trigger_suspended` (and `tick`) only renew subscriptions whose retry is due,
+so a card that failed a minute ago isn't charged again on the next run. A successful
+`renewed()` resets both.
+
+The n-th retry waits `SUBSCRIPTIONS_RETRY_BASE * SUBSCRIPTIONS_RETRY_FACTOR ** (n - 1)`
+seconds, at most `SUBSCRIPTIONS_RETRY_MAX`. By default that is 1, 2, 4, 8, 16 and then every
+24 hours. `SUBSCRIPTIONS_RETRY_BASE = 0` retries on every run, as before.
+"""
+
+
+DEFAULT_BASE = 60 * 60
+DEFAULT_FACTOR = 2
+DEFAULT_MAX = 24 * 60 * 60
+
+
+def policy():
+    return (
+        getattr(settings, "SUBSCRIPTIONS_RETRY_BASE", DEFAULT_BASE),
+        getattr(settings, "SUBSCRIPTIONS_RETRY_FACTOR", DEFAULT_FACTOR),
+        getattr(settings, "SUBSCRIPTIONS_RETRY_MAX", DEFAULT_MAX),
+    )
+
+
+def delay(attempt):
+    # type: (int) -> timedelta
+    """
+    How long to wait after the `attempt`-th failure (counting from 1) before retrying.
+    """
+    base, factor, maximum = policy()
+    seconds = base * factor ** (max(attempt, 1) - 1)
+    return timedelta(seconds=min(seconds, maximum))
+
+
+def next_retry(attempt, now=None):
+    return (now or timezone.now()) + delay(attempt)
+
+
+def retry_values(now):
+    """
+    The columns `renewal_failed()` sets, as expressions for a bulk UPDATE. The delay is picked
+    from `retry_attempts` with a CASE that has one branch for each step below the maximum.
+    """
+    base, factor, maximum = policy()
+    whens = []
+    attempt = 1
+    while delay(attempt) < timedelta(seconds=maximum) and factor > 1 and base > 0:
+        whens.append(When(retry_attempts=attempt - 1, then=Value(now + delay(attempt))))
+        attempt += 1
+    return {
+        "retry_attempts": F("retry_attempts") + 1,
+        "next_retry_at": Case(*whens, default=Value(now + delay(attempt))),
+    }
@@ -0,0 +1,236 @@
+from itertools import islice
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cache, counters, history, outbox, schedule
+from .states import SubscriptionState as State
+from .sweeps import chunk_size, sweep
+
+__all__ = ["bulk_add", "bulk_transition"]
+
+"""
+Set-based execution of a transition over a queryset, and set-based creation.
+
+Rather than loading each subscription and calling the transition method, every
+chunk of candidates is moved with a single UPDATE guarded by the transition's
+source states, its history is written with a single StateLog (or StateChange, see
+subscriptions.history) bulk_create, and a single bulk signal is sent with the list
+of moved pks. `bulk_add` creates subscriptions the same way, a batch at a time.
+
+Usage:
+
+    bulk_transition(
+        Subscription.objects.renewals_due(),
+        Subscription.renew,
+        signals.bulk_subscription_due,
+        values={"reason": ""},
+    )
+    bulk_add(Subscription, ((start, end, reference) for ... in ...))
+"""
+
+
+def transition_spec(transition_method):
+    """
+    Returns the (field, sources, target) declared by the @transition decorator.
+    """
+    meta = transition_method._django_fsm
+    targets = {t.target for t in meta.transitions.values()}
+    if len(targets) != 1:
+        raise ValueError("{} must have exactly one target state".format(transition_method.__name__))
+    target = targets.pop()
+    sources = [source for source in meta.transitions if source not in ("*", "+")]
+    if not sources or target in sources:
+        raise ValueError(
+            "{} must move subscriptions out of its source states".format(transition_method.__name__)
+        )
+    return meta.field, sources, target
+
+
+def write_history(model, rows, transition, target, timestamp, description=None):
+    """
+    Writes one StateLog (or StateChange) per (pk, source) row with a single bulk_create.
+    """
+    from django_fsm_log.models import StateLog
+
+    if history.enabled():
+        StateChange = apps.get_model("subscriptions", "StateChange")
+        history.write(
+            [
+                StateChange(
+                    subscription_id=pk,
+                    timestamp=timestamp,
+                    source_state=target if source is None else source,
+                    state=target,
+                    transition=transition,
+                    description=description,
+                )
+                for pk, source in rows
+            ]
+        )
+        return
+    content_type = ContentType.objects.get_for_model(model)
+    StateLog.objects.bulk_create(
+        [
+            StateLog(
+                timestamp=timestamp,
+                source_state=None if source is None else int(source),
+                state=int(target),
+                transition=transition,
+                content_type=content_type,
+                object_id=pk,
+                description=description,
+            )
+            for pk, source in rows
+        ]
+    )
+
+
+def bulk_transition(
+    queryset,
+    transition_method,
+    signal,
+    values=None,
+    description=None,
+    size=None,
+    name=None,
+    workers=None,
+    throttle=None,
+):
+    """
+    Moves every subscription in `queryset` through `transition_method` in chunks of `size`,
+    and returns the number of subscriptions moved.
+
+    Only rows still in one of the transition's source states are updated, so rows that
+    changed state between the read and the write are skipped, exactly as the transition
+    method would refuse them. `values` are the extra columns the transition method would
+    have set. `signal` is sent once per chunk with `pks` after the chunk has committed, or is
+    queued in the outbox with the chunk. `name`, `workers` and `throttle` are passed on to
+    `subscriptions.sweeps.sweep`.
+    """
+    field, sources, target = transition_spec(transition_method)
+    model = queryset.model
+    candidates = queryset.filter(**{"{}__in".format(field.name): sources})
+    values = dict(values or {}, **{field.name: target})
+
+    def process(rows):
+        now = timezone.now()
+        pks = [pk for pk, _ in rows]
+        updated = model._base_manager.filter(
+            pk__in=pks, **{"{}__in".format(field.name): sources}
+        ).update(last_updated=now, **values)
+        if updated != len(rows):
+            # Without row locks a concurrent transition can win the race. Keep only the
+            # rows carrying our stamp so history and signals match what was written.
+            stamped = set(
+                model._base_manager.filter(
+                    pk__in=pks, last_updated=now, **{field.name: target}
+                ).values_list("pk", flat=True)
+            )
+            rows = [(pk, source) for pk, source in rows if pk in stamped]
+            pks = [pk for pk, _ in rows]
+        schedule.refresh(model._base_manager.filter(pk__in=pks))
+        write_history(model, rows, transition_method.__name__, target, now, description)
+        if counters.enabled():
+            deltas = {target: len(rows)}
+            for _, source in rows:
+                deltas[source] = deltas.get(source, 0) - 1
+            counters.change(deltas)
+        cache.invalidate_pks(pks)
+        if pks:
+            outbox.send_on_commit(signal, model, pks)
+        return len(pks)
+
+    return sweep(name, candidates, process, size, workers=workers, throttle=throttle)
+
+
+def bulk_add(model, rows, size=None, skip_existing=False, signal=None):
+    """
+    Creates a subscription for every (start, end, reference) in `rows`, which may be a
+    generator, and returns the number created.
+
+    Rows are read and inserted `size` at a time (`SUBSCRIPTIONS_CHUNK_SIZE` by default), each
+    batch in its own transaction with a single bulk_create for the subscriptions and another
+    for their history, so memory use doesn't grow with the input. With `skip_existing`, rows
+    whose reference already has a subscription, or appeared earlier in `rows`, are skipped.
+    `signal` is sent once per batch with `pks`, like the bulk triggers' signals.
+
+    On databases that can't return the pks of a bulk insert, they are read back by reference
+    from the rows inserted after the batch's. Subscriptions with the same references inserted
+    by a concurrent transaction at the same time can then be counted (and signalled) as part of
+    the batch.
+    """
+    size = size or chunk_size()
+    using = router.db_for_write(model)
+    rows = iter(rows)
+    count = 0
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return count
+        with transaction.atomic(using=using):
+            count += add_batch(model, batch, using, skip_existing, signal)
+
+
+def returns_pks(using):
+    # type: (str) -> bool
+    """
+    Whether bulk_create sets the pks of the objects it inserts on `using`.
+    """
+    features = connections[using].features
+    # Named can_return_ids_from_bulk_insert before Django 3.0
+    return getattr(
+        features,
+        "can_return_rows_from_bulk_insert",
+        getattr(features, "can_return_ids_from_bulk_insert", False),
+    )
+
+
+def add_batch(model, batch, using, skip_existing, signal):
+    manager = model._base_manager.using(using)
+    if skip_existing:
+        # Earlier batches have been inserted by now, so this also skips their references.
+        taken = set(
+            manager.filter(reference__in=[reference for _, _, reference in batch]).values_list(
+                "reference", flat=True
+            )
+        )
+        unique = []
+        for start, end, reference in batch:
+            if reference not in taken:
+                taken.add(reference)
+                unique.append((start, end, reference))
+        batch = unique
+    if not batch:
+        return 0
+
+    now = timezone.now()
+    subscriptions = [
+        model(state=State.ACTIVE, start=start, end=end, reference=reference, reason="")
+        for start, end, reference in batch
+    ]
+    if returns_pks(using):
+        manager.bulk_create(subscriptions)
+        pks = [subscription.pk for subscription in subscriptions]
+    else:
+        # The pks aren't returned, so read back the rows with these references that were
+        # inserted after the highest pk, at most one per subscription inserted. Concurrent
+        # inserts of the same references (and only those) could be mistaken for ours.
+        highest = manager.aggregate(highest=Max("pk"))["highest"] or 0
+        manager.bulk_create(subscriptions)
+        pks = list(
+            manager.filter(pk__gt=highest, reference__in=[reference for _, _, reference in batch])
+            .order_by("pk")
+            .values_list("pk", flat=True)[: len(subscriptions)]
+        )
+
+    write_history(model, [(pk, None) for pk in pks], "add_subscription", State.ACTIVE, now)
+    if counters.enabled():
+        counters.change({State.ACTIVE: len(pks)})
+    cache.invalidate([reference for _, _, reference in batch], using=using)
+    if signal is not None and pks:
+        outbox.send_on_commit(signal, model, pks, using=using)
+    return len(pks)
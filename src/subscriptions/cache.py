@@ -0,0 +1,256 @@
+import hashlib
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import metrics
+from .states import SubscriptionState as State
+
+__all__ = ["invalidate", "is_subscribed", "subscribed"]
+
+"""
+A read-through cache of whether a reference has a live (ACTIVE or EXPIRING) subscription.
+
+Enabled by pointing `settings.SUBSCRIPTIONS_CACHE` at one of the `CACHES`. Lookups check the
+shared cache, and then the database, filling in the cache as they go. Whenever a subscription is saved, transitioned or deleted, its references
+are replaced by a short lived tombstone in the LRU of this process and in the shared cache,
+once the transaction commits. Lookups only ever fill a tier with `add`, which leaves a
+tombstone in place, so a lookup that read the database before the transaction committed can't
+write its stale answer back afterwards. References are read from the database until their
+tombstone expires.
+
+`SUBSCRIPTIONS_CACHE_LOCAL_SIZE` adds a small in-process LRU in front of the shared cache,
+which is off by default. Other processes only learn of a change through the shared cache, so
+with it on, their LRU can serve the old answer for up to `SUBSCRIPTIONS_CACHE_LOCAL_TIMEOUT`
+seconds (1 by default) after a transition commits.
+
+Usage:
+
+    Subscription.objects.is_subscribed("customer-1")
+    Subscription.objects.subscribed(["customer-1", "customer-2"])
+"""
+
+
+LIVE_STATES = (State.ACTIVE, State.EXPIRING)
+DEFAULT_TIMEOUT = 300
+# The LRU can serve stale answers, so it has to be asked for.
+DEFAULT_LOCAL_SIZE = 0
+DEFAULT_LOCAL_TIMEOUT = 1
+# Outlives any lookup that was reading the database as the invalidating transaction committed.
+TOMBSTONE_TIMEOUT = 30
+TOMBSTONE = "invalidated"
+
+
+def cache_alias():
+    # type: () -> t.Optional[str]
+    return getattr(settings, "SUBSCRIPTIONS_CACHE", None)
+
+
+def timeout():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+class LocalCache:
+    """
+    A thread safe LRU of at most `size` entries, each expiring `timeout` seconds after it was
+    set.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                value, expires = entry
+                if expires <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values, timeout=None):
+        self.store(values, timeout, replace=True)
+
+    def add_many(self, values):
+        """
+        Like `set_many`, but leaves the keys that already have an entry alone.
+        """
+        self.store(values, None, replace=False)
+
+    def store(self, values, timeout, replace):
+        if not self.size:
+            return
+        now = time.monotonic()
+        expires = now + (self.timeout if timeout is None else timeout)
+        with self.lock:
+            for key, value in values.items():
+                entry = self.entries.get(key)
+                if not replace and entry is not None and entry[1] > now:
+                    continue
+                self.entries[key] = (value, expires)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+_local = None
+
+
+def local_cache():
+    # type: () -> LocalCache
+    global _local
+    if _local is None:
+        _local = LocalCache(
+            getattr(settings, "SUBSCRIPTIONS_CACHE_LOCAL_SIZE", DEFAULT_LOCAL_SIZE),
+            getattr(settings, "SUBSCRIPTIONS_CACHE_LOCAL_TIMEOUT", DEFAULT_LOCAL_TIMEOUT),
+        )
+    return _local
+
+
+@receiver(setting_changed)
+def reset_local_cache(setting, **kwargs):
+    global _local
+    if setting.startswith("SUBSCRIPTIONS_CACHE"):
+        _local = None
+
+
+def cache_key(reference):
+    digest = hashlib.md5(reference.encode("utf-8")).hexdigest()
+    return "subscriptions:subscribed:{}".format(digest)
+
+
+def count(name, value, **tags):
+    backend = metrics.get_backend()
+    if backend.enabled and value:
+        backend.increment(name, value, tags)
+
+
+def lookup(queryset, references):
+    """
+    Returns the set of `references` with a live subscription in `queryset`.
+    """
+    return set(
+        queryset.for_references(references)
+        .filter(state__in=LIVE_STATES)
+        .order_by()
+        .values_list("reference", flat=True)
+        .distinct()
+    )
+
+
+def present(values):
+    return {key: value for key, value in values.items() if value != TOMBSTONE}
+
+
+def subscribed(queryset, references):
+    """
+    Returns {reference: whether it has a live subscription} for every one of `references`.
+    """
+    references = set(references)
+    alias = cache_alias()
+    if alias is None:
+        live = lookup(queryset, references)
+        return {reference: reference in live for reference in references}
+
+    keys = {cache_key(reference): reference for reference in references}
+    local = local_cache()
+    found = present(local.get_many(keys))
+    count("subscriptions.cache.hit", len(found), tier="local")
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        shared = present(caches[alias].get_many(missing))
+        count("subscriptions.cache.hit", len(shared), tier="shared")
+        local.add_many(shared)
+        found.update(shared)
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        count("subscriptions.cache.miss", len(missing))
+        subscribed = lookup(queryset, [keys[key] for key in missing])
+        loaded = {key: keys[key] in subscribed for key in missing}
+        shared = caches[alias]
+        local.add_many(
+            {key: value for key, value in loaded.items() if shared.add(key, value, timeout())}
+        )
+        found.update(loaded)
+
+    return {reference: found[key] for key, reference in keys.items()}
+
+
+def is_subscribed(queryset, reference):
+    # type: (...) -> bool
+    return subscribed(queryset, [reference])[reference]
+
+
+def invalidate(references, using=None):
+    """
+    Tombstones `references` in this process and in the shared cache, once the transaction
+    commits.
+    """
+    alias = cache_alias()
+    if alias is None:
+        return
+    keys = [cache_key(reference) for reference in set(references) if reference is not None]
+    if not keys:
+        return
+
+    def forget():
+        tombstones = dict.fromkeys(keys, TOMBSTONE)
+        local_cache().set_many(tombstones, TOMBSTONE_TIMEOUT)
+        caches[alias].set_many(tombstones, TOMBSTONE_TIMEOUT)
+
+    transaction.on_commit(forget, using=using)
+
+
+def invalidate_pks(pks, using=None):
+    if cache_alias() is None:
+        return
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    invalidate(
+        Subscription._base_manager.using(using)
+        .filter(pk__in=pks)
+        .values_list("reference", flat=True),
+        using=using,
+    )
+
+
+def transitioning(sender, instance, **kwargs):
+    # renewed() can change the reference, so remember the one the transition started with.
+    if cache_alias() is not None:
+        instance._reference_before_transition = instance.reference
+
+
+def saved(sender, instance, using=None, **kwargs):
+    invalidate(
+        [instance.reference, instance.__dict__.pop("_reference_before_transition", None)],
+        using=using,
+    )
+
+
+def deleted(sender, instance, using=None, **kwargs):
+    invalidate([instance.reference], using=using)
@@ -0,0 +1,141 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import replicas
+from .states import SubscriptionState as State
+
+__all__ = ["buffered", "change", "enabled", "reconcile", "saving", "state_counts"]
+
+"""
+Counts of subscriptions per state, maintained as subscriptions change.
+
+With `settings.SUBSCRIPTIONS_STATE_COUNTS = True`, the StateCount table holds one row per
+state. Transitions (including bulk transitions), creates and deletes add their deltas to
+it, so that "how many subscriptions are SUSPENDED" is a primary key lookup instead of a
+scan of the subscription table. A transition's delta is written in the same transaction as the
+save in its post transition hook.
+
+Inside `buffered()`, which wraps every chunk of a trigger, deltas are added up and written
+at the end of the chunk, in the chunk's transaction, with at most one UPDATE per state.
+Counts can drift when subscriptions are changed without signals (eg: `bulk_create` or
+`QuerySet.update`). `reconcile()` recounts them from scratch.
+"""
+
+
+_deltas = ContextVar("subscriptions_state_count_deltas", default=None)
+
+
+def enabled():
+    # type: () -> bool
+    return getattr(settings, "SUBSCRIPTIONS_STATE_COUNTS", False)
+
+
+@contextmanager
+def buffered():
+    """
+    Adds up the deltas made inside the block, and writes them when it exits without an error.
+    """
+    if not enabled() or _deltas.get() is not None:
+        yield
+        return
+    deltas = Counter()
+    token = _deltas.set(deltas)
+    try:
+        yield
+    finally:
+        _deltas.reset(token)
+    write(deltas)
+
+
+def change(deltas):
+    """
+    Adds `deltas`, a mapping of state to the change in its count.
+    """
+    pending = _deltas.get()
+    if pending is not None:
+        pending.update(deltas)
+        return
+    write(deltas)
+
+
+def write(deltas):
+    StateCount = apps.get_model("subscriptions", "StateCount")
+    # Always in state order, so that concurrent writers lock the rows in the same order.
+    for state, delta in sorted(deltas.items()):
+        if delta and not StateCount.objects.filter(state=state).update(count=F("count") + delta):
+            StateCount.objects.create(state=state, count=delta)
+
+
+def state_counts():
+    # type: () -> dict
+    """
+    Returns the number of subscriptions in each state, from the StateCount table.
+    """
+    StateCount = apps.get_model("subscriptions", "StateCount")
+    counts = dict.fromkeys(State, 0)
+    rows = replicas.reading(StateCount.objects.values_list())
+    counts.update((State(state), count) for state, count in rows)
+    return counts
+
+
+def reconcile():
+    """
+    Recounts every state from the subscription table, and returns the new counts.
+
+    The StateCount rows are locked first, so transitions that commit while the subscriptions
+    are being counted wait, and then apply their deltas to the new counts.
+    """
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    StateCount = apps.get_model("subscriptions", "StateCount")
+    with transaction.atomic():
+        list(StateCount.objects.select_for_update().order_by("state"))
+        counts = dict.fromkeys(State, 0)
+        counts.update(
+            (State(row["state"]), row["count"])
+            for row in Subscription._base_manager.order_by()
+            .values("state")
+            .annotate(count=Count("pk"))
+        )
+        for state, count in counts.items():
+            StateCount.objects.update_or_create(state=state, defaults={"count": count})
+    return counts
+
+
+def transitioning(sender, instance, name, source, target, **kwargs):
+    # Remembered until the post transition hook saves the transition, see `saving()`. An
+    # unsaved subscription is counted in its state by `created()` instead.
+    if enabled() and not instance._state.adding and target is not None and source != target:
+        instance._state_count_deltas = {source: -1, target: 1}
+
+
+@contextmanager
+def saving(instance):
+    """
+    Adds the delta of the transition `instance` has just made, in the same transaction as the
+    block, which saves it.
+    """
+    deltas = instance.__dict__.pop("_state_count_deltas", None)
+    if deltas is None or _deltas.get() is not None:
+        yield
+        if deltas is not None:
+            change(deltas)
+        return
+    with transaction.atomic(using=instance._state.db):
+        yield
+        write(deltas)
+
+
+def created(sender, instance, created, raw=False, **kwargs):
+    if enabled() and created and not raw:
+        change({instance.state: 1})
+
+
+def deleted(sender, instance, **kwargs):
+    if enabled():
+        change({instance.state: -1})
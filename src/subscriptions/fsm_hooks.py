@@ -1,5 +1,6 @@
 from functools import wraps
 
+from django.db.models.signals import class_prepared
 from django.dispatch import receiver
 from django_fsm.signals import post_transition as post_transition_signal
 
@@ -23,6 +24,7 @@ Usage:
 
 
 _POST_TRANSITION_IDENTIFIER = "_fsm_post_transition"
+_POST_TRANSITION_HOOKS = "_fsm_post_transition_hooks"
 
 
 def post_transition(transition_method):
@@ -42,18 +44,33 @@ def post_transition(transition_method):
     return inner_function
 
 
-@receiver(post_transition_signal)
+@receiver(class_prepared)
+def register_post_transition_hooks(sender, **kwargs):
+    """
+    Builds the table of transition name -> hook name for a model as soon as its class is
+    created, and only connects our receiver for models that have hooks.
+
+    This runs while the models module is imported, so the receiver is still connected before
+    django_fsm_log's, and hooks run (and save) before the StateLog is written.
+    """
+    hooks = {}
+    for klass in reversed(sender.__mro__):
+        for name, attr in vars(klass).items():
+            hook_name = getattr(attr, _POST_TRANSITION_IDENTIFIER, None)
+            if hook_name is not None and hasattr(attr, "_django_fsm"):
+                hooks[name] = hook_name
+    if hooks:
+        setattr(sender, _POST_TRANSITION_HOOKS, hooks)
+        post_transition_signal.connect(post_transition_handler, sender=sender)
+
+
 def post_transition_handler(sender, instance, name, source, target, **kwargs):
     """
-    Identifies the hook linked to the transition method, and calls it with no
-    arguments.
+    Calls the hook linked to the transition method with no arguments.
 
     The transition has **not** been saved at this point.
     """
-    transition_method = getattr(instance, name)
-    try:
-        post_hook_name = getattr(transition_method, _POST_TRANSITION_IDENTIFIER)
-    except AttributeError:
-        return
-    post_func = getattr(instance, post_hook_name)
-    post_func()
+    post_hook_name = getattr(sender, _POST_TRANSITION_HOOKS).get(name)
+    if post_hook_name is not None:
+        # Looked up on the instance, so that overrides and mocks of the hook are respected.
+        getattr(instance, post_hook_name)()
@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+__all__ = ["buffered", "enabled", "record"]
+
+"""
+A compact transition history for subscriptions, as an alternative to django_fsm_log.
+
+With `settings.SUBSCRIPTIONS_COMPACT_HISTORY = True`, every transition writes a StateChange
+row, with integer states and a direct foreign key to the subscription. Add the subscription
+model to `DJANGO_FSM_LOG_IGNORED_MODELS` so that it stops writing a StateLog as well:
+
+    DJANGO_FSM_LOG_IGNORED_MODELS = ["subscriptions.models.Subscription"]
+
+Inside `buffered()`, which wraps every chunk of a trigger, the rows are collected and
+written with a single bulk_create at the end of the chunk, in the chunk's transaction.
+"""
+
+
+_buffer = ContextVar("subscriptions_history_buffer", default=None)
+
+
+def enabled():
+    # type: () -> bool
+    return getattr(settings, "SUBSCRIPTIONS_COMPACT_HISTORY", False)
+
+
+@contextmanager
+def buffered():
+    """
+    Collects the history written inside the block, and writes it all at once when the block
+    exits without an error.
+    """
+    if not enabled() or _buffer.get() is not None:
+        yield
+        return
+    changes = []
+    token = _buffer.set(changes)
+    try:
+        yield
+    finally:
+        _buffer.reset(token)
+    if changes:
+        StateChange = apps.get_model("subscriptions", "StateChange")
+        StateChange.objects.bulk_create(changes)
+
+
+def write(changes):
+    pending = _buffer.get()
+    if pending is not None:
+        pending.extend(changes)
+        return
+    StateChange = apps.get_model("subscriptions", "StateChange")
+    StateChange.objects.bulk_create(changes)
+
+
+def record(sender, instance, name, source, target, **kwargs):
+    """
+    Receives django_fsm's post_transition, after the transition has been saved.
+    """
+    if not enabled() or target is None:
+        return
+    from django_fsm_log.helpers import FSMLogDescriptor
+
+    StateChange = apps.get_model("subscriptions", "StateChange")
+    change = StateChange(
+        subscription_id=instance.pk,
+        timestamp=timezone.now(),
+        source_state=source,
+        state=target,
+        transition=name,
+    )
+    for attr in ("by", "description"):
+        try:
+            setattr(change, attr, FSMLogDescriptor(instance, attr).get())
+        except AttributeError:
+            pass
+    write([change])
@@ -0,0 +1,32 @@
+from django.db import models
+
+__all__ = ["StateIndex"]
+
+
+class StateIndex(models.Index):
+    """
+    An index over `fields` that only covers subscriptions in `states`, for the trigger queries
+    that never look at the other states.
+
+    Backends that support partial indexes get `fields` WHERE state IN `states`, which stays
+    small however many subscriptions are in the other states. Other backends get a plain index
+    over `fields` instead. SQLite is treated as the latter, because it only uses a partial index
+    when the query spells out the literal values, and Django binds parameters.
+    """
+
+    def __init__(self, *, states, fields, name, **kwargs):
+        self.states = list(states)
+        super().__init__(fields=fields, name=name, **kwargs)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs["states"] = self.states
+        return "subscriptions.indexes.StateIndex", args, kwargs
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        connection = schema_editor.connection
+        condition = None
+        if connection.features.supports_partial_indexes and connection.vendor != "sqlite":
+            condition = models.Q(state__in=self.states)
+        index = models.Index(fields=self.fields, name=self.name, condition=condition)
+        return index.create_sql(model, schema_editor, using=using, **kwargs)
@@ -0,0 +1,63 @@
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+__all__ = ["default_owner", "duration", "expiry", "release", "take", "values"]
+
+"""
+Leases on RENEWING subscriptions.
+
+`renew()` takes a lease on the subscription: it records who is renewing it in `lease_owner`,
+and until when in the indexed `lease_expires`, `SUBSCRIPTIONS_LEASE_SECONDS` (15 minutes
+by default) from now. A renewal that takes longer extends its lease, with a single UPDATE that
+doesn't touch the rest of the row:
+
+    subscription.extend_lease()
+
+`trigger_stuck` (and `tick`) then only reclaim subscriptions whose lease has expired, so a
+crashed renewal is recovered as soon as its lease runs out, and a slow renewal that keeps
+extending its lease is left alone. Subscriptions that were moved to RENEWING without a lease
+(before leases existed, or by a `QuerySet.update()`) are still judged by `last_updated`.
+Leaving RENEWING releases the lease.
+"""
+
+
+DEFAULT_SECONDS = 15 * 60
+
+
+def duration():
+    # type: () -> timedelta
+    return timedelta(seconds=getattr(settings, "SUBSCRIPTIONS_LEASE_SECONDS", DEFAULT_SECONDS))
+
+
+def default_owner():
+    # type: () -> str
+    return "{}:{}".format(socket.gethostname(), os.getpid())[:100]
+
+
+def expiry(now=None, seconds=None):
+    now = now or timezone.now()
+    return now + (duration() if seconds is None else timedelta(seconds=seconds))
+
+
+def take(subscription, owner=None, now=None):
+    subscription.lease_owner = owner or default_owner()
+    subscription.lease_expires = expiry(now)
+
+
+def release(subscription):
+    subscription.lease_owner = ""
+    subscription.lease_expires = None
+
+
+def values(now):
+    """
+    The columns `renew()` sets, for a bulk UPDATE.
+    """
+    return {"lease_owner": default_owner(), "lease_expires": expiry(now)}
+
+
+RELEASED = {"lease_owner": "", "lease_expires": None}
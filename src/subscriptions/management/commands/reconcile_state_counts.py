@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from subscriptions import counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the subscriptions in each state into the StateCount table."
+
+    def handle(self, *args, **options):
+        for state, count in sorted(counters.reconcile().items()):
+            self.stdout.write("{}: {}".format(state.name, count))
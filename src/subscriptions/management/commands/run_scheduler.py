@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from subscriptions import schedule
+
+
+class Command(BaseCommand):
+    help = "Moves subscriptions through their triggers as they become due, until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reschedule",
+            action="store_true",
+            help="Recompute when every subscription is next due before starting.",
+        )
+
+    def handle(self, *args, **options):
+        if options["reschedule"]:
+            self.stdout.write("Rescheduled {} subscriptions".format(schedule.reschedule()))
+        try:
+            schedule.run()
+        except KeyboardInterrupt:
+            pass
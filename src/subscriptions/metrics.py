@@ -0,0 +1,211 @@
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+__all__ = [
+    "MetricsBackend",
+    "PrometheusBackend",
+    "StatsdBackend",
+    "get_backend",
+    "instrument",
+    "timer",
+]
+
+"""
+Timings for transitions and sweeps, reported to a pluggable backend.
+
+The backend is configured with `settings.SUBSCRIPTIONS_METRICS_BACKEND`, a dotted path to
+a `MetricsBackend` subclass. By default nothing is measured at all.
+
+Every transition reports:
+
+    subscriptions.transition            total time, including the post transition hook
+    subscriptions.transition.db         time spent running queries
+    subscriptions.transition.statelog   time spent writing the StateLog
+    subscriptions.transition.receivers  time spent in signal receivers
+    subscriptions.transition.queries    number of queries
+
+tagged with `transition`. Every sweep chunk reports `subscriptions.sweep.chunk`,
+`subscriptions.sweep.rows` and, once it commits, `subscriptions.sweep.receivers` (the time
+spent sending the signals of its transitions, which the transitions themselves don't
+include), tagged with `sweep`. Every signal sent reports `subscriptions.signal`, tagged with
+`signal`.
+"""
+
+
+class MetricsBackend:
+    """
+    Discards everything. Subclasses override `timing` and `increment`.
+    """
+
+    enabled = False
+
+    def timing(self, name, seconds, tags):
+        pass
+
+    def increment(self, name, value, tags):
+        pass
+
+
+class StatsdBackend(MetricsBackend):
+    """
+    Reports to statsd, appending tag values to the metric name, eg:
+    `subscriptions.transition.renew`. Requires the `statsd` package unless a client with
+    `timing(name, ms)` and `incr(name, count)` methods is given.
+    """
+
+    enabled = True
+
+    def __init__(self, client=None):
+        if client is None:
+            from statsd import StatsClient
+
+            client = StatsClient()
+        self.client = client
+
+    def name(self, name, tags):
+        return ".".join([name] + [str(value) for _, value in sorted(tags.items())])
+
+    def timing(self, name, seconds, tags):
+        self.client.timing(self.name(name, tags), seconds * 1000)
+
+    def increment(self, name, value, tags):
+        self.client.incr(self.name(name, tags), value)
+
+
+class PrometheusBackend(MetricsBackend):
+    """
+    Reports timings as histograms named eg: `subscriptions_transition_seconds`, and counts
+    as counters named eg: `subscriptions_transition_queries_total`, labelled with the tags.
+    Requires the `prometheus_client` package.
+    """
+
+    enabled = True
+
+    def __init__(self, registry=None):
+        import prometheus_client
+
+        self.prometheus = prometheus_client
+        self.registry = registry or prometheus_client.REGISTRY
+        self.metrics = {}
+
+    def metric(self, kind, name, tags):
+        key = (kind, name)
+        if key not in self.metrics:
+            cls = self.prometheus.Histogram if kind == "seconds" else self.prometheus.Counter
+            metric_name = "{}_{}".format(re.sub(r"\W", "_", name), kind)
+            self.metrics[key] = cls(
+                metric_name, name, labelnames=sorted(tags), registry=self.registry
+            )
+        metric = self.metrics[key]
+        return metric.labels(**tags) if tags else metric
+
+    def timing(self, name, seconds, tags):
+        self.metric("seconds", name, tags).observe(seconds)
+
+    def increment(self, name, value, tags):
+        self.metric("total", name, tags).inc(value)
+
+
+_backend = None
+
+
+def get_backend():
+    # type: () -> MetricsBackend
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "SUBSCRIPTIONS_METRICS_BACKEND", None)
+        _backend = import_string(path)() if path else MetricsBackend()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == "SUBSCRIPTIONS_METRICS_BACKEND":
+        _backend = None
+
+
+@contextmanager
+def timer(name, **tags):
+    backend = get_backend()
+    if not backend.enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        backend.timing(name, time.perf_counter() - started, tags)
+
+
+class Measurement:
+    """
+    Accumulates where the time goes during a single transition.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.statelog = 0.0
+        self.receivers = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            if "django_fsm_log_statelog" in sql:
+                self.statelog += elapsed
+
+
+_measurement = ContextVar("subscriptions_measurement", default=None)
+
+
+def record_receivers(seconds):
+    measurement = _measurement.get()
+    if measurement is not None:
+        measurement.receivers += seconds
+
+
+def instrument(transition_method):
+    """
+    Reports metrics for every call to `transition_method`. Must be the outermost decorator,
+    so that the post transition hook and the StateLog write are included.
+    """
+
+    @wraps(transition_method)
+    def instrumented(instance, *args, **kwargs):
+        backend = get_backend()
+        if not backend.enabled:
+            return transition_method(instance, *args, **kwargs)
+
+        measurement = Measurement()
+        token = _measurement.set(measurement)
+        connection = connections[instance._state.db or DEFAULT_DB_ALIAS]
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(measurement):
+                return transition_method(instance, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _measurement.reset(token)
+            tags = {"transition": transition_method.__name__}
+            backend.timing("subscriptions.transition", elapsed, tags)
+            backend.timing("subscriptions.transition.db", measurement.db, tags)
+            backend.timing("subscriptions.transition.statelog", measurement.statelog, tags)
+            backend.timing("subscriptions.transition.receivers", measurement.receivers, tags)
+            backend.increment("subscriptions.transition.queries", measurement.queries, tags)
+
+    return instrumented
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0003_stateorder"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SweepCursor",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        help_text="The name of the sweep",
+                        max_length=100,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "last_updated",
+                    models.DateTimeField(
+                        help_text="last_updated of the last subscription processed by the sweep"
+                    ),
+                ),
+                (
+                    "last_id",
+                    models.IntegerField(
+                        help_text="id of the last subscription processed by the sweep"
+                    ),
+                ),
+                (
+                    "updated",
+                    models.DateTimeField(
+                        auto_now=True, help_text="Keeps track of when the cursor was last moved"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:18
+
+from django.db import migrations
+import subscriptions.indexes
+import subscriptions.states
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0004_sweepcursor"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="subscription",
+            index=subscriptions.indexes.StateIndex(
+                fields=["state", "last_updated", "end"],
+                name="subscription_trigger_idx",
+                states=[
+                    subscriptions.states.SubscriptionState["ACTIVE"],
+                    subscriptions.states.SubscriptionState["EXPIRING"],
+                    subscriptions.states.SubscriptionState["RENEWING"],
+                    subscriptions.states.SubscriptionState["SUSPENDED"],
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0005_trigger_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SignalEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "signal",
+                    models.CharField(help_text="The name of the signal to send", max_length=50),
+                ),
+                (
+                    "pks",
+                    models.TextField(
+                        blank=True, help_text="The JSON list of pks sent by a bulk signal"
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "available",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="When the signal may next be sent. Empty once delivery has been abandoned",
+                        null=True,
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=0, help_text="Failed attempts to send"),
+                ),
+                (
+                    "last_error",
+                    models.TextField(blank=True, help_text="The last error raised by a receiver"),
+                ),
+                (
+                    "subscription",
+                    models.ForeignKey(
+                        help_text="The sender of the signal, unless it is a bulk signal",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="subscriptions.subscription",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="signalevent",
+            index=models.Index(fields=["available", "id"], name="signalevent_available_idx"),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0006_signalevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedSubscription",
+            fields=[
+                (
+                    "id",
+                    models.IntegerField(
+                        help_text="The id of the subscription", primary_key=True, serialize=False
+                    ),
+                ),
+                (
+                    "state",
+                    models.IntegerField(
+                        choices=[
+                            (-1, "ERROR"),
+                            (1, "ACTIVE"),
+                            (2, "EXPIRING"),
+                            (3, "RENEWING"),
+                            (4, "SUSPENDED"),
+                            (5, "ENDED"),
+                        ],
+                        help_text="The final status",
+                    ),
+                ),
+                ("start", models.DateTimeField(help_text="When the subscription began")),
+                ("end", models.DateTimeField(help_text="When the subscription ended")),
+                (
+                    "reference",
+                    models.TextField(
+                        help_text="Free text field for user references", max_length=100
+                    ),
+                ),
+                (
+                    "last_updated",
+                    models.DateTimeField(help_text="When the subscription was last updated"),
+                ),
+                (
+                    "reason",
+                    models.TextField(help_text="Reason for the last state change, if applicable."),
+                ),
+                (
+                    "archived",
+                    models.DateTimeField(auto_now_add=True, help_text="When it was archived"),
+                ),
+            ],
+            options={
+                "get_latest_by": "start",
+            },
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("subscriptions", "0007_archivedsubscription"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StateChange",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("timestamp", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "source_state",
+                    models.IntegerField(
+                        choices=[
+                            (-1, "ERROR"),
+                            (1, "ACTIVE"),
+                            (2, "EXPIRING"),
+                            (3, "RENEWING"),
+                            (4, "SUSPENDED"),
+                            (5, "ENDED"),
+                        ]
+                    ),
+                ),
+                (
+                    "state",
+                    models.IntegerField(
+                        choices=[
+                            (-1, "ERROR"),
+                            (1, "ACTIVE"),
+                            (2, "EXPIRING"),
+                            (3, "RENEWING"),
+                            (4, "SUSPENDED"),
+                            (5, "ENDED"),
+                        ]
+                    ),
+                ),
+                ("transition", models.CharField(max_length=50)),
+                ("description", models.TextField(blank=True, null=True)),
+                (
+                    "by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "subscription",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="history",
+                        to="subscriptions.subscription",
+                    ),
+                ),
+            ],
+            options={
+                "get_latest_by": "timestamp",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="statechange",
+            index=models.Index(
+                fields=["subscription", "timestamp"], name="statechange_history_idx"
+            ),
+        ),
+    ]
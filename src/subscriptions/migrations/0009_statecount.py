@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_states(apps, schema_editor):
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    StateCount = apps.get_model("subscriptions", "StateCount")
+    counts = dict(Subscription.objects.order_by().values_list("state").annotate(count=Count("pk")))
+    StateCount.objects.bulk_create(
+        [StateCount(state=state, count=counts.get(state, 0)) for state in (-1, 1, 2, 3, 4, 5)]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0008_statechange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StateCount",
+            fields=[
+                (
+                    "state",
+                    models.IntegerField(
+                        choices=[
+                            (-1, "ERROR"),
+                            (1, "ACTIVE"),
+                            (2, "EXPIRING"),
+                            (3, "RENEWING"),
+                            (4, "SUSPENDED"),
+                            (5, "ENDED"),
+                        ],
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:36
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def check_references(apps, schema_editor):
+    # `reference` was a TextField, so nothing stopped longer values being saved. Refuse to
+    # migrate rather than have the database truncate (or reject) them half way through.
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    too_long = list(
+        Subscription.objects.annotate(length=Length("reference"))
+        .filter(length__gt=100)
+        .values_list("pk", flat=True)[:20]
+    )
+    if too_long:
+        raise ValueError(
+            "Subscriptions {} (and maybe others) have a reference longer than 100 characters. "
+            "Shorten them before running this migration.".format(too_long)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0009_statecount"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="subscription",
+            name="reference",
+            field=models.CharField(help_text="Free text field for user references", max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                fields=["reference"],
+                name="subscription_reference_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
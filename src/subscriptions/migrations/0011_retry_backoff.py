@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:40
+
+from django.db import migrations, models
+import subscriptions.indexes
+import subscriptions.states
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0010_reference_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscription",
+            name="next_retry_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When a SUSPENDED subscription is next due to be retried, see backoff",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="retry_attempts",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Renewals that have failed since the last successful one"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=subscriptions.indexes.StateIndex(
+                fields=["state", "next_retry_at"],
+                name="subscription_retry_idx",
+                states=[subscriptions.states.SubscriptionState["SUSPENDED"]],
+            ),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:42
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+import subscriptions.schedule
+from subscriptions.states import SubscriptionState as State
+
+
+def next_action_expression():
+    # A frozen copy of `schedule.next_action_expression()` as of this migration, which must
+    # only refer to the fields the model has at this point.
+    field = models.DateTimeField()
+    suspended = getattr(settings, "SUBSCRIPTIONS_SUSPENDED_TIMEOUT_HOURS", 48)
+    stuck = getattr(settings, "SUBSCRIPTIONS_STUCK_TIMEOUT_HOURS", 2)
+    return Case(
+        When(state__in=[State.ACTIVE, State.EXPIRING], then=F("end")),
+        When(
+            state=State.SUSPENDED,
+            then=Least(
+                Greatest(Coalesce("next_retry_at", "end"), "end"),
+                ExpressionWrapper(F("end") + timedelta(hours=suspended), output_field=field),
+            ),
+        ),
+        When(
+            state=State.RENEWING,
+            then=ExpressionWrapper(F("last_updated") + timedelta(hours=stuck), output_field=field),
+        ),
+        default=Value(None),
+        output_field=field,
+    )
+
+
+def reschedule(manager, expression, size=500):
+    bounds = manager.aggregate(first=models.Min("pk"), last=models.Max("pk"))
+    if bounds["first"] is None:
+        return
+    for first in range(bounds["first"], bounds["last"] + 1, size):
+        manager.filter(pk__gte=first, pk__lt=first + size).update(next_action_at=expression)
+
+
+def schedule_subscriptions(apps, schema_editor):
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    reschedule(Subscription._base_manager, next_action_expression())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0011_retry_backoff"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscription",
+            name="next_action_at",
+            field=subscriptions.schedule.NextActionField(
+                editable=False,
+                help_text="When the next trigger is due for this subscription, see schedule",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(fields=["next_action_at"], name="subscription_next_action_idx"),
+        ),
+        migrations.RunPython(schedule_subscriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:47
+
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+import subscriptions.indexes
+import subscriptions.states
+from subscriptions.states import SubscriptionState as State
+
+
+def next_action_expression():
+    # A frozen copy of `schedule.next_action_expression()` as of this migration, which must
+    # only refer to the fields the model has at this point.
+    field = models.DateTimeField()
+    suspended = getattr(settings, "SUBSCRIPTIONS_SUSPENDED_TIMEOUT_HOURS", 48)
+    stuck = getattr(settings, "SUBSCRIPTIONS_STUCK_TIMEOUT_HOURS", 2)
+    return Case(
+        When(state__in=[State.ACTIVE, State.EXPIRING], then=F("end")),
+        When(
+            state=State.SUSPENDED,
+            then=Least(
+                Greatest(Coalesce("next_retry_at", "end"), "end"),
+                ExpressionWrapper(F("end") + timedelta(hours=suspended), output_field=field),
+            ),
+        ),
+        When(
+            state=State.RENEWING,
+            then=Coalesce(
+                "lease_expires",
+                ExpressionWrapper(F("last_updated") + timedelta(hours=stuck), output_field=field),
+            ),
+        ),
+        default=Value(None),
+        output_field=field,
+    )
+
+
+def schedule_subscriptions(apps, schema_editor):
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    reschedule = import_module("subscriptions.migrations.0012_next_action").reschedule
+    reschedule(Subscription._base_manager, next_action_expression())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0012_next_action"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscription",
+            name="lease_expires",
+            field=models.DateTimeField(
+                blank=True, help_text="When the renewal is considered stuck, see leases", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="lease_owner",
+            field=models.CharField(
+                blank=True, help_text="Who is renewing a RENEWING subscription", max_length=100
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=subscriptions.indexes.StateIndex(
+                fields=["state", "lease_expires"],
+                name="subscription_lease_idx",
+                states=[subscriptions.states.SubscriptionState["RENEWING"]],
+            ),
+        ),
+        migrations.RunPython(schedule_subscriptions, migrations.RunPython.noop),
+    ]
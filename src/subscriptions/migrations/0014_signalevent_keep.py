@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0013_lease"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="signalevent",
+            name="subscription",
+            field=models.ForeignKey(
+                db_constraint=False,
+                help_text="The sender of the signal, unless it is a bulk signal",
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="subscriptions.subscription",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:11
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def check_references(apps, schema_editor):
+    # Subscriptions archived before 0010_reference_index can have references longer than 100
+    # characters. Refuse to migrate rather than have the database truncate (or reject) them.
+    ArchivedSubscription = apps.get_model("subscriptions", "ArchivedSubscription")
+    too_long = list(
+        ArchivedSubscription.objects.annotate(length=Length("reference"))
+        .filter(length__gt=100)
+        .values_list("pk", flat=True)[:20]
+    )
+    if too_long:
+        raise ValueError(
+            "Archived subscriptions {} (and maybe others) have a reference longer than 100 "
+            "characters. Shorten them before running this migration.".format(too_long)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0014_signalevent_keep"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="archivedsubscription",
+            name="reference",
+            field=models.CharField(
+                db_index=True, help_text="Free text field for user references", max_length=100
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:19
+
+from django.db import migrations
+import subscriptions.indexes
+import subscriptions.states
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0015_archived_reference"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="subscription",
+            name="subscription_lease_idx",
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=subscriptions.indexes.StateIndex(
+                fields=["state", "lease_expires", "last_updated"],
+                name="subscription_lease_idx",
+                states=[subscriptions.states.SubscriptionState["RENEWING"]],
+            ),
+        ),
+    ]
@@ -1,16 +1,42 @@
+import copy
+import functools
 import typing as t
 from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.db import models
-from django.db.models.expressions import ExpressionWrapper as E
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django_fsm import FSMIntegerField, can_proceed, transition
+from django_fsm.signals import post_transition as post_transition_signal
+from django_fsm.signals import pre_transition as pre_transition_signal
 from django_fsm_log.decorators import fsm_log_by, fsm_log_description
 
-from . import signals
+from . import (
+    backoff,
+    cache,
+    counters,
+    history,
+    leases,
+    optimistic,
+    outbox,
+    replicas,
+    schedule,
+    signals,
+    throttle,
+)
+from .aio import asweep, atransition
+from .bulk import bulk_add, bulk_transition
 from .fsm_hooks import post_transition
+from .indexes import StateIndex
+from .metrics import instrument
 from .states import SubscriptionState as State
+from .sweeps import chunk_size, each, sweep
+
+# What tick() and run_due() count, by the trigger each subscription was routed to
+ROUTES = ("renewals", "expiring", "suspended", "timeout", "stuck")
+# The routes that renew, and so are throttled, see subscriptions.throttle
+RENEWAL_ROUTES = ("renewals", "suspended")
 
 
 def as_date(dt):
@@ -21,45 +47,176 @@ def as_date(dt):
 
 
 class SubscriptionManager(models.Manager):
+    _shard = None  # type: t.Optional[t.Tuple[int, int]]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self._shard is not None:
+            queryset = queryset.filter(pk__range=self._shard)
+        return queryset
+
+    def shard(self, first_pk, last_pk):
+        """
+        Returns a copy of this manager that only sees subscriptions with a pk between `first_pk`
+        and `last_pk` (inclusive), so that triggers can be split across workers.
+        """
+        manager = copy.copy(self)
+        manager._shard = (first_pk, last_pk)
+        return manager
+
+    def sweep_name(self, name):
+        if self._shard is None:
+            return name
+        return "{}:{}-{}".format(name, *self._shard)
+
+    def state_counts(self):
+        """
+        Returns the number of subscriptions in each state. This is a lookup of the StateCount
+        table when `settings.SUBSCRIPTIONS_STATE_COUNTS` is set, and a full count otherwise,
+        either read from `settings.SUBSCRIPTIONS_READ_DATABASE` when it is set.
+        """
+        if counters.enabled() and self._shard is None:
+            return counters.state_counts()
+        counts = dict.fromkeys(State, 0)
+        counts.update(
+            (State(state), count)
+            for state, count in replicas.reading(self.get_queryset())
+            .order_by()
+            .values_list("state")
+            .annotate(models.Count("pk"))
+        )
+        return counts
+
+    def count_in_state(self, state):
+        # type: (State) -> int
+        return self.state_counts()[state]
+
+    def is_subscribed(self, reference):
+        # type: (str) -> bool
+        """
+        Whether `reference` has an ACTIVE or EXPIRING subscription, read through the cache
+        configured with `settings.SUBSCRIPTIONS_CACHE`.
+        """
+        return cache.is_subscribed(self.get_queryset(), reference)
+
+    def subscribed(self, references):
+        # type: (t.Iterable[str]) -> t.Dict[str, bool]
+        """
+        Like `is_subscribed`, for many references at once.
+        """
+        return cache.subscribed(self.get_queryset(), references)
+
+    def by_reference(self, references):
+        # type: (t.Iterable[str]) -> t.Dict[str, t.List[Subscription]]
+        """
+        Returns {reference: [subscriptions]} for those of `references` that have subscriptions.
+
+        The references are looked up `SUBSCRIPTIONS_CHUNK_SIZE` at a time, so that each query
+        is a bounded `IN` list on `subscription_reference_idx`.
+        """
+        references = sorted(set(references))
+        found = {}  # type: t.Dict[str, t.List[Subscription]]
+        size = chunk_size()
+        for start in range(0, len(references), size):
+            for subscription in self.get_queryset().for_references(
+                references[start : start + size]
+            ):
+                found.setdefault(subscription.reference, []).append(subscription)
+        return found
+
     def add_subscription(self, start, end, reference):
         return self.create(state=State.ACTIVE, start=start, end=end, reference=reference)
 
-    def trigger_renewals(self):
+    def add_subscriptions_bulk(self, rows, batch_size=None, skip_existing=False, signal=False):
+        """
+        Creates a subscription for every (start, end, reference) in `rows`, in batches of
+        `batch_size`, and returns the number created. `rows` can be a generator, and is only
+        read a batch at a time.
+
+        With `skip_existing=True`, references that already have a subscription are skipped.
+        With `signal=True`, `bulk_subscription_added` is sent once per batch with its `pks`.
+        """
+        return bulk_add(
+            self.model,
+            rows,
+            size=batch_size,
+            skip_existing=skip_existing,
+            signal=signals.bulk_subscription_added if signal else None,
+        )
+
+    def trigger_renewals(self, bulk=False, workers=None):
         """
         Finds all subscriptions that are due to be renewed, and begins the renewal process.
+
+        With `bulk=True` the subscriptions are moved in chunks, and `bulk_subscription_due` is
+        sent once per chunk instead of `subscription_due` once per subscription.
+
+        With `workers`, that many threads claim disjoint chunks of the due subscriptions, so
+        overlapping calls (from other threads or celery workers) never renew the same one twice.
         """
-        count = 0
-        renewals = self.get_queryset().renewals_due().order_by("last_updated").iterator()
-        for subscription in renewals:
-            subscription.renew()
-            count += 1
-        return count
+        renewals = self.get_queryset().renewals_due()
+        if bulk:
+            return bulk_transition(
+                renewals,
+                self.model.renew,
+                signals.bulk_subscription_due,
+                values=dict(reason="", **leases.values(timezone.now())),
+                name=self.sweep_name("renewals"),
+                workers=workers,
+                throttle=throttle.renewals(),
+            )
+        return sweep(
+            self.sweep_name("renewals"),
+            renewals,
+            each(self.model, self.model.renew),
+            workers=workers,
+            throttle=throttle.renewals(),
+        )
 
-    def trigger_expiring(self):
+    def trigger_expiring(self, bulk=False):
         """
         Finds all subscriptions that have now finished, and begins the end subscription process.
         """
-        count = 0
-        ended = self.get_queryset().expiring().order_by("last_updated").iterator()
-        for subscription in ended:
-            subscription.end_subscription()
-            count += 1
-        return count
+        ended = self.get_queryset().expiring()
+        if bulk:
+            return bulk_transition(
+                ended,
+                self.model.end_subscription,
+                signals.bulk_subscription_ended,
+                values={"reason": "", "end": timezone.now()},
+                name=self.sweep_name("expiring"),
+            )
+        return sweep(
+            self.sweep_name("expiring"), ended, each(self.model, self.model.end_subscription)
+        )
 
-    def trigger_suspended(self):
+    def trigger_suspended(self, bulk=False, workers=None):
         """
         Finds all subscriptions that are due and suspended, and begins the renewal process.
 
-        This is useful for handling retries after a failed renewal.
+        This is useful for handling retries after a failed renewal. `workers` behaves as it
+        does for `trigger_renewals`.
         """
-        count = 0
-        suspended = self.get_queryset().suspended().order_by("last_updated").iterator()
-        for subscription in suspended:
-            subscription.renew()
-            count += 1
-        return count
+        suspended = self.get_queryset().suspended()
+        if bulk:
+            return bulk_transition(
+                suspended,
+                self.model.renew,
+                signals.bulk_subscription_due,
+                values=dict(reason="", **leases.values(timezone.now())),
+                name=self.sweep_name("suspended"),
+                workers=workers,
+                throttle=throttle.renewals(),
+            )
+        return sweep(
+            self.sweep_name("suspended"),
+            suspended,
+            each(self.model, self.model.renew),
+            workers=workers,
+            throttle=throttle.renewals(),
+        )
 
-    def trigger_suspended_timeout(self, timeout_hours=48, timeout_days=None):
+    def trigger_suspended_timeout(self, timeout_hours=48, timeout_days=None, bulk=False):
         """
         Finds all subscriptions that have remained in Suspended status for `timeout_hours`, and begins
         the end subscription process.
@@ -69,16 +226,20 @@ class SubscriptionManager(models.Manager):
         if timeout_days is not None:
             timeout_hours = timeout_days * 24
 
-        count = 0
-        suspended = (
-            self.get_queryset().suspended_timeout(timeout_hours).order_by("last_updated").iterator()
+        suspended = self.get_queryset().suspended_timeout(timeout_hours)
+        if bulk:
+            return bulk_transition(
+                suspended,
+                self.model.end_subscription,
+                signals.bulk_subscription_ended,
+                values={"reason": "", "end": timezone.now()},
+                name=self.sweep_name("timeout"),
+            )
+        return sweep(
+            self.sweep_name("timeout"), suspended, each(self.model, self.model.end_subscription)
         )
-        for subscription in suspended:
-            subscription.end_subscription()
-            count += 1
-        return count
 
-    def trigger_stuck(self, timeout_hours=2):
+    def trigger_stuck(self, timeout_hours=2, bulk=False):
         """
         Finds all subscriptions that begun the renewal process but did not complete, and moves them
         to the unknown state, requiring manual intervention.
@@ -87,43 +248,286 @@ class SubscriptionManager(models.Manager):
         the renewal succeeded or failed.
         """
         retry_stuck = getattr(settings, "SUBSCRIPTIONS_STUCK_RETRY", False)
-        count = 0
-        old_renewing: t.Iterable[Subscription] = self.get_queryset().stuck(timeout_hours).order_by(
-            "last_updated"
-        ).iterator()
-        for subscription in old_renewing:
+        old_renewing = self.get_queryset().stuck(timeout_hours)
+        if bulk:
+            description = "stuck subscription"
+            values = dict(reason=description, **leases.RELEASED)
+            if retry_stuck:
+                method, signal = self.model.renewal_failed, signals.bulk_renewal_failed
+                values.update(backoff.retry_values(timezone.now()))
+            else:
+                method, signal = self.model.state_unknown, signals.bulk_subscription_error
+            return bulk_transition(
+                old_renewing,
+                method,
+                signal,
+                values=values,
+                description=description,
+                name=self.sweep_name("stuck"),
+            )
+
+        def unstick(subscription):
+            # type: (Subscription) -> None
             if retry_stuck:
                 subscription.renewal_failed(description="stuck subscription")
             else:
                 subscription.state_unknown(description="stuck subscription")
-            count += 1
-        return count
+
+        return sweep(self.sweep_name("stuck"), old_renewing, each(self.model, unstick))
+
+    def tick(self, timeout_hours=48, stuck_hours=2):
+        # type: (...) -> t.Dict[str, int]
+        """
+        Runs every trigger in a single sweep, and returns the number of subscriptions each one
+        moved, eg: {"renewals": 10, "expiring": 2, "suspended": 0, "timeout": 1, "stuck": 0},
+        along with the number of candidates left by the renewal throttle as "remaining".
+
+        The candidates of all five triggers are fetched with one query, against one clock, and
+        each subscription is routed to the transition its trigger would have made. A
+        subscription that is both suspended and past `timeout_hours` is ended, rather than
+        renewed again.
+        """
+        now = timezone.now()
+        queryset = self.get_queryset()
+        route, counts = self.router(now, timeout_hours, stuck_hours)
+        counts["remaining"] = self.sweep_routes(
+            "tick",
+            queryset.actionable(timeout_hours, stuck_hours, now=now),
+            queryset.renewals_due(now) | queryset.suspended(now),
+            route,
+            now,
+        )
+        return counts
+
+    def run_due(self):
+        # type: () -> t.Dict[str, int]
+        """
+        Like `tick`, but finds the candidates with a range read of `next_action_at`, see
+        `subscriptions.schedule`. The timeouts come from settings.
+        """
+        now = timezone.now()
+        route, counts = self.router(
+            now, schedule.suspended_timeout_hours(), schedule.stuck_timeout_hours()
+        )
+        candidates = self.get_queryset().due(now)
+        counts["remaining"] = self.sweep_routes(
+            "due",
+            candidates,
+            candidates.filter(state__in=[State.ACTIVE, State.SUSPENDED]),
+            route,
+            now,
+        )
+        return counts
+
+    def sweep_routes(self, name, candidates, renewing, route, now):
+        """
+        Sweeps `candidates` through `route`, and returns the number of candidates the renewal
+        throttle left.
+
+        When renewals are throttled, every other route is swept first without the throttle, and
+        then `renewing` (the candidates that may be renewed) only through the renewal routes, so
+        that only renewals take its tokens and are jittered.
+        """
+        renewals = throttle.renewals()
+        if renewals is None:
+            sweep(self.sweep_name(name), candidates, each(self.model, route), started=now)
+            return 0
+        others = [kind for kind in ROUTES if kind not in RENEWAL_ROUTES]
+        sweep(
+            self.sweep_name(name),
+            candidates,
+            each(self.model, functools.partial(route, kinds=others)),
+            started=now,
+        )
+        progress = sweep(
+            self.sweep_name(name + ".renewals"),
+            renewing,
+            each(self.model, functools.partial(route, kinds=RENEWAL_ROUTES)),
+            started=now,
+            throttle=renewals,
+        )
+        return progress.remaining
+
+    def router(self, now, timeout_hours, stuck_hours):
+        """
+        Returns a function that moves a subscription through the transition its trigger would
+        make at `now`, if any, and the counts it adds to.
+        """
+        timeout = now - timedelta(hours=timeout_hours)
+        stuck = now - timedelta(hours=stuck_hours)
+        retry_stuck = getattr(settings, "SUBSCRIPTIONS_STUCK_RETRY", False)
+        counts = dict.fromkeys(ROUTES, 0)
+
+        def route(subscription, kinds=ROUTES):
+            # type: (Subscription, t.Collection[str]) -> None
+            # Checked again against the same clock, in case the row changed after it was read.
+            state = subscription.state
+            if state == State.SUSPENDED and subscription.end <= timeout:
+                kind, move = "timeout", subscription.end_subscription
+            elif (
+                state == State.SUSPENDED
+                and subscription.end < now
+                and (subscription.next_retry_at is None or subscription.next_retry_at <= now)
+            ):
+                kind, move = "suspended", subscription.renew
+            elif state == State.ACTIVE and subscription.end < now:
+                kind, move = "renewals", subscription.renew
+            elif state == State.EXPIRING and subscription.end < now:
+                kind, move = "expiring", subscription.end_subscription
+            elif state == State.RENEWING and (
+                subscription.lease_expires <= now
+                if subscription.lease_expires
+                else subscription.last_updated <= stuck
+            ):
+                kind = "stuck"
+                move = functools.partial(
+                    subscription.renewal_failed if retry_stuck else subscription.state_unknown,
+                    description="stuck subscription",
+                )
+            else:
+                return
+            if kind in kinds:
+                move()
+                counts[kind] += 1
+
+        return route, counts
+
+    async def atrigger_renewals(self, concurrency=None):
+        """
+        Async counterpart of `trigger_renewals`, renewing up to `concurrency` subscriptions at
+        once.
+        """
+        return await asweep(
+            self.get_queryset().renewals_due(),
+            self.model.arenew,
+            concurrency=concurrency,
+            throttle=throttle.renewals(),
+        )
+
+    async def atrigger_expiring(self, concurrency=None):
+        return await asweep(
+            self.get_queryset().expiring(), self.model.aend_subscription, concurrency=concurrency
+        )
+
+    async def atrigger_suspended(self, concurrency=None):
+        return await asweep(
+            self.get_queryset().suspended(),
+            self.model.arenew,
+            concurrency=concurrency,
+            throttle=throttle.renewals(),
+        )
+
+    async def atrigger_suspended_timeout(self, timeout_hours=48, concurrency=None):
+        return await asweep(
+            self.get_queryset().suspended_timeout(timeout_hours),
+            self.model.aend_subscription,
+            concurrency=concurrency,
+        )
+
+    async def atrigger_stuck(self, timeout_hours=2, concurrency=None):
+        retry_stuck = getattr(settings, "SUBSCRIPTIONS_STUCK_RETRY", False)
+
+        async def unstick(subscription):
+            # type: (Subscription) -> None
+            if retry_stuck:
+                await subscription.arenewal_failed(description="stuck subscription")
+            else:
+                await subscription.astate_unknown(description="stuck subscription")
+
+        return await asweep(
+            self.get_queryset().stuck(timeout_hours), unstick, concurrency=concurrency
+        )
 
 
 class SubscriptionQuerySet(models.QuerySet):
-    def renewals_due(self):
-        return self.filter(state=State.ACTIVE, end__lt=timezone.now())
+    def for_reference(self, reference):
+        # type: (str) -> SubscriptionQuerySet
+        """
+        Subscriptions with exactly `reference`, using `subscription_reference_idx`.
+
+        Transforms of the column (`iexact`, `Lower()`, ...) can't use the index, so lookups by
+        reference should go through here rather than filtering ad hoc.
+        """
+        return self.filter(reference=reference)
+
+    def for_references(self, references):
+        # type: (t.Iterable[str]) -> SubscriptionQuerySet
+        return self.filter(reference__in=references)
+
+    def reference_startswith(self, prefix):
+        # type: (str) -> SubscriptionQuerySet
+        """
+        Subscriptions whose reference begins with `prefix`. The index serves this on PostgreSQL
+        and MySQL. SQLite can't use an index for a case insensitive `LIKE`.
+        """
+        return self.filter(reference__startswith=prefix)
+
+    def renewals_due(self, now=None):
+        return self.filter(state=State.ACTIVE, end__lt=now or timezone.now())
 
-    def expiring(self):
-        return self.filter(state=State.EXPIRING, end__lt=timezone.now())
+    def expiring(self, now=None):
+        return self.filter(state=State.EXPIRING, end__lt=now or timezone.now())
 
-    def suspended(self):
-        return self.filter(state=State.SUSPENDED, end__lt=timezone.now())
+    def suspended(self, now=None):
+        """
+        SUSPENDED subscriptions whose retry is due, see `subscriptions.backoff`.
+        """
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(next_retry_at__lte=now) | models.Q(next_retry_at=None),
+            state=State.SUSPENDED,
+            end__lt=now,
+        )
 
-    def suspended_timeout(self, timeout_hours=48, timeout_days=None):
+    def suspended_timeout(self, timeout_hours=48, timeout_days=None, now=None):
         if timeout_days is not None:
             timeout_hours = timeout_days * 24
 
-        return self.annotate(
-            cutoff=E(
-                models.F("end") + timedelta(hours=timeout_hours),
-                output_field=models.DateTimeField(),
-            )
-        ).filter(state=State.SUSPENDED, cutoff__lte=timezone.now())
+        return self.filter(state=State.SUSPENDED).ended_before(hours=timeout_hours, now=now)
+
+    def actionable(self, timeout_hours=48, stuck_hours=2, now=None):
+        """
+        The candidates of every trigger at once, as a single query.
+        """
+        now = now or timezone.now()
+        return (
+            self.renewals_due(now)
+            | self.expiring(now)
+            | self.suspended(now)
+            | self.suspended_timeout(timeout_hours, now=now)
+            | self.stuck(stuck_hours, now=now)
+        )
 
-    def stuck(self, timeout_hours=2):
+    def due(self, now=None):
+        """
+        Subscriptions whose `next_action_at` has passed, see `subscriptions.schedule`.
+        """
+        return self.filter(next_action_at__lte=now or timezone.now())
+
+    def ended_before(self, hours=0, now=None):
+        """
+        Subscriptions whose `end` was at least `hours` before `now`.
+
+        The cutoff is computed once, rather than adding the interval to `end` for every row,
+        so that the database compares the raw column and can use its indexes.
+        """
+        now = now or timezone.now()
+        return self.filter(end__lte=now - timedelta(hours=hours))
+
+    def stuck(self, timeout_hours=2, now=None):
+        """
+        RENEWING subscriptions whose lease has expired, see `subscriptions.leases`. Those
+        without a lease are stuck once they were last updated `timeout_hours` ago.
+        """
+        now = now or timezone.now()
+        # The state is repeated in each branch, so that both are range reads of the lease index.
         return self.filter(
-            state=State.RENEWING, last_updated__lte=timezone.now() - timedelta(hours=timeout_hours)
+            models.Q(state=State.RENEWING, lease_expires__lte=now)
+            | models.Q(
+                state=State.RENEWING,
+                lease_expires=None,
+                last_updated__lte=now - timedelta(hours=timeout_hours),
+            )
         )
 
 
@@ -136,11 +540,29 @@ class Subscription(models.Model):
     )
     start = models.DateTimeField(default=timezone.now, help_text="When the subscription begins")
     end = models.DateTimeField(help_text="When the subscription ends")
-    reference = models.TextField(max_length=100, help_text="Free text field for user references")
+    reference = models.CharField(max_length=100, help_text="Free text field for user references")
     last_updated = models.DateTimeField(
         auto_now=True, help_text="Keeps track of when a record was last updated"
     )
     reason = models.TextField(help_text="Reason for state change, if applicable.")
+    retry_attempts = models.PositiveIntegerField(
+        default=0, help_text="Renewals that have failed since the last successful one"
+    )
+    next_retry_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When a SUSPENDED subscription is next due to be retried, see backoff",
+    )
+    lease_owner = models.CharField(
+        max_length=100, blank=True, help_text="Who is renewing a RENEWING subscription"
+    )
+    lease_expires = models.DateTimeField(
+        null=True, blank=True, help_text="When the renewal is considered stuck, see leases"
+    )
+    # Computed from the fields above as the subscription is saved.
+    next_action_at = schedule.NextActionField(
+        help_text="When the next trigger is due for this subscription, see schedule"
+    )
 
     objects = SubscriptionManager.from_queryset(SubscriptionQuerySet)()
 
@@ -149,6 +571,37 @@ class Subscription(models.Model):
             models.Index(fields=["state"], name="subscription_state_idx"),
             models.Index(fields=["end"], name="subscription_end_idx"),
             models.Index(fields=["last_updated"], name="subscription_last_updated_idx"),
+            # Serves every trigger query, in the (last_updated, id) order the sweeps walk them,
+            # see subscriptions.sweeps. `end` is carried along so that subscriptions that aren't
+            # due yet are skipped without visiting the table.
+            StateIndex(
+                states=[State.ACTIVE, State.EXPIRING, State.RENEWING, State.SUSPENDED],
+                fields=["state", "last_updated", "end"],
+                name="subscription_trigger_idx",
+            ),
+            # Serves lookups by reference. On PostgreSQL the pattern operator class lets it
+            # serve `reference__startswith` (the admin search) as well as equality, whatever
+            # the database collation. Other backends ignore the operator class.
+            models.Index(
+                fields=["reference"],
+                name="subscription_reference_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+            # Serves trigger_suspended, which only retries subscriptions that are due.
+            StateIndex(
+                states=[State.SUSPENDED],
+                fields=["state", "next_retry_at"],
+                name="subscription_retry_idx",
+            ),
+            # Serves the scheduler's range reads of what is due, see subscriptions.schedule.
+            models.Index(fields=["next_action_at"], name="subscription_next_action_idx"),
+            # Serves trigger_stuck, which reclaims renewals whose lease has expired, and those
+            # without a lease by `last_updated`.
+            StateIndex(
+                states=[State.RENEWING],
+                fields=["state", "lease_expires", "last_updated"],
+                name="subscription_lease_idx",
+            ),
         ]
         get_latest_by = "start"
         permissions = (("can_update_state", "Can update subscription state"),)
@@ -158,36 +611,74 @@ class Subscription(models.Model):
             self.pk, self.get_state_display(), as_date(self.start), as_date(self.end)
         )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if optimistic.enabled():
+            optimistic.snapshot(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        if kwargs.get("update_fields"):
+            kwargs["update_fields"] = {*kwargs["update_fields"], "next_action_at"}
+        super().save(*args, **kwargs)
+        if optimistic.enabled():
+            optimistic.snapshot(self)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, **kwargs):
+        # Set by optimistic.save() to make the UPDATE conditional on what was loaded.
+        expected = getattr(self, "_expected", None)
+        if expected:
+            base_qs = base_qs.filter(**expected)
+        updated = super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update, **kwargs
+        )
+        if (
+            expected
+            and not updated
+            and type(self)._base_manager.using(using).filter(pk=pk_val).exists()
+        ):
+            raise optimistic.ConcurrentTransition(
+                "Subscription {} has been saved since it was loaded".format(pk_val)
+            )
+        return updated
+
     def can_proceed(self, transition_method):
         return can_proceed(transition_method)
 
+    @instrument
     @transition(field=state, source=State.ACTIVE, target=State.EXPIRING)
     def cancel_autorenew(self):
         self.reason = ""
 
     @post_transition(cancel_autorenew)
     def post_cancel_autorenew(self):
-        self.save()
-        signals.autorenew_canceled.send_robust(self)
+        outbox.save_and_send(self, signals.autorenew_canceled)
 
+    @instrument
     @transition(field=state, source=State.EXPIRING, target=State.ACTIVE)
     def enable_autorenew(self):
         self.reason = ""
 
     @post_transition(enable_autorenew)
     def post_enable_autorenew(self):
-        self.save()
-        signals.autorenew_enabled.send_robust(self)
+        outbox.save_and_send(self, signals.autorenew_enabled)
 
+    @instrument
     @transition(field=state, source=[State.ACTIVE, State.SUSPENDED], target=State.RENEWING)
-    def renew(self):
+    def renew(self, owner=None):
+        """
+        Begins the renewal, leased to `owner` (this host and process, by default), see
+        `subscriptions.leases`.
+        """
         self.reason = ""
+        leases.take(self, owner)
 
     @post_transition(renew)
     def post_renew(self):
-        self.save()
-        signals.subscription_due.send_robust(self)
+        outbox.save_and_send(self, signals.subscription_due)
 
+    @instrument
     @fsm_log_description
     @transition(
         field=state,
@@ -198,12 +689,15 @@ class Subscription(models.Model):
         self.reason = ""
         self.end = new_end_date
         self.reference = new_reference
+        self.retry_attempts = 0
+        self.next_retry_at = None
+        leases.release(self)
 
     @post_transition(renewed)
     def post_renewed(self):
-        self.save()
-        signals.subscription_renewed.send_robust(self)
+        outbox.save_and_send(self, signals.subscription_renewed)
 
+    @instrument
     @fsm_log_description
     @transition(field=state, source=[State.RENEWING, State.ERROR], target=State.SUSPENDED)
     def renewal_failed(self, reason="", description=None):
@@ -211,12 +705,15 @@ class Subscription(models.Model):
             self.reason = description
         else:
             self.reason = reason
+        self.retry_attempts += 1
+        self.next_retry_at = backoff.next_retry(self.retry_attempts)
+        leases.release(self)
 
     @post_transition(renewal_failed)
     def post_renewal_failed(self):
-        self.save()
-        signals.renewal_failed.send_robust(self)
+        outbox.save_and_send(self, signals.renewal_failed)
 
+    @instrument
     @fsm_log_by
     @fsm_log_description
     @transition(
@@ -233,9 +730,9 @@ class Subscription(models.Model):
 
     @post_transition(end_subscription)
     def post_end_subscription(self):
-        self.save()
-        signals.subscription_ended.send_robust(self)
+        outbox.save_and_send(self, signals.subscription_ended)
 
+    @instrument
     @fsm_log_description
     @transition(field=state, source=State.RENEWING, target=State.ERROR)
     def state_unknown(self, reason="", description=None):
@@ -253,8 +750,182 @@ class Subscription(models.Model):
             self.reason = description
         else:
             self.reason = reason
+        leases.release(self)
 
     @post_transition(state_unknown)
     def post_state_unknown(self):
-        self.save()
-        signals.subscription_error.send_robust(self)
+        outbox.save_and_send(self, signals.subscription_error)
+
+    def extend_lease(self, seconds=None):
+        # type: (t.Optional[float]) -> bool
+        """
+        Extends the lease `renew()` took to `seconds` (`SUBSCRIPTIONS_LEASE_SECONDS` by default)
+        from now, and returns whether it was still held, ie: the subscription is still RENEWING
+        under the same owner.
+        """
+        expires = leases.expiry(seconds=seconds)
+        extended = (
+            type(self)
+            ._base_manager.filter(pk=self.pk, state=State.RENEWING, lease_owner=self.lease_owner)
+            .update(lease_expires=expires, next_action_at=expires)
+        )
+        if extended:
+            self.lease_expires = self.next_action_at = expires
+        return bool(extended)
+
+    # Async counterparts of the transitions, see subscriptions.aio
+
+    async def acancel_autorenew(self):
+        return await atransition(self.cancel_autorenew)
+
+    async def aenable_autorenew(self):
+        return await atransition(self.enable_autorenew)
+
+    async def arenew(self, owner=None):
+        return await atransition(self.renew, owner=owner)
+
+    async def arenewed(self, new_end_date, new_reference, description=None):
+        return await atransition(self.renewed, new_end_date, new_reference, description=description)
+
+    async def arenewal_failed(self, reason="", description=None):
+        return await atransition(self.renewal_failed, reason=reason, description=description)
+
+    async def aend_subscription(self, reason="", by=None, description=None):
+        return await atransition(
+            self.end_subscription, reason=reason, by=by, description=description
+        )
+
+    async def astate_unknown(self, reason="", description=None):
+        return await atransition(self.state_unknown, reason=reason, description=description)
+
+
+# Connected after the post transition hooks, so that history is written once the hook has saved.
+post_transition_signal.connect(history.record, sender=Subscription)
+post_save.connect(counters.created, sender=Subscription)
+post_delete.connect(counters.deleted, sender=Subscription)
+pre_transition_signal.connect(cache.transitioning, sender=Subscription)
+pre_transition_signal.connect(counters.transitioning, sender=Subscription)
+post_save.connect(cache.saved, sender=Subscription)
+post_delete.connect(cache.deleted, sender=Subscription)
+
+
+class StateCount(models.Model):
+    """
+    The number of subscriptions in a state, maintained when `settings.SUBSCRIPTIONS_STATE_COUNTS`
+    is set. See `subscriptions.counters`.
+    """
+
+    state = models.IntegerField(primary_key=True, choices=State.choices())
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{}: {}".format(State(self.state).name, self.count)
+
+
+class StateChange(models.Model):
+    """
+    A transition of a subscription, written instead of a StateLog when
+    `settings.SUBSCRIPTIONS_COMPACT_HISTORY` is set. See `subscriptions.history`.
+    """
+
+    subscription = models.ForeignKey(
+        Subscription,
+        # History is kept when the subscription is archived.
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="history",
+    )
+    timestamp = models.DateTimeField(default=timezone.now)
+    source_state = models.IntegerField(choices=State.choices())
+    state = models.IntegerField(choices=State.choices())
+    transition = models.CharField(max_length=50)
+    by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    description = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["subscription", "timestamp"], name="statechange_history_idx")
+        ]
+        get_latest_by = "timestamp"
+
+    def __str__(self):
+        return "{}: {} -> {} ({})".format(
+            self.subscription_id,
+            State(self.source_state).name,
+            State(self.state).name,
+            self.transition,
+        )
+
+
+class ArchivedSubscription(models.Model):
+    """
+    A subscription that had ended, moved out of Subscription by `subscriptions.archive`.
+    """
+
+    id = models.IntegerField(primary_key=True, help_text="The id of the subscription")
+    state = models.IntegerField(choices=State.choices(), help_text="The final status")
+    start = models.DateTimeField(help_text="When the subscription began")
+    end = models.DateTimeField(help_text="When the subscription ended")
+    reference = models.CharField(
+        max_length=100, db_index=True, help_text="Free text field for user references"
+    )
+    last_updated = models.DateTimeField(help_text="When the subscription was last updated")
+    reason = models.TextField(help_text="Reason for the last state change, if applicable.")
+    archived = models.DateTimeField(auto_now_add=True, help_text="When it was archived")
+
+    class Meta:
+        get_latest_by = "start"
+
+    def __str__(self):
+        return "[{}] {}: {:%Y-%m-%d} to {:%Y-%m-%d}".format(
+            self.pk, self.get_state_display(), as_date(self.start), as_date(self.end)
+        )
+
+
+class SweepCursor(models.Model):
+    name = models.CharField(max_length=100, primary_key=True, help_text="The name of the sweep")
+    last_updated = models.DateTimeField(
+        help_text="last_updated of the last subscription processed by the sweep"
+    )
+    last_id = models.IntegerField(help_text="id of the last subscription processed by the sweep")
+    updated = models.DateTimeField(
+        auto_now=True, help_text="Keeps track of when the cursor was last moved"
+    )
+
+    def __str__(self):
+        return "{}: {:%Y-%m-%d %H:%M:%S} #{}".format(self.name, self.last_updated, self.last_id)
+
+
+class SignalEvent(models.Model):
+    signal = models.CharField(max_length=50, help_text="The name of the signal to send")
+    # Deleting or archiving a subscription keeps its undelivered events, see outbox.deliver
+    subscription = models.ForeignKey(
+        Subscription,
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        help_text="The sender of the signal, unless it is a bulk signal",
+    )
+    pks = models.TextField(blank=True, help_text="The JSON list of pks sent by a bulk signal")
+    created = models.DateTimeField(auto_now_add=True)
+    available = models.DateTimeField(
+        null=True,
+        default=timezone.now,
+        help_text="When the signal may next be sent. Empty once delivery has been abandoned",
+    )
+    attempts = models.PositiveIntegerField(default=0, help_text="Failed attempts to send")
+    last_error = models.TextField(blank=True, help_text="The last error raised by a receiver")
+
+    class Meta:
+        indexes = [models.Index(fields=["available", "id"], name="signalevent_available_idx")]
+
+    def __str__(self):
+        return "{}: {}".format(self.signal, self.subscription_id or self.pks)
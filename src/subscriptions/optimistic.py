@@ -0,0 +1,66 @@
+from django.conf import settings
+from django_fsm import ConcurrentTransition
+
+__all__ = ["ConcurrentTransition", "enabled", "save"]
+
+"""
+Optimistic concurrency for the saves made by transitions.
+
+With `settings.SUBSCRIPTIONS_CONDITIONAL_SAVE = True`, a transition is saved with
+
+    UPDATE ... SET <changed columns> WHERE id = ? AND state = ? AND last_updated = ?
+
+using the state and last_updated the subscription had when it was loaded (or last saved).
+`last_updated` changes on every save, so it serves as the version of the row. When another
+process has saved the subscription in the meantime, nothing is updated and
+`django_fsm.ConcurrentTransition` is raised instead of overwriting the other write. Only the
+columns that the transition changed are written.
+"""
+
+
+def enabled():
+    # type: () -> bool
+    return getattr(settings, "SUBSCRIPTIONS_CONDITIONAL_SAVE", False)
+
+
+def snapshot(instance):
+    """
+    Remembers the loaded values of `instance`, to compare against when it is next saved.
+    """
+    instance._snapshot = {
+        field.attname: instance.__dict__[field.attname]
+        for field in instance._meta.concrete_fields
+        if field.attname in instance.__dict__
+    }
+
+
+def changed_fields(instance, loaded):
+    return [
+        field.name
+        for field in instance._meta.concrete_fields
+        if not field.primary_key
+        and field.attname in instance.__dict__
+        and (
+            getattr(field, "auto_now", False)
+            or field.attname not in loaded
+            or loaded[field.attname] != instance.__dict__[field.attname]
+        )
+    ]
+
+
+def save(instance):
+    """
+    Saves a subscription after a transition, conditionally when enabled.
+    """
+    loaded = getattr(instance, "_snapshot", None)
+    if not enabled() or loaded is None or instance._state.adding:
+        instance.save()
+        return
+
+    instance._expected = {
+        name: loaded[name] for name in ("state", "last_updated") if name in loaded
+    }
+    try:
+        instance.save(update_fields=changed_fields(instance, loaded))
+    finally:
+        del instance._expected
@@ -0,0 +1,180 @@
+import json
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from . import counters, optimistic, signals
+from .sweeps import chunk_size
+
+__all__ = ["deliver", "enabled", "save_and_send", "send_on_commit"]
+
+"""
+Delivery of subscription signals through a transactional outbox.
+
+By default signals are sent to their receivers as soon as a transition is saved, or once
+the chunk of the sweep that made the transition commits. With `settings.SUBSCRIPTIONS_OUTBOX = True`,
+a SignalEvent is written in the same transaction as the transition instead, and the
+events are sent later, in batches, by `deliver()` (or the `deliver_signals` task).
+
+Receivers then only run for transitions that committed, and a slow or failing receiver
+no longer holds up the triggers. Events whose receivers raise are retried with an
+exponential backoff, and abandoned after `SUBSCRIPTIONS_OUTBOX_MAX_ATTEMPTS`.
+
+Usage:
+
+    outbox.save_and_send(subscription, signals.subscription_due)
+    outbox.deliver()
+"""
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 60
+
+
+def enabled():
+    # type: () -> bool
+    return getattr(settings, "SUBSCRIPTIONS_OUTBOX", False)
+
+
+def max_attempts():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_OUTBOX_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+
+
+def retry_delay(attempts):
+    # type: (int) -> timedelta
+    delay = getattr(settings, "SUBSCRIPTIONS_OUTBOX_RETRY_DELAY", DEFAULT_RETRY_DELAY)
+    return timedelta(seconds=delay * 2 ** (attempts - 1))
+
+
+def save_and_send(instance, signal):
+    """
+    Saves `instance`, with its change to the state counts, and sends `signal` with it as the
+    sender, or queues the signal in the outbox in the same transaction as the save.
+    """
+    if not enabled():
+        with counters.saving(instance):
+            optimistic.save(instance)
+        signal.send_robust(instance)
+        return
+
+    SignalEvent = apps.get_model("subscriptions", "SignalEvent")
+    with transaction.atomic(using=instance._state.db), counters.saving(instance):
+        optimistic.save(instance)
+        SignalEvent.objects.using(instance._state.db).create(
+            signal=signal.name, subscription=instance
+        )
+
+
+def send_on_commit(signal, model, pks, using=None):
+    """
+    Sends the bulk `signal` with `pks` once the current transaction commits, or queues it in
+    the outbox as part of the current transaction.
+    """
+    if not enabled():
+        transaction.on_commit(lambda: signal.send_robust(model, pks=pks), using=using)
+        return
+
+    SignalEvent = apps.get_model("subscriptions", "SignalEvent")
+    SignalEvent.objects.using(using).create(signal=signal.name, pks=json.dumps(pks))
+
+
+def send(event, model):
+    """
+    Sends the signal recorded by `event`, and returns the first error raised by a receiver.
+    """
+    signal = getattr(signals, event.signal)
+    try:
+        with transaction.atomic(using=event._state.db):
+            if event.pks:
+                responses = signal.send_robust(model, pks=json.loads(event.pks))
+            else:
+                responses = signal.send_robust(event.subscription)
+    except DatabaseError as err:
+        # A receiver broke the transaction without raising, so it couldn't be released.
+        return err
+    for _, response in responses:
+        if isinstance(response, Exception):
+            return response
+    return None
+
+
+def deliver(size=None, using=None):
+    """
+    Sends every outbox event that is due, in batches of `size`, and returns the number of
+    events delivered.
+
+    Each batch is claimed in its own transaction, skipping events claimed by a concurrent
+    `deliver()` where the database supports it. Delivered events are deleted. Events with a
+    failing receiver are retried later, with every receiver of the signal called again. Events
+    whose subscription has since been deleted (or archived) can't be sent, and are abandoned.
+    """
+    SignalEvent = apps.get_model("subscriptions", "SignalEvent")
+    size = size or chunk_size()
+    events = SignalEvent.objects.using(using).order_by("available", "pk")
+    features = connections[events.db].features
+    # Only lock the events, not the subscriptions that the triggers are sweeping.
+    lock = {
+        "skip_locked": features.has_select_for_update_skip_locked,
+        "of": ("self",) if features.has_select_for_update_of else (),
+    }
+    model = SignalEvent._meta.get_field("subscription").related_model
+    started = timezone.now()
+    delivered = 0
+    while True:
+        with transaction.atomic(using=events.db):
+            # Failed events are pushed back past `started`, so each event is tried once per
+            # call unless the retry delay is 0.
+            batch = list(
+                events.filter(available__lte=started)
+                .select_for_update(**lock)
+                .select_related("subscription")[:size]
+            )
+            if not batch:
+                break
+            done = []
+            for event in batch:
+                if event.subscription_id is not None and event.subscription is None:
+                    abandon(event, "Subscription {} no longer exists".format(event.subscription_id))
+                    continue
+                error = send(event, model)
+                if error is None:
+                    done.append(event.pk)
+                else:
+                    retry(event, error)
+            SignalEvent.objects.using(events.db).filter(pk__in=done).delete()
+            delivered += len(done)
+    return delivered
+
+
+def retry(event, error):
+    event.attempts += 1
+    event.last_error = repr(error)
+    if event.attempts >= max_attempts():
+        event.available = None
+        log.error(
+            "Giving up on %s for subscription %s after %s attempts: %r",
+            event.signal,
+            event.subscription_id or event.pks,
+            event.attempts,
+            error,
+        )
+    else:
+        event.available = timezone.now() + retry_delay(event.attempts)
+    event.save(update_fields=["attempts", "last_error", "available"])
+
+
+def abandon(event, reason):
+    """
+    Keeps `event` for inspection, but never tries to send it again.
+    """
+    event.available = None
+    event.last_error = reason
+    log.error("Giving up on %s: %s", event.signal, reason)
+    event.save(update_fields=["last_error", "available"])
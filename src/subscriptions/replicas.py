@@ -0,0 +1,42 @@
+import typing as t
+
+from django.conf import settings
+
+__all__ = ["alias", "reading"]
+
+"""
+Reading sweep candidates and reports from a read replica.
+
+With `settings.SUBSCRIPTIONS_READ_DATABASE` set to a database alias, the sweeps behind the
+triggers, `tick()` and `run_due()` scan their candidates on that database, a chunk of
+(pk, state, last_updated) keys at a time. Each chunk is then checked again on the primary, by
+pk, against the trigger's own filter, and only the rows that still match are locked and moved.
+The primary sees only those targeted reads and the writes. `state_counts()` is read from the
+replica too.
+
+A replica that lags the primary can only delay work, never repeat it:
+
+- A row the primary has already moved on, but the replica still shows as a candidate, fails
+  the check on the primary and is skipped.
+- A row that has become a candidate on the primary, but not yet on the replica, is picked up
+  by a later run.
+
+`state_counts()` is as stale as the replica. Claiming sweeps (`workers`) lock their candidates
+as they read them, so they always read from the primary, as do the reference cache and the
+individual transitions.
+"""
+
+
+def alias():
+    # type: () -> t.Optional[str]
+    return getattr(settings, "SUBSCRIPTIONS_READ_DATABASE", None)
+
+
+def reading(queryset):
+    """
+    `queryset` on the read replica, if one is configured.
+    """
+    using = alias()
+    if using is None:
+        return queryset
+    return queryset.using(using)
@@ -0,0 +1,185 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, Min, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from .states import SubscriptionState as State
+from .sweeps import chunk_size
+
+__all__ = ["NextActionField", "next_action", "reschedule", "run", "seconds_until_next"]
+
+"""
+Event driven scheduling of the triggers.
+
+Every subscription keeps the instant its next trigger is due in the indexed `next_action_at`
+column, computed whenever it is saved:
+
+    ACTIVE, EXPIRING  end
+    SUSPENDED         its next retry (see subscriptions.backoff), or end + the suspended
+                      timeout, whichever is first
+    RENEWING          the expiry of its lease (see subscriptions.leases), or last_updated
+                      + the stuck timeout without one
+    ENDED, ERROR      never (NULL)
+
+`run()` then sleeps until the earliest of them, moves everything that is due with a single
+range read of the index (`Subscription.objects.run_due()`), and goes back to sleep. Nothing is
+late by a polling interval, and an idle table costs one index lookup per wake. It sleeps at
+most `SUBSCRIPTIONS_SCHEDULER_MAX_SLEEP` seconds, to notice subscriptions created or changed by
+other processes that are due sooner.
+
+The timeouts come from `SUBSCRIPTIONS_SUSPENDED_TIMEOUT_HOURS` (48) and
+`SUBSCRIPTIONS_STUCK_TIMEOUT_HOURS` (2). Run `reschedule()` after changing them, or after
+changing `end` or `state` with `QuerySet.update()`.
+
+Usage:
+
+    $ python manage.py run_scheduler
+"""
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SUSPENDED_TIMEOUT_HOURS = 48
+DEFAULT_STUCK_TIMEOUT_HOURS = 2
+DEFAULT_MAX_SLEEP = 60
+
+
+def suspended_timeout_hours():
+    # type: () -> int
+    return getattr(
+        settings, "SUBSCRIPTIONS_SUSPENDED_TIMEOUT_HOURS", DEFAULT_SUSPENDED_TIMEOUT_HOURS
+    )
+
+
+def stuck_timeout_hours():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_STUCK_TIMEOUT_HOURS", DEFAULT_STUCK_TIMEOUT_HOURS)
+
+
+def max_sleep():
+    # type: () -> float
+    return getattr(settings, "SUBSCRIPTIONS_SCHEDULER_MAX_SLEEP", DEFAULT_MAX_SLEEP)
+
+
+def next_action(subscription):
+    """
+    The instant the next trigger is due for `subscription`, or None if it never will be.
+    """
+    state, end = subscription.state, subscription.end
+    if state in (State.ACTIVE, State.EXPIRING):
+        return end
+    if state == State.SUSPENDED:
+        retry = max(subscription.next_retry_at or end, end)
+        return min(retry, end + timedelta(hours=suspended_timeout_hours()))
+    if state == State.RENEWING:
+        if subscription.lease_expires is not None:
+            return subscription.lease_expires
+        return subscription.last_updated + timedelta(hours=stuck_timeout_hours())
+    return None
+
+
+def next_action_expression():
+    """
+    `next_action()` as an expression, for updating many rows at once.
+    """
+    field = models.DateTimeField()
+    return Case(
+        When(state__in=[State.ACTIVE, State.EXPIRING], then=F("end")),
+        When(
+            state=State.SUSPENDED,
+            then=Least(
+                Greatest(Coalesce("next_retry_at", "end"), "end"),
+                ExpressionWrapper(
+                    F("end") + timedelta(hours=suspended_timeout_hours()), output_field=field
+                ),
+            ),
+        ),
+        When(
+            state=State.RENEWING,
+            then=Coalesce(
+                "lease_expires",
+                ExpressionWrapper(
+                    F("last_updated") + timedelta(hours=stuck_timeout_hours()), output_field=field
+                ),
+            ),
+        ),
+        default=Value(None),
+        output_field=field,
+    )
+
+
+class NextActionField(models.DateTimeField):
+    """
+    Holds `next_action()`, computed as the subscription is saved. It must be declared after
+    the fields it is computed from, so that `last_updated` has already been stamped.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("editable", False)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = next_action(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def refresh(queryset):
+    # type: (...) -> int
+    """
+    Recomputes `next_action_at` for `queryset`, for rows changed by `QuerySet.update()`.
+    """
+    return queryset.update(next_action_at=next_action_expression())
+
+
+def reschedule(model=None, size=None):
+    # type: (...) -> int
+    """
+    Recomputes `next_action_at` for every subscription, a pk range of `size` at a time, and
+    returns the number of rows updated.
+    """
+    model = model or apps.get_model("subscriptions", "Subscription")
+    size = size or chunk_size()
+    manager = model._base_manager
+    bounds = manager.aggregate(first=models.Min("pk"), last=models.Max("pk"))
+    if bounds["first"] is None:
+        return 0
+    count = 0
+    for first in range(bounds["first"], bounds["last"] + 1, size):
+        count += refresh(manager.filter(pk__gte=first, pk__lt=first + size))
+    return count
+
+
+def seconds_until_next(now=None):
+    # type: (...) -> float
+    """
+    Seconds until the next subscription is due, at most `SUBSCRIPTIONS_SCHEDULER_MAX_SLEEP`.
+    """
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    now = now or timezone.now()
+    upcoming = Subscription.objects.filter(next_action_at__gt=now).aggregate(
+        next=Min("next_action_at")
+    )["next"]
+    if upcoming is None:
+        return max_sleep()
+    return min((upcoming - now).total_seconds(), max_sleep())
+
+
+def run(stop=None):
+    """
+    Moves due subscriptions as they become due, until `stop` (a `threading.Event`) is set.
+    """
+    Subscription = apps.get_model("subscriptions", "Subscription")
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        counts = Subscription.objects.run_due()
+        if any(counts.values()):
+            log.info("subscriptions.scheduler | %s |", counts)
+        stop.wait(seconds_until_next())
@@ -1,9 +1,255 @@
-from django.dispatch import Signal
-
-subscription_due = Signal()
-subscription_ended = Signal()
-subscription_renewed = Signal()
-subscription_error = Signal()
-renewal_failed = Signal()
-autorenew_canceled = Signal()
-autorenew_enabled = Signal()
+import asyncio
+import logging
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.dispatch import Signal as BaseSignal
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RECEIVER_BUDGET = 1.0
+
+
+def receiver_budget():
+    # type: () -> float
+    return getattr(settings, "SUBSCRIPTIONS_RECEIVER_BUDGET", DEFAULT_RECEIVER_BUDGET)
+
+
+def receiver_name(receiver):
+    return "{}.{}".format(
+        getattr(receiver, "__module__", None), getattr(receiver, "__qualname__", repr(receiver))
+    )
+
+
+class ReceiverStats:
+    """
+    Latency and error counts for one receiver of one signal, since the last reset.
+    """
+
+    def __init__(self, signal, receiver):
+        self.signal = signal
+        self.receiver = receiver
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<ReceiverStats {} {}: calls={} errors={} slow={} mean={:.4f}s max={:.4f}s>".format(
+            self.signal, self.receiver, self.calls, self.errors, self.slow, self.mean, self.max
+        )
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def record(self, elapsed, error, slow):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.errors += int(error)
+        self.slow += int(slow)
+
+
+_stats = {}  # type: t.Dict[str, ReceiverStats]
+_stats_lock = threading.Lock()
+
+
+def receiver_stats():
+    """
+    Returns the ReceiverStats of every receiver that has been called, slowest mean first.
+    """
+    with _stats_lock:
+        stats = list(_stats.values())
+    return sorted(stats, key=lambda s: s.mean, reverse=True)
+
+
+def slow_receivers():
+    """
+    Returns the ReceiverStats of every receiver that has exceeded its budget at least once.
+    """
+    return [stats for stats in receiver_stats() if stats.slow]
+
+
+def reset_receiver_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+_deferred = ContextVar("subscriptions_deferred_signals", default=None)
+
+
+@contextmanager
+def deferred():
+    """
+    Collects the (signal, sender, named) of every signal sent inside the block instead of
+    sending it, so that the caller can send them later, with `send_deferred` or `asend_robust`.
+    """
+    pending = []
+    token = _deferred.set(pending)
+    try:
+        yield pending
+    finally:
+        _deferred.reset(token)
+
+
+def send_deferred(pending):
+    """
+    Sends the signals collected by `deferred()`.
+    """
+    for signal, sender, named in pending:
+        signal.send_robust(sender, **named)
+
+
+class Signal(BaseSignal):
+    """
+    A signal that times each of its receivers, and that can also be sent from async code.
+
+    Receivers that take longer than `settings.SUBSCRIPTIONS_RECEIVER_BUDGET` seconds (1 by
+    default) are logged as slow. Per receiver calls, errors, slow calls and latency are kept
+    in `receiver_stats()`, and reported to the metrics backend when one is configured.
+    """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+
+    def live_receivers(self, sender):
+        """
+        The receivers connected for `sender`, from the private `Signal._live_receivers`. That is
+        a list before Django 5, and a (sync receivers, async receivers) pair from Django 5.
+        """
+        receivers = self._live_receivers(sender)
+        if isinstance(receivers, tuple) and len(receivers) == 2:
+            sync_receivers, async_receivers = receivers
+            return list(sync_receivers) + list(async_receivers)
+        if not isinstance(receivers, list):
+            raise TypeError("Unexpected receivers {!r} for {}".format(receivers, self.name))
+        return receivers
+
+    def send_robust(self, sender, **named):
+        if not self.receivers:
+            return []
+        pending = _deferred.get()
+        if pending is not None:
+            pending.append((self, sender, named))
+            return []
+
+        backend = metrics.get_backend()
+        budget = receiver_budget()
+        responses = []
+        sent = time.perf_counter()
+        for receiver in self.live_receivers(sender):
+            call = receiver
+            if asyncio.iscoroutinefunction(receiver):
+                from asgiref.sync import async_to_sync
+
+                call = async_to_sync(receiver)
+            started = time.perf_counter()
+            error = None
+            try:
+                response = call(signal=self, sender=sender, **named)
+            # Like Signal.send_robust, any error of a receiver is logged and returned
+            except Exception as err:  # noqa: B902
+                response = error = self.failed(receiver, err)
+            elapsed = time.perf_counter() - started
+            self.record(receiver, elapsed, error, budget, backend)
+            responses.append((receiver, response))
+
+        self.sent(time.perf_counter() - sent, backend)
+        return responses
+
+    async def asend_robust(self, sender, **named):
+        """
+        Sends the signal from async code. Coroutine receivers are awaited, and other receivers
+        are run in a thread, so the event loop is never blocked.
+        """
+        from asgiref.sync import sync_to_async
+
+        if not self.receivers:
+            return []
+
+        backend = metrics.get_backend()
+        budget = receiver_budget()
+        responses = []
+        sent = time.perf_counter()
+        for receiver in self.live_receivers(sender):
+            started = time.perf_counter()
+            error = None
+            try:
+                if asyncio.iscoroutinefunction(receiver):
+                    response = await receiver(signal=self, sender=sender, **named)
+                else:
+                    response = await sync_to_async(receiver)(signal=self, sender=sender, **named)
+            # Like Signal.send_robust, any error of a receiver is logged and returned
+            except Exception as err:  # noqa: B902
+                response = error = self.failed(receiver, err)
+            elapsed = time.perf_counter() - started
+            self.record(receiver, elapsed, error, budget, backend)
+            responses.append((receiver, response))
+
+        self.sent(time.perf_counter() - sent, backend)
+        return responses
+
+    def failed(self, receiver, err):
+        log.error(
+            "Error calling %s in %s.send_robust() (%s)",
+            receiver_name(receiver),
+            self.name,
+            err,
+            exc_info=err,
+        )
+        return err
+
+    def sent(self, elapsed, backend):
+        if backend.enabled:
+            metrics.record_receivers(elapsed)
+            backend.timing("subscriptions.signal", elapsed, {"signal": self.name})
+
+    def record(self, receiver, elapsed, error, budget, backend):
+        name = receiver_name(receiver)
+        slow = budget is not None and elapsed > budget
+        if slow:
+            log.warning(
+                "Slow receiver %s for %s took %.3fs, over the budget of %.3fs",
+                name,
+                self.name,
+                elapsed,
+                budget,
+            )
+        with _stats_lock:
+            stats = _stats.get((self.name, name))
+            if stats is None:
+                stats = _stats[(self.name, name)] = ReceiverStats(self.name, name)
+            stats.record(elapsed, error is not None, slow)
+
+        if backend.enabled:
+            tags = {"signal": self.name, "receiver": name}
+            backend.timing("subscriptions.receiver", elapsed, tags)
+            if error is not None:
+                backend.increment("subscriptions.receiver.errors", 1, tags)
+            if slow:
+                backend.increment("subscriptions.receiver.slow", 1, tags)
+
+
+subscription_due = Signal("subscription_due")
+subscription_ended = Signal("subscription_ended")
+subscription_renewed = Signal("subscription_renewed")
+subscription_error = Signal("subscription_error")
+renewal_failed = Signal("renewal_failed")
+autorenew_canceled = Signal("autorenew_canceled")
+autorenew_enabled = Signal("autorenew_enabled")
+
+# Sent once per chunk by the bulk triggers, with sender=Subscription and pks=[...]
+bulk_subscription_due = Signal("bulk_subscription_due")
+bulk_subscription_ended = Signal("bulk_subscription_ended")
+bulk_subscription_error = Signal("bulk_subscription_error")
+bulk_renewal_failed = Signal("bulk_renewal_failed")
+bulk_subscription_added = Signal("bulk_subscription_added")
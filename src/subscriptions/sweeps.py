@@ -0,0 +1,308 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from . import counters, history, metrics, replicas, signals
+
+__all__ = ["Progress", "chunk_size", "each", "pk_ranges", "sweep"]
+
+"""
+Chunked, resumable iteration over the candidates of a trigger.
+
+Candidates are walked in chunks using keyset pagination on (last_updated, pk). Each
+chunk is processed in its own transaction, which also records the position of the
+chunk in a SweepCursor. If the sweep is interrupted (a worker crash, or a celery
+redelivery of an `acks_late` task), the next run with the same name resumes after
+the last committed chunk rather than starting from the beginning.
+
+With `workers`, the sweep instead runs as a pool of workers that each claim disjoint
+chunks with SELECT ... FOR UPDATE SKIP LOCKED (or a compare-and-swap on last_updated
+where the database can't skip locked rows, with a single worker). Claiming sweeps keep no
+cursor, and any number of them can run at once, in threads or in separate celery workers.
+
+With a `throttle` (see subscriptions.throttle), each chunk is sized to what the throttle
+grants, and the sweep stops early when it grants nothing. The count it returns then also has
+the number of candidates left, as `remaining`.
+
+With `SUBSCRIPTIONS_READ_DATABASE` set, the candidates are scanned on that replica instead, and
+each chunk is checked again on the primary, see subscriptions.replicas.
+
+Usage:
+
+    sweep("renewals", Subscription.objects.renewals_due(), each(Subscription, renew))
+    sweep("renewals", Subscription.objects.renewals_due(), each(Subscription, renew), workers=4)
+"""
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+class Progress(int):
+    """
+    The number of rows a sweep processed, with the number of candidates it left `remaining`
+    when a throttle stopped it early.
+    """
+
+    def __new__(cls, count, remaining=0):
+        progress = super().__new__(cls, count)
+        progress.remaining = remaining
+        return progress
+
+    def __repr__(self):
+        return "Progress({}, remaining={})".format(int(self), self.remaining)
+
+    # Formats as the plain count, as the triggers' return values always have.
+    __str__ = int.__repr__
+
+
+def chunk_size():
+    # type: () -> int
+    return getattr(settings, "SUBSCRIPTIONS_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+
+
+def each(model, action):
+    """
+    Builds a chunk processor that calls `action` with every subscription in the chunk.
+    """
+
+    def process(rows):
+        subscriptions = model._default_manager.filter(pk__in=[pk for pk, _ in rows]).order_by(
+            "last_updated", "pk"
+        )
+        count = 0
+        for subscription in subscriptions:
+            action(subscription)
+            count += 1
+        return count
+
+    return process
+
+
+def measured(name, process, rows, using=None):
+    # History and state counts are written once for the whole chunk, before it commits. The
+    # signals of its transitions are only sent once it has, so receivers never act on a
+    # transition that a later row of the chunk rolls back.
+    with history.buffered(), counters.buffered(), signals.deferred() as pending:
+        with metrics.timer("subscriptions.sweep.chunk", sweep=name):
+            count = process(rows)
+    if pending:
+        transaction.on_commit(lambda: send_measured(name, pending), using=using)
+    backend = metrics.get_backend()
+    if backend.enabled:
+        backend.increment("subscriptions.sweep.rows", count, {"sweep": name})
+    return count
+
+
+def sweep(name, queryset, process, size=None, workers=None, started=None, throttle=None):
+    """
+    Walks `queryset` in chunks of `size`, and returns the sum of `process(rows)` over all chunks.
+
+    `rows` is a list of (pk, state) tuples, locked for update where the database supports it.
+    Only rows last updated before the sweep started are visited, so subscriptions that are
+    touched while the sweep runs are left for the next run. `started` defaults to now, and can
+    be passed to share the clock the candidates were chosen with. When `name` is None no cursor
+    is persisted and the sweep always starts from the beginning. With a read replica configured,
+    the candidates are scanned there, and only the rows that are still candidates on the
+    primary are processed.
+
+    When `workers` is given, `workers` threads claim chunks concurrently instead, and `name`
+    is ignored. `workers=1` claims chunks in the calling thread, which is what separate
+    processes running the same sweep at the same time should use.
+    """
+    if workers:
+        return run_workers(
+            workers,
+            lambda: claiming_sweep(queryset, process, size, name=name, throttle=throttle),
+            using=queryset.db,
+        )
+
+    SweepCursor = apps.get_model("subscriptions", "SweepCursor")
+    size = size or chunk_size()
+    started = started or timezone.now()
+    candidates = queryset.filter(last_updated__lte=started).order_by("last_updated", "pk")
+    scanned = replicas.reading(candidates)
+
+    position = None
+    if name is not None:
+        cursor = SweepCursor.objects.filter(name=name).first()
+        if cursor is not None:
+            position = (cursor.last_updated, cursor.last_id)
+
+    count = 0
+    while True:
+        limit = throttle.grant(size) if throttle else size
+        if not limit:
+            # Stopped early, the cursor is kept for the next run to resume from.
+            return stopped(name, count, after(scanned, position).count())
+        if scanned.db != candidates.db:
+            # Scanned outside the transaction, the primary is only asked about these keys.
+            keys = list(after(scanned, position).values_list("pk", "state", "last_updated")[:limit])
+            if not keys:
+                break
+        with transaction.atomic():
+            if scanned.db != candidates.db:
+                rows = recheck(candidates, keys)
+            else:
+                chunk = after(candidates, position)
+                keys = list(
+                    chunk.select_for_update().values_list("pk", "state", "last_updated")[:limit]
+                )
+                if not keys:
+                    break
+                rows = [(pk, state) for pk, state, _ in keys]
+            if throttle:
+                rows = throttle.admit(queryset.model, rows)
+                throttle.refund(limit - len(rows))
+            count += measured(name, process, rows)
+            pk, _, last_updated = keys[-1]
+            position = (last_updated, pk)
+            if name is not None:
+                SweepCursor.objects.update_or_create(
+                    name=name, defaults={"last_updated": last_updated, "last_id": pk}
+                )
+
+    if throttle:
+        throttle.refund(limit)
+    if name is not None:
+        SweepCursor.objects.filter(name=name).delete()
+    return Progress(count)
+
+
+def send_measured(name, pending):
+    # Sent outside the transition that queued them, so timed for the chunk instead.
+    with metrics.timer("subscriptions.sweep.receivers", sweep=name):
+        signals.send_deferred(pending)
+
+
+def stopped(name, count, remaining):
+    log.warning(
+        "subscriptions.throttle | sweep=%s | count=%s | remaining=%s |", name, count, remaining
+    )
+    return Progress(count, remaining)
+
+
+def recheck(candidates, keys):
+    """
+    Locks and returns the (pk, state) rows of `keys`, read from a replica, that are still
+    `candidates` on the primary.
+    """
+    return list(
+        candidates.filter(pk__in=[pk for pk, _, _ in keys])
+        .select_for_update()
+        .values_list("pk", "state")
+    )
+
+
+def after(candidates, position):
+    """
+    Filters `candidates` to the rows after the (last_updated, pk) `position`, if there is one.
+    """
+    if position is None:
+        return candidates
+    last_updated, last_id = position
+    return candidates.filter(
+        Q(last_updated__gt=last_updated) | Q(last_updated=last_updated, pk__gt=last_id)
+    )
+
+
+def claim(candidates, size):
+    """
+    Claims up to `size` of `candidates` for the current transaction, skipping any rows claimed
+    by a concurrent transaction. Returns the (pk, state) rows that were claimed, and whether
+    any candidates were seen at all.
+    """
+    connection = connections[candidates.db]
+    if connection.features.has_select_for_update_skip_locked:
+        rows = list(
+            candidates.select_for_update(skip_locked=True).values_list("pk", "state")[:size]
+        )
+        return rows, bool(rows)
+
+    # Portable fallback: the first transaction to move last_updated on from the value it
+    # read owns the row, every other transaction updates nothing and moves on.
+    seen = list(candidates.values_list("pk", "state", "last_updated")[:size])
+    claimed_at = timezone.now()
+    manager = candidates.model._base_manager.using(candidates.db)
+    rows = [
+        (pk, state)
+        for pk, state, last_updated in seen
+        if manager.filter(pk=pk, state=state, last_updated=last_updated).update(
+            last_updated=claimed_at
+        )
+    ]
+    return rows, bool(seen)
+
+
+def claiming_sweep(queryset, process, size=None, name=None, throttle=None):
+    """
+    Processes claimed chunks of `queryset` until no candidates remain, and returns the sum of
+    `process(rows)`. Safe to run concurrently with other claiming sweeps over the same rows.
+    """
+    size = size or chunk_size()
+    candidates = queryset.filter(last_updated__lte=timezone.now()).order_by("last_updated", "pk")
+    count = 0
+    # Rows the throttle passed over are left as they were, and would be claimed again first.
+    passed = set()
+    while True:
+        limit = throttle.grant(size) if throttle else size
+        if not limit:
+            return stopped(name, count, candidates.exclude(pk__in=passed).count())
+        with transaction.atomic(using=candidates.db):
+            rows, seen = claim(candidates.exclude(pk__in=passed), limit)
+            if not seen:
+                break
+            if throttle:
+                admitted = throttle.admit(queryset.model, rows)
+                throttle.refund(limit - len(admitted))
+                passed.update(pk for pk, _ in set(rows) - set(admitted))
+                rows = admitted
+            if rows:
+                count += measured(name, process, rows, using=candidates.db)
+    if throttle:
+        throttle.refund(limit)
+    return Progress(count)
+
+
+def run_workers(workers, target, using=DEFAULT_DB_ALIAS):
+    """
+    Calls `target` once from each of `workers` threads, and returns the sum of the results.
+
+    Databases that can't skip locked rows (SQLite among them) get a single worker, as workers
+    claiming with the portable fallback would only wait on, or deadlock with, each other.
+    """
+    if workers == 1 or not connections[using].features.has_select_for_update_skip_locked:
+        return target()
+
+    def work():
+        try:
+            return target()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(work) for _ in range(workers)]
+        results = [future.result() for future in futures]
+    # Every worker counts the same candidates left over, so take the latest count.
+    return Progress(sum(results), min(getattr(result, "remaining", 0) for result in results))
+
+
+def pk_ranges(queryset, shards):
+    """
+    Splits the pks of `queryset` into at most `shards` contiguous, inclusive (first, last) ranges
+    of equal width.
+    """
+    bounds = queryset.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return []
+    width = -(-(bounds["last"] - bounds["first"] + 1) // shards)
+    return [
+        (first, min(first + width - 1, bounds["last"]))
+        for first in range(bounds["first"], bounds["last"] + 1, width)
+    ]
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
-from celery import shared_task
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
 
+from . import outbox
+from .archive import archive_ended
 from .models import Subscription
+from .sweeps import pk_ranges
 
 """
 Celery tasks that can be directly added to a projects' Celery Beat configuration,
@@ -16,42 +19,122 @@ log = get_task_logger(__name__)
 
 
 def log_update(trigger: str, count: int):
+    remaining = getattr(count, "remaining", 0)
+    if remaining:
+        log.info(
+            "subscriptions.trigger | trigger=%s | count=%s | remaining=%s |",
+            trigger,
+            count,
+            remaining,
+        )
+        return
     log.info("subscriptions.trigger | trigger=%s | count=%s |", trigger, count)
 
 
+def log_counts(counts):
+    counts = dict(counts)
+    remaining = counts.pop("remaining", 0)
+    for trigger, count in counts.items():
+        log_update(trigger, count)
+    if remaining:
+        log.info("subscriptions.trigger | remaining=%s |", remaining)
+
+
 @shared_task(acks_late=True)
-def trigger_renewals():
-    count = Subscription.objects.trigger_renewals()
+def trigger_renewals(bulk=False, workers=None):
+    count = Subscription.objects.trigger_renewals(bulk=bulk, workers=workers)
     log_update("renewals", count)
     return count
 
 
 @shared_task(acks_late=True)
-def trigger_expiring():
-    count = Subscription.objects.trigger_expiring()
+def trigger_expiring(bulk=False):
+    count = Subscription.objects.trigger_expiring(bulk=bulk)
     log_update("expiring", count)
     return count
 
 
 @shared_task(acks_late=True)
-def trigger_suspended():
-    count = Subscription.objects.trigger_suspended()
+def trigger_suspended(bulk=False, workers=None):
+    count = Subscription.objects.trigger_suspended(bulk=bulk, workers=workers)
     log_update("suspended", count)
     return count
 
 
 @shared_task(acks_late=True)
-def trigger_suspended_timeout(hours=48, days=None):
+def trigger_suspended_timeout(hours=48, days=None, bulk=False):
     if days is not None:
         hours = days * 24
 
-    count = Subscription.objects.trigger_suspended_timeout(timeout_hours=hours)
+    count = Subscription.objects.trigger_suspended_timeout(timeout_hours=hours, bulk=bulk)
     log_update("timeout", count)
     return count
 
 
 @shared_task(acks_late=True)
-def trigger_stuck(hours=2):
-    count = Subscription.objects.trigger_stuck(timeout_hours=hours)
+def trigger_stuck(hours=2, bulk=False):
+    count = Subscription.objects.trigger_stuck(timeout_hours=hours, bulk=bulk)
     log_update("stuck", count)
     return count
+
+
+@shared_task(acks_late=True)
+def tick(timeout_hours=48, stuck_hours=2):
+    """
+    Runs all five triggers in one sweep, in place of scheduling each of them.
+    """
+    counts = Subscription.objects.tick(timeout_hours=timeout_hours, stuck_hours=stuck_hours)
+    log_counts(counts)
+    return counts
+
+
+@shared_task(acks_late=True)
+def run_due():
+    """
+    Runs every trigger for the subscriptions that are due, found by `next_action_at`.
+    """
+    counts = Subscription.objects.run_due()
+    log_counts(counts)
+    return counts
+
+
+@shared_task(acks_late=True)
+def fan_out_renewals(shards=8, bulk=False):
+    """
+    Splits the due subscriptions into `shards` pk ranges, and renews each range in its own
+    task. The per-shard counts are added up and logged by `log_shards` once every shard is
+    done, so a result backend must be configured. Returns the number of shards dispatched.
+    """
+    ranges = pk_ranges(Subscription.objects.renewals_due(), shards)
+    if not ranges:
+        log_update("renewals", 0)
+        return 0
+    header = [trigger_renewals_shard.s(first, last, bulk=bulk) for first, last in ranges]
+    chord(header)(log_shards.s("renewals"))
+    return len(ranges)
+
+
+@shared_task(acks_late=True)
+def trigger_renewals_shard(first_pk, last_pk, bulk=False):
+    return Subscription.objects.shard(first_pk, last_pk).trigger_renewals(bulk=bulk)
+
+
+@shared_task
+def log_shards(counts, trigger):
+    count = sum(counts)
+    log_update(trigger, count)
+    return count
+
+
+@shared_task(acks_late=True)
+def archive_subscriptions(days=None):
+    count = archive_ended(days=days)
+    log_update("archive", count)
+    return count
+
+
+@shared_task(acks_late=True)
+def deliver_signals():
+    count = outbox.deliver()
+    log.info("subscriptions.outbox | delivered=%s |", count)
+    return count
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+import time
+import typing as t
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .states import SubscriptionState as State
+
+__all__ = ["Throttle", "TokenBucket", "jitter", "renewals"]
+
+"""
+Rate limiting for the triggers that renew subscriptions.
+
+With `settings.SUBSCRIPTIONS_RENEWAL_RATE` set, renewals are paced by a token bucket of that
+many subscriptions per second, holding at most `SUBSCRIPTIONS_RENEWAL_BURST` tokens (the rate,
+by default). Each chunk of a throttled sweep is sized to the tokens available, waiting for at
+least one. A run that can't get a token within `SUBSCRIPTIONS_RENEWAL_MAX_WAIT` seconds (60 by
+default) of starting stops early, keeping its cursor, and reports the candidates it left as
+`remaining` on the count it returns. The bucket is shared by the threads of a process, not between
+processes, so divide the provider's limit by the number of processes running triggers.
+
+With `SUBSCRIPTIONS_RENEWAL_JITTER` set to a number of seconds, every subscription is renewed
+up to that long after its `end`, at an offset derived from its pk, which spreads renewals that
+were bought together across the window. Subscriptions inside their window are passed over, and
+picked up by a later run.
+
+Usage:
+
+    sweep("renewals", candidates, process, throttle=throttle.renewals())
+"""
+
+
+DEFAULT_MAX_WAIT = 60
+
+
+def rate():
+    # type: () -> t.Optional[float]
+    return getattr(settings, "SUBSCRIPTIONS_RENEWAL_RATE", None)
+
+
+def jitter_window():
+    # type: () -> float
+    return getattr(settings, "SUBSCRIPTIONS_RENEWAL_JITTER", 0)
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket that refills at `rate` tokens per second, up to `burst`.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, wanted, timeout):
+        # type: (int, float) -> int
+        """
+        Takes up to `wanted` tokens, waiting at most `timeout` seconds for the first one, and
+        returns how many were taken.
+        """
+        deadline = self.clock() + timeout
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    taken = min(wanted, int(self.tokens))
+                    self.tokens -= taken
+                    return taken
+                wait = (1 - self.tokens) / self.rate
+            if self.clock() + wait > deadline:
+                return 0
+            self.sleep(wait)
+
+    def put(self, tokens):
+        """
+        Returns `tokens` that were taken but not used.
+        """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+
+_bucket = None
+
+
+def bucket():
+    # type: () -> TokenBucket
+    global _bucket
+    if _bucket is None:
+        # Only asked for once a rate is set, see renewals()
+        per_second = t.cast(float, rate())
+        burst = getattr(settings, "SUBSCRIPTIONS_RENEWAL_BURST", None) or max(1, per_second)
+        _bucket = TokenBucket(per_second, burst)
+    return _bucket
+
+
+@receiver(setting_changed)
+def reset_bucket(setting, **kwargs):
+    global _bucket
+    if setting.startswith("SUBSCRIPTIONS_RENEWAL_"):
+        _bucket = None
+
+
+def jitter(pk):
+    # type: (int) -> timedelta
+    """
+    The deterministic offset of subscription `pk` within the jitter window.
+    """
+    digest = hashlib.md5(str(pk).encode("ascii")).digest()
+    fraction = int.from_bytes(digest[:4], "big") / 2**32
+    return timedelta(seconds=jitter_window() * fraction)
+
+
+class Throttle:
+    """
+    The throttling of one run of a sweep: how many rows each chunk may have, and which of
+    them are due once jittered.
+    """
+
+    def __init__(self, bucket=None, window=0, max_wait=DEFAULT_MAX_WAIT):
+        self.bucket = bucket
+        self.window = window
+        self.now = timezone.now()
+        self.clock = bucket.clock if bucket is not None else time.monotonic
+        self.deadline = self.clock() + max_wait
+
+    def grant(self, wanted):
+        # type: (int) -> int
+        """
+        How many rows the next chunk may have. 0 means the run should stop.
+        """
+        if self.bucket is None:
+            return wanted
+        return self.bucket.take(wanted, max(0, self.deadline - self.clock()))
+
+    def refund(self, unused):
+        if self.bucket is not None and unused > 0:
+            self.bucket.put(unused)
+
+    def admit(self, model, rows):
+        """
+        Leaves out the (pk, state) rows that would renew before their jittered time.
+        """
+        renewing = [pk for pk, state in rows if state in (State.ACTIVE, State.SUSPENDED)]
+        if not self.window or not renewing:
+            return rows
+        ends = dict(model._base_manager.filter(pk__in=renewing).values_list("pk", "end"))
+        return [
+            (pk, state) for pk, state in rows if pk not in ends or ends[pk] + jitter(pk) < self.now
+        ]
+
+
+def renewals():
+    """
+    A Throttle for a run of a trigger that renews subscriptions, or None if renewals aren't
+    throttled.
+    """
+    window = jitter_window()
+    if rate() is None and not window:
+        return None
+    return Throttle(
+        bucket=bucket() if rate() is not None else None,
+        window=window,
+        max_wait=getattr(settings, "SUBSCRIPTIONS_RENEWAL_MAX_WAIT", DEFAULT_MAX_WAIT),
+    )
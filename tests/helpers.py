@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+@contextmanager
+def capture_on_commit_callbacks(using=DEFAULT_DB_ALIAS, execute=False):
+    """
+    `TestCase.captureOnCommitCallbacks()`, which is only available from Django 3.2: captures the
+    `transaction.on_commit` callbacks registered inside the block, and runs them on the way out
+    if `execute`.
+    """
+    callbacks = []
+    start = len(connections[using].run_on_commit)
+    try:
+        yield callbacks
+    finally:
+        # Entries are (savepoint ids, callback) tuples, with a third `robust` item on Django 4.2
+        callbacks[:] = [entry[1] for entry in connections[using].run_on_commit[start:]]
+        if execute:
+            for callback in callbacks:
+                callback()
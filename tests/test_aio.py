@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from django.utils import timezone
+from subscriptions import signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+class AsyncTestCase(TestCase):
+    sigs = [signals.subscription_due, signals.subscription_renewed, signals.subscription_error]
+
+    def setUp(self):
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+        self.calls = []
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    async def receiver(self, sender, signal, **kwargs):
+        self.calls.append((signal, sender))
+
+    def test_transition(self):
+        signals.subscription_renewed.connect(self.receiver)
+        sub = Subscription.objects.create(state=State.RENEWING, end=timezone.now())
+        new_end = timezone.now() + timedelta(days=30)
+        async_to_sync(sub.arenewed)(new_end, "new", description="paid")
+
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual((sub.state, sub.end, sub.reference), (State.ACTIVE, new_end, "new"))
+        self.assertEqual(self.calls, [(signals.subscription_renewed, sub)])
+
+    def test_sync_receivers(self):
+        calls = []
+
+        def receiver(sender, **kwargs):
+            calls.append(sender)
+
+        signals.subscription_due.connect(receiver)
+        sub = Subscription.objects.create(end=timezone.now())
+        async_to_sync(sub.arenew)()
+        self.assertEqual(calls, [sub])
+
+    def test_async_receiver_from_sync_code(self):
+        signals.subscription_due.connect(self.receiver)
+        sub = Subscription.objects.create(end=timezone.now())
+        sub.renew()
+        self.assertEqual(self.calls, [(signals.subscription_due, sub)])
+
+    def test_trigger_overlaps_receivers(self):
+        in_flight = []
+        peak = []
+
+        async def receiver(sender, **kwargs):
+            in_flight.append(sender)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(sender)
+
+        signals.subscription_due.connect(receiver)
+        for _ in range(6):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        Subscription.objects.create(end=timezone.now() + timedelta(days=1))
+
+        count = async_to_sync(Subscription.objects.atrigger_renewals)(concurrency=3)
+
+        self.assertEqual(count, 6)
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(Subscription.objects.filter(state=State.RENEWING).count(), 6)
+
+    def test_trigger_stuck(self):
+        signals.subscription_error.connect(self.receiver)
+        sub = Subscription.objects.create(state=State.RENEWING, end=timezone.now())
+        Subscription.objects.filter(pk=sub.pk).update(
+            last_updated=timezone.now() - timedelta(hours=3)
+        )
+
+        self.assertEqual(async_to_sync(Subscription.objects.atrigger_stuck)(), 1)
+        self.assertEqual(Subscription.objects.get(pk=sub.pk).state, State.ERROR)
+        self.assertEqual(self.calls, [(signals.subscription_error, sub)])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions.archive import archive_ended
+from subscriptions.models import ArchivedSubscription, Subscription
+from subscriptions.states import SubscriptionState as State
+from subscriptions.tasks import archive_subscriptions
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.old = [
+            Subscription.objects.create(
+                state=State.ENDED, end=now - timedelta(days=400), reference="old", reason="bye"
+            )
+            for _ in range(3)
+        ]
+        self.recent = Subscription.objects.create(state=State.ENDED, end=now - timedelta(days=5))
+        self.active = Subscription.objects.create(state=State.ACTIVE, end=now - timedelta(days=400))
+
+    def test_moves_old_ended(self):
+        self.assertEqual(archive_ended(size=2), 3)
+
+        self.assertEqual(
+            set(Subscription.objects.values_list("pk", flat=True)),
+            {self.recent.pk, self.active.pk},
+        )
+        archived = ArchivedSubscription.objects.get(pk=self.old[0].pk)
+        self.assertEqual(archived.state, State.ENDED)
+        self.assertEqual((archived.reference, archived.reason), ("old", "bye"))
+        self.assertEqual((archived.start, archived.end), (self.old[0].start, self.old[0].end))
+        self.assertIsNotNone(archived.archived)
+
+    def test_retention(self):
+        self.assertEqual(archive_ended(days=1), 4)
+        self.assertEqual(list(Subscription.objects.values_list("pk", flat=True)), [self.active.pk])
+
+    @override_settings(SUBSCRIPTIONS_ARCHIVE_DAYS=1000)
+    def test_retention_setting(self):
+        self.assertEqual(archive_subscriptions(), 0)
+
+    @mock.patch("subscriptions.archive.time.sleep")
+    def test_pause_between_chunks(self, sleep):
+        archive_ended(size=2, pause=0.5)
+        sleep.assert_called_once_with(0.5)
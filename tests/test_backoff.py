@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions import backoff, signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+class BackoffTestCase(TestCase):
+    sigs = [signals.subscription_due, signals.renewal_failed, signals.subscription_renewed]
+
+    def setUp(self):
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    def test_delay(self):
+        hours = [backoff.delay(attempt) / timedelta(hours=1) for attempt in range(1, 8)]
+        self.assertEqual(hours, [1, 2, 4, 8, 16, 24, 24])
+        with self.settings(SUBSCRIPTIONS_RETRY_BASE=0):
+            self.assertEqual(backoff.delay(3), timedelta(0))
+
+    def test_retry_scheduled(self):
+        sub = Subscription.objects.create(state=State.RENEWING, end=timezone.now())
+        now = timezone.now()
+        with mock.patch("subscriptions.backoff.timezone.now", return_value=now):
+            sub.renewal_failed()
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(sub.retry_attempts, 1)
+        self.assertEqual(sub.next_retry_at, now + timedelta(hours=1))
+
+        sub.renew()
+        sub.renewal_failed()
+        self.assertEqual(Subscription.objects.get(pk=sub.pk).retry_attempts, 2)
+
+        sub.renewed(timezone.now() + timedelta(days=30), "renewed")
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual((sub.retry_attempts, sub.next_retry_at), (0, None))
+
+    def test_trigger_suspended_waits_for_retry(self):
+        end = timezone.now() - timedelta(hours=1)
+        waiting = Subscription.objects.create(
+            state=State.SUSPENDED, end=end, next_retry_at=timezone.now() + timedelta(hours=1)
+        )
+        due = Subscription.objects.create(
+            state=State.SUSPENDED, end=end, next_retry_at=timezone.now() - timedelta(minutes=1)
+        )
+        unscheduled = Subscription.objects.create(state=State.SUSPENDED, end=end)
+
+        self.assertEqual(Subscription.objects.trigger_suspended(), 2)
+        self.assertEqual(Subscription.objects.get(pk=waiting.pk).state, State.SUSPENDED)
+        self.assertEqual(Subscription.objects.get(pk=due.pk).state, State.RENEWING)
+        self.assertEqual(Subscription.objects.get(pk=unscheduled.pk).state, State.RENEWING)
+        self.assertEqual(Subscription.objects.tick()["suspended"], 0)
+
+    @override_settings(SUBSCRIPTIONS_STUCK_RETRY=True)
+    def test_bulk_stuck_retry(self):
+        first = Subscription.objects.create(state=State.RENEWING, end=timezone.now())
+        third = Subscription.objects.create(
+            state=State.RENEWING, end=timezone.now(), retry_attempts=2
+        )
+        Subscription.objects.update(last_updated=timezone.now() - timedelta(hours=3))
+
+        now = timezone.now()
+        with mock.patch("subscriptions.models.timezone.now", return_value=now):
+            self.assertEqual(Subscription.objects.trigger_stuck(bulk=True), 2)
+        first, third = Subscription.objects.get(pk=first.pk), Subscription.objects.get(pk=third.pk)
+        self.assertEqual((first.retry_attempts, first.next_retry_at), (1, now + timedelta(hours=1)))
+        self.assertEqual((third.retry_attempts, third.next_retry_at), (3, now + timedelta(hours=4)))
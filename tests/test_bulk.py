@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_fsm_log.models import StateLog
+from subscriptions import signals
+from subscriptions.bulk import returns_pks
+from subscriptions.models import StateChange, Subscription
+from subscriptions.states import SubscriptionState as State
+from tests.helpers import capture_on_commit_callbacks
+
+
+class BulkAddTestCase(TestCase):
+    def setUp(self):
+        self.start = timezone.now()
+        self.end = self.start + timedelta(days=30)
+
+    def rows(self, *references):
+        return ((self.start, self.end, reference) for reference in references)
+
+    def test_add_in_batches(self):
+        # savepoint, insert, history insert, release (and reading back the pks without RETURNING)
+        per_batch = 4 if returns_pks(connection.alias) else 6
+        with self.assertNumQueries(3 * per_batch):
+            count = Subscription.objects.add_subscriptions_bulk(
+                self.rows("a", "b", "c", "d", "e"), batch_size=2
+            )
+        self.assertEqual(count, 5)
+        subscriptions = Subscription.objects.order_by("pk")
+        self.assertEqual([sub.reference for sub in subscriptions], ["a", "b", "c", "d", "e"])
+        self.assertEqual({sub.state for sub in subscriptions}, {State.ACTIVE})
+
+        logs = StateLog.objects.order_by("object_id")
+        self.assertEqual([log.object_id for log in logs], [sub.pk for sub in subscriptions])
+        self.assertEqual(
+            {(log.source_state, log.transition) for log in logs}, {(None, "add_subscription")}
+        )
+
+    def test_pks_read_back(self):
+        Subscription.objects.add_subscription(self.start, self.end, "a")
+        with mock.patch("subscriptions.bulk.returns_pks", return_value=False):
+            count = Subscription.objects.add_subscriptions_bulk(self.rows("a", "b"))
+        self.assertEqual(count, 2)
+        added = Subscription.objects.order_by("pk").values_list("pk", flat=True)[1:]
+        logs = StateLog.objects.filter(transition="add_subscription").order_by("object_id")
+        self.assertEqual([log.object_id for log in logs], list(added))
+
+    def test_returns_pks_before_django_3(self):
+        features = mock.Mock(spec=["can_return_ids_from_bulk_insert"])
+        features.can_return_ids_from_bulk_insert = True
+        with mock.patch.object(connection, "features", features):
+            self.assertTrue(returns_pks(connection.alias))
+
+    def test_skip_existing(self):
+        Subscription.objects.add_subscription(self.start, self.end, "a")
+        count = Subscription.objects.add_subscriptions_bulk(
+            self.rows("a", "b", "b", "c", "b"), batch_size=2, skip_existing=True
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            sorted(Subscription.objects.values_list("reference", flat=True)), ["a", "b", "c"]
+        )
+
+    def test_signal_per_batch(self):
+        handler = mock.Mock()
+        signals.bulk_subscription_added.connect(handler)
+        self.addCleanup(signals.bulk_subscription_added.disconnect, handler)
+
+        with capture_on_commit_callbacks(execute=True):
+            Subscription.objects.add_subscriptions_bulk(
+                self.rows("a", "b", "c"), batch_size=2, signal=True
+            )
+        pks = list(Subscription.objects.order_by("pk").values_list("pk", flat=True))
+        self.assertEqual(
+            [call.kwargs["pks"] for call in handler.call_args_list], [pks[:2], pks[2:]]
+        )
+
+    @override_settings(SUBSCRIPTIONS_COMPACT_HISTORY=True, SUBSCRIPTIONS_STATE_COUNTS=True)
+    def test_compact_history_and_counts(self):
+        Subscription.objects.add_subscriptions_bulk(self.rows("a", "b"))
+        self.assertEqual(StateChange.objects.filter(state=State.ACTIVE).count(), 2)
+        self.assertFalse(StateLog.objects.exists())
+        self.assertEqual(Subscription.objects.count_in_state(State.ACTIVE), 2)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from subscriptions import cache, metrics, signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+from tests.helpers import capture_on_commit_callbacks
+
+
+@override_settings(SUBSCRIPTIONS_CACHE="default", SUBSCRIPTIONS_CACHE_LOCAL_SIZE=1000)
+class ReferenceCacheTestCase(TestCase):
+    sigs = [
+        signals.subscription_ended,
+        signals.subscription_renewed,
+        signals.bulk_subscription_ended,
+    ]
+
+    def setUp(self):
+        backend = override_settings(
+            SUBSCRIPTIONS_METRICS_BACKEND="tests.test_metrics.RecordingBackend"
+        )
+        backend.enable()
+        self.addCleanup(backend.disable)
+        caches["default"].clear()
+        cache.local_cache().entries.clear()
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+        Subscription.objects.create(end=timezone.now(), reference="live")
+        Subscription.objects.create(state=State.ENDED, end=timezone.now(), reference="ended")
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    def counts(self, name):
+        backend = metrics.get_backend()
+        return {tags.get("tier"): value for (n, value, tags) in backend.increments if n == name}
+
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                Subscription.objects.subscribed(["live", "ended", "unknown"]),
+                {"live": True, "ended": False, "unknown": False},
+            )
+        with self.assertNumQueries(0):
+            self.assertTrue(Subscription.objects.is_subscribed("live"))
+            self.assertFalse(Subscription.objects.is_subscribed("unknown"))
+        self.assertEqual(self.counts("subscriptions.cache.miss"), {None: 3})
+        self.assertEqual(self.counts("subscriptions.cache.hit"), {"local": 1})
+
+    def test_shared_tier(self):
+        Subscription.objects.is_subscribed("live")
+        cache.local_cache().entries.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(Subscription.objects.is_subscribed("live"))
+        self.assertEqual(self.counts("subscriptions.cache.hit"), {"shared": 1})
+
+    def test_invalidated_by_transition(self):
+        self.assertTrue(Subscription.objects.is_subscribed("live"))
+        sub = Subscription.objects.get(reference="live")
+        with capture_on_commit_callbacks(execute=True):
+            sub.end_subscription()
+        self.assertFalse(Subscription.objects.is_subscribed("live"))
+
+    def test_invalidated_by_create(self):
+        self.assertFalse(Subscription.objects.is_subscribed("new"))
+        with capture_on_commit_callbacks(execute=True):
+            Subscription.objects.add_subscription(timezone.now(), timezone.now(), "new")
+        self.assertTrue(Subscription.objects.is_subscribed("new"))
+
+    def test_renewed_reference_change(self):
+        sub = Subscription.objects.create(state=State.RENEWING, end=timezone.now(), reference="a")
+        self.assertEqual(Subscription.objects.subscribed(["a", "b"]), {"a": False, "b": False})
+        with capture_on_commit_callbacks(execute=True):
+            sub.renewed(timezone.now() + timedelta(days=30), "b")
+        self.assertEqual(Subscription.objects.subscribed(["a", "b"]), {"a": False, "b": True})
+
+    def test_invalidated_by_bulk(self):
+        Subscription.objects.create(
+            state=State.EXPIRING, end=timezone.now() - timedelta(days=1), reference="expiring"
+        )
+        self.assertTrue(Subscription.objects.is_subscribed("expiring"))
+        with capture_on_commit_callbacks(execute=True):
+            Subscription.objects.trigger_expiring(bulk=True)
+        self.assertFalse(Subscription.objects.is_subscribed("expiring"))
+
+    def test_not_invalidated_before_commit(self):
+        self.assertTrue(Subscription.objects.is_subscribed("live"))
+        with capture_on_commit_callbacks(execute=False) as callbacks:
+            Subscription.objects.get(reference="live").end_subscription()
+        self.assertTrue(Subscription.objects.is_subscribed("live"))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_fill_after_invalidate(self):
+        lookup = cache.lookup
+
+        def racing(queryset, references):
+            # The transition commits after the database was read, but before the fill.
+            found = lookup(queryset, references)
+            with capture_on_commit_callbacks(execute=True):
+                Subscription.objects.get(reference="live").end_subscription()
+            return found
+
+        with mock.patch("subscriptions.cache.lookup", side_effect=racing):
+            self.assertTrue(Subscription.objects.is_subscribed("live"))
+        self.assertFalse(Subscription.objects.is_subscribed("live"))
+        cache.local_cache().entries.clear()
+        self.assertFalse(Subscription.objects.is_subscribed("live"))
+
+
+@override_settings(SUBSCRIPTIONS_CACHE="default")
+class DefaultCacheTestCase(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        Subscription.objects.create(end=timezone.now(), reference="live")
+
+    def test_no_local_tier(self):
+        self.assertTrue(Subscription.objects.is_subscribed("live"))
+        self.assertEqual(cache.local_cache().entries, {})
+        with self.assertNumQueries(0):
+            self.assertTrue(Subscription.objects.is_subscribed("live"))
+        with capture_on_commit_callbacks(execute=True):
+            Subscription.objects.get(reference="live").end_subscription()
+        self.assertFalse(Subscription.objects.is_subscribed("live"))
+
+
+class LocalCacheTestCase(TestCase):
+    def test_bounded(self):
+        local = cache.LocalCache(size=2, timeout=60)
+        local.set_many({"a": True, "b": False})
+        local.get_many(["a"])
+        local.set_many({"c": True})
+        self.assertEqual(local.get_many(["a", "b", "c"]), {"a": True, "c": True})
+
+    def test_add_many(self):
+        local = cache.LocalCache(size=2, timeout=60)
+        local.set_many({"a": cache.TOMBSTONE})
+        local.add_many({"a": True, "b": False})
+        self.assertEqual(local.get_many(["a", "b"]), {"a": cache.TOMBSTONE, "b": False})
+
+    @mock.patch("subscriptions.cache.time.monotonic")
+    def test_expiry(self, monotonic):
+        monotonic.return_value = 100
+        local = cache.LocalCache(size=2, timeout=1)
+        local.set_many({"a": True})
+        monotonic.return_value = 101
+        self.assertEqual(local.get_many(["a"]), {})
+
+    def test_disabled(self):
+        with override_settings(SUBSCRIPTIONS_CACHE=None):
+            Subscription.objects.create(end=timezone.now(), reference="live")
+            with CaptureQueriesContext(connection) as queries:
+                Subscription.objects.is_subscribed("live")
+                Subscription.objects.is_subscribed("live")
+            self.assertEqual(len(queries), 2)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from subscriptions import signals
+from subscriptions.archive import archive_ended
+from subscriptions.models import StateCount, Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+@override_settings(SUBSCRIPTIONS_STATE_COUNTS=True)
+class StateCountTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def counts(self):
+        return {
+            state: count for state, count in Subscription.objects.state_counts().items() if count
+        }
+
+    def test_create_transition_delete(self):
+        sub = Subscription.objects.create(end=timezone.now())
+        self.assertEqual(self.counts(), {State.ACTIVE: 1})
+        sub.renew()
+        self.assertEqual(self.counts(), {State.RENEWING: 1})
+        self.assertEqual(Subscription.objects.count_in_state(State.RENEWING), 1)
+        sub.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_transition_before_first_save(self):
+        sub = Subscription(end=timezone.now())
+        sub.renew()
+        self.assertEqual(self.counts(), {State.RENEWING: 1})
+        call_command("reconcile_state_counts", stdout=StringIO())
+        self.assertEqual(self.counts(), {State.RENEWING: 1})
+
+    def test_transition_and_count_commit_together(self):
+        sub = Subscription.objects.create(end=timezone.now())
+        with mock.patch("subscriptions.counters.write", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                sub.renew()
+        self.assertEqual(Subscription.objects.get(pk=sub.pk).state, State.ACTIVE)
+        self.assertEqual(self.counts(), {State.ACTIVE: 1})
+
+    def test_sweep_writes_once_per_chunk(self):
+        for _ in range(4):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        Subscription.objects.create(end=timezone.now() + timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            Subscription.objects.trigger_renewals()
+
+        updates = [q for q in queries if q["sql"].startswith('UPDATE "subscriptions_statecount"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.counts(), {State.ACTIVE: 1, State.RENEWING: 4})
+
+    def test_bulk_and_archive(self):
+        for _ in range(3):
+            Subscription.objects.create(
+                state=State.EXPIRING, end=timezone.now() - timedelta(days=1)
+            )
+        Subscription.objects.trigger_expiring(bulk=True)
+        self.assertEqual(self.counts(), {State.ENDED: 3})
+
+        archive_ended(days=0)
+        self.assertEqual(self.counts(), {})
+
+    def test_reconcile(self):
+        for _ in range(2):
+            Subscription.objects.create(end=timezone.now())
+        StateCount.objects.all().delete()
+        self.assertEqual(self.counts(), {})
+
+        out = StringIO()
+        call_command("reconcile_state_counts", stdout=out)
+        self.assertIn("ACTIVE: 2", out.getvalue())
+        self.assertEqual(self.counts(), {State.ACTIVE: 2})
+
+    def test_matches_full_count(self):
+        Subscription.objects.create(end=timezone.now())
+        Subscription.objects.create(state=State.SUSPENDED, end=timezone.now())
+        with self.settings(SUBSCRIPTIONS_STATE_COUNTS=False):
+            full = Subscription.objects.state_counts()
+        self.assertEqual(Subscription.objects.state_counts(), full)
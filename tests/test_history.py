@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_fsm_log.models import StateLog
+from subscriptions import signals
+from subscriptions.archive import archive_ended
+from subscriptions.models import StateChange, Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+@override_settings(
+    SUBSCRIPTIONS_COMPACT_HISTORY=True,
+    DJANGO_FSM_LOG_IGNORED_MODELS=["subscriptions.models.Subscription"],
+)
+class CompactHistoryTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers, signals.subscription_ended.receivers
+        signals.subscription_due.receivers = []
+        signals.subscription_ended.receivers = []
+
+    def tearDown(self):
+        signals.subscription_due.receivers, signals.subscription_ended.receivers = self.receivers
+
+    def test_transition(self):
+        user = get_user_model().objects.create(username="admin")
+        sub = Subscription.objects.create(state=State.SUSPENDED, end=timezone.now())
+        sub.end_subscription(by=user, description="LetItGo")
+
+        change = sub.history.get()
+        self.assertEqual((change.source_state, change.state), (State.SUSPENDED, State.ENDED))
+        self.assertEqual(change.transition, "end_subscription")
+        self.assertEqual((change.by, change.description), (user, "LetItGo"))
+        self.assertFalse(StateLog.objects.exists())
+
+    def test_sweep_writes_once_per_chunk(self):
+        for _ in range(4):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2):
+            with CaptureQueriesContext(connection) as queries:
+                Subscription.objects.trigger_renewals()
+
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "subscriptions_statechange"')
+        ]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(StateChange.objects.filter(transition="renew").count(), 4)
+
+    def test_bulk(self):
+        for _ in range(3):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        Subscription.objects.trigger_renewals(bulk=True)
+
+        self.assertEqual(
+            list(StateChange.objects.values_list("source_state", "state").distinct()),
+            [(State.ACTIVE, State.RENEWING)],
+        )
+        self.assertEqual(StateChange.objects.count(), 3)
+        self.assertFalse(StateLog.objects.exists())
+
+    def test_kept_when_archived(self):
+        sub = Subscription.objects.create(end=timezone.now() - timedelta(days=400))
+        sub.end_subscription()
+        Subscription.objects.filter(pk=sub.pk).update(end=timezone.now() - timedelta(days=400))
+        archive_ended()
+        self.assertEqual(StateChange.objects.get().subscription_id, sub.pk)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from unittest import skipUnless
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from subscriptions import schedule
+from subscriptions.models import Subscription
+
+
+class TriggerIndexTestCase(TestCase):
+    """
+    Asserts that the planner picks the index made for each trigger query, in the shape the
+    sweeps actually run it.
+    """
+
+    def assertUsesIndex(self, queryset, index):
+        chunk = queryset.filter(last_updated__lte=timezone.now()).order_by("last_updated", "pk")
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # An empty table is always cheapest to scan sequentially
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = chunk[:500].explain()
+        self.assertIn(index, plan)
+
+    def test_renewals_due(self):
+        self.assertUsesIndex(Subscription.objects.renewals_due(), "subscription_trigger_idx")
+
+    def test_expiring(self):
+        self.assertUsesIndex(Subscription.objects.expiring(), "subscription_trigger_idx")
+
+    def test_suspended(self):
+        self.assertUsesIndex(Subscription.objects.suspended(), "subscription_trigger_idx")
+
+    def test_suspended_timeout(self):
+        self.assertUsesIndex(Subscription.objects.suspended_timeout(), "subscription_trigger_idx")
+
+    def test_stuck(self):
+        self.assertUsesIndex(Subscription.objects.stuck(), "subscription_lease_idx")
+
+    def test_actionable(self):
+        self.assertUsesIndex(Subscription.objects.actionable(), "subscription_trigger_idx")
+
+
+class LookupIndexTestCase(TestCase):
+    """
+    Asserts that the lookups made for an index use it, however the planner would cost them.
+    """
+
+    def plan(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+
+    def test_for_reference(self):
+        plan = self.plan(Subscription.objects.for_reference("customer-1"))
+        self.assertIn("subscription_reference_idx", plan)
+
+    def test_for_references(self):
+        plan = self.plan(Subscription.objects.for_references(["customer-1", "customer-2"]))
+        self.assertIn("subscription_reference_idx", plan)
+
+    @skipUnless(connection.vendor == "postgresql", "SQLite can't use an index for LIKE")
+    def test_reference_startswith(self):
+        plan = self.plan(Subscription.objects.reference_startswith("customer-"))
+        self.assertIn("subscription_reference_idx", plan)
+
+    def test_due(self):
+        plan = self.plan(Subscription.objects.due())
+        self.assertIn("subscription_next_action_idx", plan)
+
+    def test_next_wake(self):
+        # An aggregate has no explain(), so explain the query seconds_until_next() runs.
+        with CaptureQueriesContext(connection) as queries:
+            schedule.seconds_until_next()
+        (query,) = queries.captured_queries
+        prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(prefix + query["sql"])
+            plan = "\n".join(" ".join(map(str, row)) for row in cursor.fetchall())
+        self.assertIn("MIN", query["sql"])
+        self.assertIn("subscription_next_action_idx", plan)
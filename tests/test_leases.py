@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+from subscriptions import leases, signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+class LeaseTestCase(TestCase):
+    sigs = [
+        signals.subscription_due,
+        signals.subscription_renewed,
+        signals.subscription_error,
+        signals.bulk_subscription_due,
+    ]
+
+    def setUp(self):
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+        self.now = timezone.now()
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    def test_renew_takes_lease(self):
+        sub = Subscription.objects.create(end=self.now - timedelta(days=1))
+        with mock.patch("subscriptions.leases.timezone.now", return_value=self.now):
+            sub.renew()
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(sub.lease_owner, leases.default_owner())
+        self.assertEqual(sub.lease_expires, self.now + timedelta(minutes=15))
+
+        sub.renewed(self.now + timedelta(days=30), "renewed")
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual((sub.lease_owner, sub.lease_expires), ("", None))
+
+        with self.settings(SUBSCRIPTIONS_LEASE_SECONDS=60):
+            sub.renew(owner="worker-1")
+        sub = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(sub.lease_owner, "worker-1")
+        self.assertLess(sub.lease_expires, timezone.now() + timedelta(minutes=1, seconds=1))
+
+    def test_bulk_renew_takes_lease(self):
+        Subscription.objects.create(end=self.now - timedelta(days=1))
+        self.assertEqual(Subscription.objects.trigger_renewals(bulk=True), 1)
+        sub = Subscription.objects.get()
+        self.assertEqual(sub.lease_owner, leases.default_owner())
+        self.assertGreater(sub.lease_expires, self.now)
+
+    def test_extend_lease(self):
+        sub = Subscription.objects.create(end=self.now - timedelta(days=1))
+        sub.renew()
+        last_updated = Subscription.objects.get(pk=sub.pk).last_updated
+
+        with self.assertNumQueries(1):
+            self.assertTrue(sub.extend_lease(seconds=4 * 60 * 60))
+        fresh = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(fresh.lease_expires, sub.lease_expires)
+        self.assertEqual(fresh.next_action_at, sub.lease_expires)
+        self.assertEqual(fresh.last_updated, last_updated)
+        self.assertGreater(fresh.lease_expires, self.now + timedelta(hours=3))
+
+        # Reclaimed by someone else
+        Subscription.objects.filter(pk=sub.pk).update(lease_owner="worker-2")
+        self.assertFalse(sub.extend_lease())
+
+    def test_stuck_reclaims_expired_leases(self):
+        expired = Subscription.objects.create(
+            state=State.RENEWING, end=self.now, lease_expires=self.now - timedelta(minutes=1)
+        )
+        extended = Subscription.objects.create(
+            state=State.RENEWING, end=self.now, lease_expires=self.now + timedelta(hours=1)
+        )
+        legacy = Subscription.objects.create(state=State.RENEWING, end=self.now)
+        # Every renewal was last updated long ago, only the leases tell them apart
+        Subscription.objects.update(last_updated=self.now - timedelta(hours=3))
+
+        stuck = Subscription.objects.stuck().values_list("pk", flat=True)
+        self.assertEqual(set(stuck), {expired.pk, legacy.pk})
+        self.assertEqual(Subscription.objects.tick()["stuck"], 2)
+        self.assertEqual(Subscription.objects.get(pk=expired.pk).state, State.ERROR)
+        self.assertEqual(Subscription.objects.get(pk=legacy.pk).state, State.ERROR)
+        extended = Subscription.objects.get(pk=extended.pk)
+        self.assertEqual(extended.state, State.RENEWING)
+        self.assertEqual(Subscription.objects.get(pk=expired.pk).lease_expires, None)
+        # However long ago it was last updated, a renewal holding its lease is left alone
+        self.assertEqual(Subscription.objects.trigger_stuck(timeout_hours=1), 0)
+        self.assertEqual(Subscription.objects.get(pk=extended.pk).state, State.RENEWING)
+
+    def test_bulk_stuck_releases_leases(self):
+        Subscription.objects.create(
+            state=State.RENEWING,
+            end=self.now,
+            lease_owner="worker-1",
+            lease_expires=self.now - timedelta(minutes=1),
+        )
+        self.assertEqual(Subscription.objects.trigger_stuck(bulk=True), 1)
+        sub = Subscription.objects.get()
+        self.assertEqual((sub.state, sub.lease_owner, sub.lease_expires), (State.ERROR, "", None))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions import metrics, signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+from tests.helpers import capture_on_commit_callbacks
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class RecordingBackend(metrics.MetricsBackend):
+    enabled = True
+
+    def __init__(self):
+        self.timings = []
+        self.increments = []
+
+    def timing(self, name, seconds, tags):
+        self.timings.append((name, seconds, tags))
+
+    def increment(self, name, value, tags):
+        self.increments.append((name, value, tags))
+
+    def recorded(self, name, **tags):
+        return [seconds for (n, seconds, t) in self.timings if n == name and t == tags]
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        backend = override_settings(
+            SUBSCRIPTIONS_METRICS_BACKEND="tests.test_metrics.RecordingBackend"
+        )
+        backend.enable()
+        self.addCleanup(backend.disable)
+        self.backend = metrics.get_backend()
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def test_default_backend_is_disabled(self):
+        with self.settings(SUBSCRIPTIONS_METRICS_BACKEND=None):
+            self.assertFalse(metrics.get_backend().enabled)
+
+    def test_transition(self):
+        sub = Subscription.objects.create(state=State.RENEWING, end=timezone.now())
+        sub.renewal_failed(description="DECLINED")
+
+        tags = {"transition": "renewal_failed"}
+        (total,) = self.backend.recorded("subscriptions.transition", **tags)
+        (db,) = self.backend.recorded("subscriptions.transition.db", **tags)
+        (statelog,) = self.backend.recorded("subscriptions.transition.statelog", **tags)
+        self.assertGreater(statelog, 0)
+        self.assertGreaterEqual(db, statelog)
+        self.assertGreaterEqual(total, db)
+        # The UPDATE of the subscription, and the INSERT of the StateLog
+        self.assertIn(("subscriptions.transition.queries", 2, tags), self.backend.increments)
+
+    def test_transition_receivers(self):
+        def receiver(sender, **kwargs):
+            time.sleep(0.01)
+
+        signals.subscription_due.connect(receiver)
+        sub = Subscription.objects.create(state=State.ACTIVE, end=timezone.now())
+        sub.renew()
+
+        (receivers,) = self.backend.recorded(
+            "subscriptions.transition.receivers", transition="renew"
+        )
+        (signal,) = self.backend.recorded("subscriptions.signal", signal="subscription_due")
+        self.assertGreaterEqual(receivers, 0.01)
+        self.assertEqual(receivers, signal)
+
+    def test_sweep_chunks(self):
+        hours_ago = timezone.now() - timedelta(hours=6)
+        for _ in range(3):
+            Subscription.objects.create(state=State.ACTIVE, end=hours_ago)
+        with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2):
+            Subscription.objects.trigger_renewals()
+
+        self.assertEqual(
+            len(self.backend.recorded("subscriptions.sweep.chunk", sweep="renewals")), 2
+        )
+        rows = [
+            value
+            for (name, value, tags) in self.backend.increments
+            if name == "subscriptions.sweep.rows"
+        ]
+        self.assertEqual(rows, [2, 1])
+
+    def test_sweep_receivers(self):
+        def receiver(sender, **kwargs):
+            time.sleep(0.01)
+
+        signals.subscription_due.connect(receiver)
+        for _ in range(2):
+            Subscription.objects.create(end=timezone.now() - timedelta(hours=6))
+        with capture_on_commit_callbacks(execute=True):
+            Subscription.objects.trigger_renewals()
+
+        (receivers,) = self.backend.recorded("subscriptions.sweep.receivers", sweep="renewals")
+        self.assertGreaterEqual(receivers, 0.02)
+
+
+class BackendTestCase(TestCase):
+    def test_statsd(self):
+        client = mock.Mock()
+        backend = metrics.StatsdBackend(client)
+        backend.timing("subscriptions.transition", 0.5, {"transition": "renew"})
+        backend.increment("subscriptions.sweep.rows", 3, {"sweep": "renewals"})
+        client.timing.assert_called_once_with("subscriptions.transition.renew", 500)
+        client.incr.assert_called_once_with("subscriptions.sweep.rows.renewals", 3)
+
+    @skipUnless(prometheus_client, "prometheus_client is not installed")
+    def test_prometheus(self):
+        registry = prometheus_client.CollectorRegistry()
+        backend = metrics.PrometheusBackend(registry)
+        backend.timing("subscriptions.transition", 0.5, {"transition": "renew"})
+        backend.increment("subscriptions.sweep.rows", 3, {"sweep": "renewals"})
+        self.assertEqual(
+            registry.get_sample_value(
+                "subscriptions_transition_seconds_sum", {"transition": "renew"}
+            ),
+            0.5,
+        )
+        self.assertEqual(
+            registry.get_sample_value("subscriptions_sweep_rows_total", {"sweep": "renewals"}), 3
+        )
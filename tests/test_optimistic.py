@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_fsm import ConcurrentTransition
+from django_fsm_log.models import StateLog
+from subscriptions import signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+@override_settings(SUBSCRIPTIONS_CONDITIONAL_SAVE=True)
+class ConditionalSaveTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_error.receivers
+        signals.subscription_error.receivers = []
+        self.pk = Subscription.objects.create(
+            state=State.RENEWING, end=timezone.now(), reference="ref", reason="r"
+        ).pk
+
+    def tearDown(self):
+        signals.subscription_error.receivers = self.receivers
+
+    def test_lost_race_raises(self):
+        sweep = Subscription.objects.get(pk=self.pk)
+        callback = Subscription.objects.get(pk=self.pk)
+        new_end = timezone.now() + timedelta(days=30)
+        callback.renewed(new_end, "paid")
+
+        with self.assertRaises(ConcurrentTransition), transaction.atomic():
+            sweep.state_unknown(description="stuck subscription")
+
+        sub = Subscription.objects.get(pk=self.pk)
+        self.assertEqual((sub.state, sub.end, sub.reference), (State.ACTIVE, new_end, "paid"))
+        self.assertFalse(StateLog.objects.filter(transition="state_unknown").exists())
+
+    def test_same_state_again_still_conflicts(self):
+        stale = Subscription.objects.get(pk=self.pk)
+        other = Subscription.objects.get(pk=self.pk)
+        other.renewal_failed()
+        other = Subscription.objects.get(pk=self.pk)
+        other.renew()
+
+        # Back in RENEWING, but last_updated has moved on
+        with self.assertRaises(ConcurrentTransition), transaction.atomic():
+            stale.state_unknown()
+
+    def test_writes_changed_fields(self):
+        sub = Subscription.objects.get(pk=self.pk)
+        with CaptureQueriesContext(connection) as queries:
+            sub.state_unknown(description="stuck")
+
+        (update,) = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        set_clause, where = update.split("WHERE")
+        for column in ('"state"', '"reason"', '"last_updated"'):
+            self.assertIn(column, set_clause)
+        for column in ('"reference"', '"start"', '"end"'):
+            self.assertNotIn(column, set_clause)
+        self.assertIn('"state"', where)
+        self.assertIn('"last_updated"', where)
+
+        # Consecutive transitions on the same instance are based on its own saves
+        sub.renewal_failed()
+        self.assertEqual(Subscription.objects.get(pk=self.pk).state, State.SUSPENDED)
+
+    def test_disabled_last_writer_wins(self):
+        with self.settings(SUBSCRIPTIONS_CONDITIONAL_SAVE=False):
+            sweep = Subscription.objects.get(pk=self.pk)
+            callback = Subscription.objects.get(pk=self.pk)
+            callback.renewed(timezone.now() + timedelta(days=30), "paid")
+            sweep.state_unknown()
+        self.assertEqual(Subscription.objects.get(pk=self.pk).state, State.ERROR)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions import outbox, signals
+from subscriptions.models import SignalEvent, Subscription
+from subscriptions.states import SubscriptionState as State
+from subscriptions.tasks import deliver_signals
+
+
+@override_settings(SUBSCRIPTIONS_OUTBOX=True)
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers, signals.bulk_subscription_due.receivers
+        signals.subscription_due.receivers = []
+        signals.bulk_subscription_due.receivers = []
+        self.handler = mock.Mock()
+        signals.subscription_due.connect(self.handler)
+        signals.bulk_subscription_due.connect(self.handler)
+
+    def tearDown(self):
+        signals.subscription_due.receivers, signals.bulk_subscription_due.receivers = self.receivers
+
+    def test_transition_queues_event(self):
+        sub = Subscription.objects.create(end=timezone.now())
+        sub.renew()
+
+        self.handler.assert_not_called()
+        event = SignalEvent.objects.get()
+        self.assertEqual((event.signal, event.subscription), ("subscription_due", sub))
+
+        self.assertEqual(outbox.deliver(), 1)
+        self.handler.assert_called_once_with(sender=sub, signal=signals.subscription_due)
+        self.assertFalse(SignalEvent.objects.exists())
+
+    def test_event_rolled_back_with_transition(self):
+        sub = Subscription.objects.create(end=timezone.now())
+        with mock.patch("django.db.models.QuerySet.create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                sub.renew()
+        self.assertEqual(Subscription.objects.get().state, State.ACTIVE)
+
+    def test_bulk_queues_one_event_per_chunk(self):
+        for _ in range(3):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2):
+            Subscription.objects.trigger_renewals(bulk=True)
+
+        self.assertEqual(SignalEvent.objects.count(), 2)
+        self.assertEqual(deliver_signals(), 2)
+        pks = [pk for call in self.handler.call_args_list for pk in call[1]["pks"]]
+        self.assertEqual(sorted(pks), list(Subscription.objects.values_list("pk", flat=True)))
+        self.assertEqual(self.handler.call_args[1]["sender"], Subscription)
+
+    @override_settings(SUBSCRIPTIONS_OUTBOX_MAX_ATTEMPTS=2, SUBSCRIPTIONS_OUTBOX_RETRY_DELAY=60)
+    def test_failing_receiver_is_retried(self):
+        self.handler.side_effect = ValueError("gateway down")
+        sub = Subscription.objects.create(end=timezone.now())
+        sub.renew()
+
+        self.assertEqual(outbox.deliver(), 0)
+        event = SignalEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("gateway down", event.last_error)
+        self.assertGreater(event.available, timezone.now() + timedelta(seconds=50))
+
+        # Not due again yet
+        self.assertEqual(outbox.deliver(), 0)
+        self.assertEqual(self.handler.call_count, 1)
+
+        SignalEvent.objects.update(available=timezone.now())
+        with self.assertLogs("subscriptions.outbox", "ERROR"):
+            self.assertEqual(outbox.deliver(), 0)
+        event = SignalEvent.objects.get()
+        self.assertEqual(event.attempts, 2)
+        self.assertIsNone(event.available)
+
+        self.assertEqual(outbox.deliver(), 0)
+        self.assertEqual(self.handler.call_count, 2)
+
+    def test_deleted_subscription_keeps_event(self):
+        sub = Subscription.objects.create(end=timezone.now())
+        sub.renew()
+        pk = sub.pk
+        Subscription.objects.filter(pk=pk).delete()
+
+        event = SignalEvent.objects.get()
+        self.assertEqual(event.subscription_id, pk)
+        with self.assertLogs("subscriptions.outbox", "ERROR"):
+            self.assertEqual(outbox.deliver(), 0)
+        self.handler.assert_not_called()
+        event = SignalEvent.objects.get()
+        self.assertIsNone(event.available)
+        self.assertIn("no longer exists", event.last_error)
+
+    def test_disabled_sends_inline(self):
+        with self.settings(SUBSCRIPTIONS_OUTBOX=False):
+            sub = Subscription.objects.create(end=timezone.now())
+            sub.renew()
+        self.handler.assert_called_once_with(sender=sub, signal=signals.subscription_due)
+        self.assertFalse(SignalEvent.objects.exists())
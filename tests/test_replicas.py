@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from subscriptions import signals
+from subscriptions.models import Subscription, SweepCursor
+from subscriptions.states import SubscriptionState as State
+
+
+@override_settings(SUBSCRIPTIONS_READ_DATABASE="replica")
+class ReplicaTestCase(TransactionTestCase):
+    databases = {"default", "replica"}
+    sigs = [signals.subscription_due, signals.bulk_subscription_due]
+
+    def setUp(self):
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+        self.days_ago = timezone.now() - timedelta(days=1)
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    def states(self):
+        return dict(Subscription.objects.values_list("pk", "state"))
+
+    def test_candidates_scanned_on_replica(self):
+        due = [Subscription.objects.create(end=self.days_ago) for _ in range(3)]
+        Subscription.objects.create(end=timezone.now() + timedelta(days=1))
+
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            with CaptureQueriesContext(connections["default"]) as primary:
+                self.assertEqual(Subscription.objects.trigger_renewals(), 3)
+        self.assertEqual(self.states()[due[0].pk], State.RENEWING)
+        # The scans, and the one that finds nothing left
+        self.assertEqual(len(replica.captured_queries), 2)
+        # The primary is only asked about the scanned pks
+        table = Subscription._meta.db_table
+        reads = [
+            query["sql"]
+            for query in primary.captured_queries
+            if query["sql"].startswith("SELECT") and 'FROM "{}"'.format(table) in query["sql"]
+        ]
+        self.assertTrue(reads)
+        for sql in reads:
+            self.assertIn('"{}"."id" IN'.format(table), sql)
+        self.assertFalse(SweepCursor.objects.exists())
+
+    def test_lagging_replica(self):
+        renewed = Subscription.objects.create(end=timezone.now() + timedelta(days=30))
+        due = Subscription.objects.create(end=self.days_ago)
+
+        # A replica that hasn't seen `renewed` move its end into the future yet.
+        def stale(candidates):
+            return Subscription.objects.using("replica").order_by("last_updated", "pk")
+
+        with mock.patch("subscriptions.sweeps.replicas.reading", side_effect=stale):
+            self.assertEqual(Subscription.objects.trigger_renewals(), 1)
+            self.assertEqual(Subscription.objects.trigger_renewals(bulk=True), 0)
+        self.assertEqual(self.states(), {renewed.pk: State.ACTIVE, due.pk: State.RENEWING})
+
+    def test_tick(self):
+        Subscription.objects.create(end=self.days_ago)
+        Subscription.objects.create(state=State.EXPIRING, end=self.days_ago)
+        counts = Subscription.objects.tick()
+        self.assertEqual((counts["renewals"], counts["expiring"]), (1, 1))
+
+    def test_state_counts(self):
+        Subscription.objects.create(end=self.days_ago)
+        with CaptureQueriesContext(connections["default"]) as primary:
+            self.assertEqual(Subscription.objects.count_in_state(State.ACTIVE), 1)
+        self.assertEqual(len(primary.captured_queries), 0)
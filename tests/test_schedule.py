@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+from subscriptions import schedule, signals
+from subscriptions.models import Subscription
+from subscriptions.states import SubscriptionState as State
+
+
+class ScheduleTestCase(TestCase):
+    sigs = [signals.subscription_due, signals.subscription_ended, signals.bulk_subscription_due]
+
+    def setUp(self):
+        self.receivers = [sig.receivers for sig in self.sigs]
+        for sig in self.sigs:
+            sig.receivers = []
+        self.now = timezone.now()
+
+    def tearDown(self):
+        for sig, receivers in zip(self.sigs, self.receivers):
+            sig.receivers = receivers
+
+    def next_action(self, sub):
+        return Subscription.objects.get(pk=sub.pk).next_action_at
+
+    def test_computed_on_save(self):
+        end = self.now - timedelta(hours=1)
+        sub = Subscription.objects.create(end=end)
+        self.assertEqual(self.next_action(sub), end)
+
+        sub.renew()
+        renewing = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(renewing.next_action_at, renewing.lease_expires)
+
+        sub.renewal_failed()
+        self.assertEqual(self.next_action(sub), Subscription.objects.get(pk=sub.pk).next_retry_at)
+
+        sub.end_subscription()
+        self.assertIsNone(self.next_action(sub))
+
+    def test_suspended_timeout_comes_first(self):
+        end = self.now - timedelta(hours=47)
+        sub = Subscription.objects.create(
+            state=State.SUSPENDED, end=end, next_retry_at=self.now + timedelta(hours=4)
+        )
+        self.assertEqual(self.next_action(sub), end + timedelta(hours=48))
+
+    def test_expression_matches(self):
+        subs = [
+            Subscription.objects.create(end=self.now),
+            Subscription.objects.create(state=State.EXPIRING, end=self.now),
+            Subscription.objects.create(state=State.RENEWING, end=self.now),
+            Subscription.objects.create(state=State.SUSPENDED, end=self.now),
+            Subscription.objects.create(
+                state=State.SUSPENDED, end=self.now, next_retry_at=self.now + timedelta(hours=1)
+            ),
+            Subscription.objects.create(
+                state=State.SUSPENDED, end=self.now, next_retry_at=self.now + timedelta(days=3)
+            ),
+            Subscription.objects.create(state=State.ENDED, end=self.now),
+        ]
+        expected = [self.next_action(sub) for sub in subs]
+        Subscription.objects.update(next_action_at=None)
+
+        self.assertEqual(schedule.reschedule(size=3), len(subs))
+        self.assertEqual([self.next_action(sub) for sub in subs], expected)
+
+    def test_run_due(self):
+        due = Subscription.objects.create(end=self.now - timedelta(minutes=1))
+        later = Subscription.objects.create(end=self.now + timedelta(minutes=5))
+
+        self.assertEqual(Subscription.objects.run_due()["renewals"], 1)
+        self.assertEqual(Subscription.objects.get(pk=due.pk).state, State.RENEWING)
+        self.assertEqual(Subscription.objects.get(pk=later.pk).state, State.ACTIVE)
+
+        with self.settings(SUBSCRIPTIONS_SCHEDULER_MAX_SLEEP=600):
+            self.assertAlmostEqual(schedule.seconds_until_next(self.now), 300, places=3)
+        self.assertEqual(schedule.seconds_until_next(self.now), 60)
+
+    def test_bulk_transition_reschedules(self):
+        sub = Subscription.objects.create(end=self.now - timedelta(minutes=1))
+        Subscription.objects.trigger_renewals(bulk=True)
+        renewing = Subscription.objects.get(pk=sub.pk)
+        self.assertEqual(renewing.next_action_at, renewing.lease_expires)
+
+    def test_run_until_stopped(self):
+        stop = threading.Event()
+        with mock.patch.object(
+            Subscription.objects, "run_due", side_effect=lambda: stop.set() or {}
+        ) as run_due:
+            schedule.run(stop)
+        run_due.assert_called_once_with()
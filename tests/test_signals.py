@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from subscriptions import signals
+from subscriptions.models import Subscription
+
+
+def fast(**kwargs):
+    return "fast"
+
+
+def slow(**kwargs):
+    time.sleep(0.02)
+
+
+def broken(**kwargs):
+    raise ValueError("gateway down")
+
+
+class ReceiverStatsTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+        signals.reset_receiver_stats()
+        self.addCleanup(signals.reset_receiver_stats)
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def stats(self, receiver):
+        name = "tests.test_signals.{}".format(receiver.__qualname__)
+        (stats,) = [s for s in signals.receiver_stats() if s.receiver == name]
+        return stats
+
+    def test_records_calls_and_latency(self):
+        signals.subscription_due.connect(fast)
+        signals.subscription_due.connect(slow)
+        for _ in range(2):
+            responses = signals.subscription_due.send_robust(Subscription)
+
+        self.assertEqual(responses, [(fast, "fast"), (slow, None)])
+        self.assertEqual(self.stats(fast).calls, 2)
+        self.assertEqual(self.stats(slow).calls, 2)
+        self.assertEqual(self.stats(slow).signal, "subscription_due")
+        self.assertGreaterEqual(self.stats(slow).mean, 0.02)
+        self.assertGreaterEqual(self.stats(slow).max, self.stats(slow).mean)
+        self.assertEqual(signals.receiver_stats()[0].receiver, self.stats(slow).receiver)
+
+    def test_django_5_receivers(self):
+        signals.subscription_due.connect(fast)
+        # Django 5 returns the sync and async receivers separately
+        with mock.patch.object(
+            signals.subscription_due, "_live_receivers", return_value=([fast], [slow])
+        ):
+            responses = signals.subscription_due.send_robust(Subscription)
+        self.assertEqual(responses, [(fast, "fast"), (slow, None)])
+
+        with mock.patch.object(signals.subscription_due, "_live_receivers", return_value=None):
+            with self.assertRaises(TypeError):
+                signals.subscription_due.send_robust(Subscription)
+
+    def test_counts_errors(self):
+        signals.subscription_due.connect(broken)
+        signals.subscription_due.connect(fast)
+        with self.assertLogs("subscriptions.signals", "ERROR"):
+            ((_, error), (_, response)) = signals.subscription_due.send_robust(Subscription)
+
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(response, "fast")
+        self.assertEqual(self.stats(broken).errors, 1)
+        self.assertEqual(self.stats(fast).errors, 0)
+
+    @override_settings(SUBSCRIPTIONS_RECEIVER_BUDGET=0.01)
+    def test_flags_slow_receivers(self):
+        signals.subscription_due.connect(fast)
+        signals.subscription_due.connect(slow)
+        with self.assertLogs("subscriptions.signals", "WARNING") as logs:
+            signals.subscription_due.send_robust(Subscription)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("test_signals.slow", logs.output[0])
+        self.assertEqual(
+            [s.receiver for s in signals.slow_receivers()], ["tests.test_signals.slow"]
+        )
+        self.assertEqual(self.stats(slow).slow, 1)
+
+    @override_settings(SUBSCRIPTIONS_RECEIVER_BUDGET=None)
+    def test_budget_disabled(self):
+        signals.subscription_due.connect(slow)
+        signals.subscription_due.send_robust(Subscription)
+        self.assertEqual(signals.slow_receivers(), [])
+
+    def test_reset(self):
+        signals.subscription_due.connect(fast)
+        signals.subscription_due.send_robust(Subscription)
+        signals.reset_receiver_stats()
+        self.assertEqual(signals.receiver_stats(), [])
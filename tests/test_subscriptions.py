@@ -3,14 +3,19 @@ from __future__ import absolute_import, unicode_literals
 
 from contextlib import contextmanager
 from datetime import timedelta
+from importlib import import_module
 from unittest import mock
 
-from django.test import TestCase
+from django.apps import apps as django_apps
+from django.test import TestCase, override_settings
 from django.utils import timezone
+from django_fsm.signals import post_transition as post_transition_signal
 from django_fsm_log.models import StateLog
 from subscriptions import signals
-from subscriptions.models import Subscription
+from subscriptions.bulk import bulk_transition
+from subscriptions.models import Subscription, SweepCursor
 from subscriptions.states import SubscriptionState as State
+from tests.helpers import capture_on_commit_callbacks
 
 
 @contextmanager
@@ -36,6 +41,10 @@ class SubscriptionTestCase(TestCase):
         signals.renewal_failed,
         signals.autorenew_canceled,
         signals.autorenew_enabled,
+        signals.bulk_subscription_due,
+        signals.bulk_subscription_ended,
+        signals.bulk_subscription_error,
+        signals.bulk_renewal_failed,
     ]
 
     def setUp(self):
@@ -75,6 +84,28 @@ class SubscriptionTestCase(TestCase):
         sub.renew()
         mock_post_renew.assert_called_once()
 
+    def test_post_transition_hooks_table(self):
+        self.assertEqual(
+            Subscription._fsm_post_transition_hooks,
+            {
+                "cancel_autorenew": "post_cancel_autorenew",
+                "enable_autorenew": "post_enable_autorenew",
+                "renew": "post_renew",
+                "renewed": "post_renewed",
+                "renewal_failed": "post_renewal_failed",
+                "end_subscription": "post_end_subscription",
+                "state_unknown": "post_state_unknown",
+            },
+        )
+
+    @mock.patch("subscriptions.models.Subscription.post_renew")
+    def test_post_transition_hook_other_sender(self, mock_post_renew):
+        sub = Subscription(end=self.yearish)
+        post_transition_signal.send(
+            sender=SweepCursor, instance=sub, name="renew", source=State.ACTIVE, target=None
+        )
+        mock_post_renew.assert_not_called()
+
     def test_signal_subscription_due(self):
         with signal_handler(signals.subscription_due) as handler:
             sub = Subscription(state=State.ACTIVE, end=self.yearish)
@@ -267,3 +298,185 @@ class SubscriptionTestCase(TestCase):
         sub = Subscription.objects.create(state=State.SUSPENDED, end=self.days_ago)
         sub.renewed(timezone.now() + timedelta(days=7), "MYREF", "Renewed from SUSPENDED")
         self.assertEqual(sub.state, State.ACTIVE)
+
+    @mock.patch("subscriptions.models.signals.subscription_due.send_robust")
+    def test_trigger_renewals_bulk(self, mock_signal):
+        due = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago) for _ in range(3)
+        ]
+        not_due = Subscription.objects.create(state=State.ACTIVE, end=self.yearish)
+        with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2), signal_handler(
+            signals.bulk_subscription_due
+        ) as handler, capture_on_commit_callbacks(execute=True):
+            self.assertEqual(Subscription.objects.trigger_renewals(bulk=True), 3)
+
+        self.assertEqual(handler.call_count, 2)
+        sent = [pk for call in handler.call_args_list for pk in call[1]["pks"]]
+        self.assertCountEqual(sent, [sub.pk for sub in due])
+        mock_signal.assert_not_called()
+        for sub in due:
+            self.assertEqual(Subscription.objects.get(pk=sub.pk).state, State.RENEWING)
+            log = StateLog.objects.for_(sub).get()
+            self.assertEqual(log.transition, "renew")
+            self.assertEqual(log.source_state, str(State.ACTIVE.value))
+            self.assertEqual(log.state, str(State.RENEWING.value))
+        self.assertEqual(Subscription.objects.get(pk=not_due.pk).state, State.ACTIVE)
+
+    def test_trigger_expiring_bulk(self):
+        due = Subscription.objects.create(state=State.EXPIRING, end=self.hours_ago)
+        with signal_handler(signals.bulk_subscription_ended) as handler:
+            with capture_on_commit_callbacks(execute=True):
+                self.assertEqual(Subscription.objects.trigger_expiring(bulk=True), 1)
+        handler.assert_called_once_with(
+            sender=Subscription, signal=signals.bulk_subscription_ended, pks=[due.pk]
+        )
+        due_fresh = Subscription.objects.get(pk=due.pk)
+        self.assertEqual(due_fresh.state, State.ENDED)
+        self.assertGreater(due_fresh.end, due.end)
+
+    def test_trigger_stuck_bulk(self):
+        due = Subscription.objects.create(state=State.RENEWING, end=self.days_ago)
+        Subscription.objects.all().update(last_updated=self.hours_ago)
+        self.assertEqual(Subscription.objects.trigger_stuck(bulk=True), 1)
+        due_fresh = Subscription.objects.get(pk=due.pk)
+        self.assertEqual(due_fresh.state, State.ERROR)
+        self.assertEqual(due_fresh.reason, "stuck subscription")
+        self.assertEqual(StateLog.objects.for_(due).get().description, "stuck subscription")
+
+    def test_bulk_transition_respects_source_states(self):
+        """
+        Rows outside the transition's source states are never moved, whatever the queryset.
+        """
+        active = Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago)
+        ended = Subscription.objects.create(state=State.ENDED, end=self.hours_ago)
+        moved = bulk_transition(
+            Subscription.objects.all(), Subscription.renew, signals.bulk_subscription_due
+        )
+        self.assertEqual(moved, 1)
+        self.assertEqual(Subscription.objects.get(pk=active.pk).state, State.RENEWING)
+        self.assertEqual(Subscription.objects.get(pk=ended.pk).state, State.ENDED)
+        self.assertFalse(StateLog.objects.for_(ended).exists())
+
+    def test_bulk_transition_requires_leaving_source(self):
+        with self.assertRaises(ValueError):
+            bulk_transition(
+                Subscription.objects.all(), Subscription.renewed, signals.bulk_subscription_due
+            )
+
+    def test_trigger_renewals_resumes_from_cursor(self):
+        first = Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago)
+        second = Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago)
+        # An earlier run committed the chunk containing `first` and then crashed
+        first = Subscription.objects.get(pk=first.pk)
+        SweepCursor.objects.create(
+            name="renewals", last_updated=first.last_updated, last_id=first.pk
+        )
+
+        self.assertEqual(Subscription.objects.trigger_renewals(), 1)
+        self.assertEqual(Subscription.objects.get(pk=first.pk).state, State.ACTIVE)
+        self.assertEqual(Subscription.objects.get(pk=second.pk).state, State.RENEWING)
+        self.assertFalse(SweepCursor.objects.exists())
+
+    def test_trigger_renewals_commits_each_chunk(self):
+        due = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago) for _ in range(3)
+        ]
+
+        def save_or_crash(subscription):
+            if subscription.pk == due[-1].pk:
+                raise RuntimeError("worker lost")
+            subscription.save()
+
+        with mock.patch(
+            "subscriptions.models.Subscription.post_renew", autospec=True
+        ) as post_renew:
+            post_renew.side_effect = save_or_crash
+            with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2), self.assertRaises(RuntimeError):
+                Subscription.objects.trigger_renewals()
+
+        states = [Subscription.objects.get(pk=sub.pk).state for sub in due]
+        self.assertEqual(states, [State.RENEWING, State.RENEWING, State.ACTIVE])
+        cursor = SweepCursor.objects.get(name="renewals")
+        self.assertEqual(cursor.last_id, due[1].pk)
+
+        # The redelivered task picks up where the crashed one stopped
+        self.assertEqual(Subscription.objects.trigger_renewals(), 1)
+        self.assertEqual(Subscription.objects.get(pk=due[-1].pk).state, State.RENEWING)
+        self.assertFalse(SweepCursor.objects.exists())
+
+    def test_suspended_timeout_boundary(self):
+        """
+        The timeout is inclusive and exact to the microsecond, whichever database computes it.
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(hours=48)
+        on_time = Subscription.objects.create(state=State.SUSPENDED, end=cutoff)
+        Subscription.objects.create(state=State.SUSPENDED, end=cutoff + timedelta(microseconds=1))
+        Subscription.objects.create(state=State.ACTIVE, end=cutoff)
+
+        timed_out = Subscription.objects.filter(state=State.SUSPENDED).ended_before(48, now=now)
+        self.assertEqual(list(timed_out), [on_time])
+        with mock.patch("subscriptions.models.timezone.now", return_value=now):
+            self.assertEqual(list(Subscription.objects.suspended_timeout(48)), [on_time])
+
+    @override_settings(SUBSCRIPTIONS_CHUNK_SIZE=2)
+    def test_by_reference(self):
+        first = Subscription.objects.add_subscription(self.days_ago, self.yearish, "a")
+        second = Subscription.objects.add_subscription(self.nowish, self.yearish, "a")
+        other = Subscription.objects.add_subscription(self.nowish, self.yearish, "b")
+        Subscription.objects.add_subscription(self.nowish, self.yearish, "ab")
+
+        with self.assertNumQueries(2):
+            found = Subscription.objects.by_reference(["a", "b", "missing"])
+        self.assertEqual(found, {"a": [first, second], "b": [other]})
+        self.assertEqual(list(Subscription.objects.for_reference("b")), [other])
+        self.assertEqual(Subscription.objects.reference_startswith("a").count(), 3)
+
+    def test_reference_migration_refuses_long_references(self):
+        migration = import_module("subscriptions.migrations.0010_reference_index")
+        Subscription.objects.add_subscription(self.nowish, self.yearish, "x" * 101)
+        with self.assertRaisesMessage(ValueError, "longer than 100 characters"):
+            migration.check_references(django_apps, None)
+
+    def test_tick(self):
+        active = Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago)
+        expiring = Subscription.objects.create(state=State.EXPIRING, end=self.hours_ago)
+        suspended = Subscription.objects.create(state=State.SUSPENDED, end=self.hours_ago)
+        timed_out = Subscription.objects.create(state=State.SUSPENDED, end=self.days_ago)
+        stuck = Subscription.objects.create(state=State.RENEWING, end=self.hours_ago)
+        Subscription.objects.filter(pk=stuck.pk).update(last_updated=self.hours_ago)
+        untouched = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.yearish),
+            Subscription.objects.create(state=State.RENEWING, end=self.hours_ago),
+            Subscription.objects.create(state=State.ENDED, end=self.days_ago),
+        ]
+
+        counts = Subscription.objects.tick()
+        self.assertEqual(
+            counts,
+            {
+                "renewals": 1,
+                "expiring": 1,
+                "suspended": 1,
+                "timeout": 1,
+                "stuck": 1,
+                "remaining": 0,
+            },
+        )
+
+        def state(sub):
+            return Subscription.objects.get(pk=sub.pk).state
+
+        self.assertEqual(state(active), State.RENEWING)
+        self.assertEqual(state(expiring), State.ENDED)
+        self.assertEqual(state(suspended), State.RENEWING)
+        self.assertEqual(state(timed_out), State.ENDED)
+        self.assertEqual(state(stuck), State.ERROR)
+        self.assertEqual([state(sub) for sub in untouched], [sub.state for sub in untouched])
+        self.assertFalse(SweepCursor.objects.exists())
+
+    def test_tick_uses_one_clock(self):
+        Subscription.objects.create(state=State.ACTIVE, end=self.nowish)
+        with mock.patch("subscriptions.models.timezone.now", return_value=self.nowish):
+            self.assertEqual(Subscription.objects.tick()["renewals"], 0)
+        self.assertEqual(Subscription.objects.tick()["renewals"], 1)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from django_fsm_log.models import StateLog
+from subscriptions import signals
+from subscriptions.models import Subscription, SweepCursor
+from subscriptions.states import SubscriptionState as State
+from subscriptions.sweeps import claim, each, sweep
+from tests.helpers import capture_on_commit_callbacks
+
+
+class ClaimTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def test_claims_are_disjoint(self):
+        hours_ago = timezone.now() - timedelta(hours=6)
+        first = Subscription.objects.create(state=State.ACTIVE, end=hours_ago)
+        second = Subscription.objects.create(state=State.ACTIVE, end=hours_ago)
+        candidates = Subscription.objects.renewals_due().filter(last_updated__lte=timezone.now())
+        candidates = candidates.order_by("last_updated", "pk")
+        with transaction.atomic():
+            rows, seen = claim(candidates, 1)
+            self.assertEqual(rows, [(first.pk, State.ACTIVE)])
+            rows, seen = claim(candidates, 1)
+            self.assertEqual(rows, [(second.pk, State.ACTIVE)])
+            rows, seen = claim(candidates, 1)
+            self.assertEqual((rows, seen), ([], False))
+
+    def test_trigger_renewals_single_worker(self):
+        due = Subscription.objects.create(
+            state=State.ACTIVE, end=timezone.now() - timedelta(hours=6)
+        )
+        self.assertEqual(Subscription.objects.trigger_renewals(workers=1), 1)
+        self.assertEqual(Subscription.objects.get(pk=due.pk).state, State.RENEWING)
+        self.assertFalse(SweepCursor.objects.exists())
+
+
+class ChunkSignalsTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+        self.received = []
+        signals.subscription_due.connect(self.receiver)
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def receiver(self, sender, **kwargs):
+        self.received.append(sender.pk)
+
+    def test_sent_once_the_chunk_commits(self):
+        subs = [Subscription.objects.create(end=timezone.now() - timedelta(hours=6)) for _ in "ab"]
+        with capture_on_commit_callbacks(execute=True):
+            sweep(None, Subscription.objects.renewals_due(), each(Subscription, Subscription.renew))
+            self.assertEqual(self.received, [])
+        self.assertEqual(sorted(self.received), [sub.pk for sub in subs])
+
+    def test_not_sent_when_the_chunk_rolls_back(self):
+        subs = [Subscription.objects.create(end=timezone.now() - timedelta(hours=6)) for _ in "ab"]
+
+        def renew(subscription):
+            if subscription.pk == subs[1].pk:
+                raise ValueError("gateway down")
+            subscription.renew()
+
+        with capture_on_commit_callbacks(execute=True):
+            with self.assertRaises(ValueError):
+                sweep(None, Subscription.objects.renewals_due(), each(Subscription, renew))
+        self.assertEqual(self.received, [])
+        self.assertEqual(Subscription.objects.get(pk=subs[0].pk).state, State.ACTIVE)
+
+
+class WorkerPoolTestCase(TransactionTestCase):
+    def test_many_workers(self):
+        # On SQLite (a file, see runtests.py), threads claiming at once would deadlock
+        hours_ago = timezone.now() - timedelta(hours=6)
+        for _ in range(40):
+            Subscription.objects.create(state=State.ACTIVE, end=hours_ago)
+        with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=3):
+            self.assertEqual(Subscription.objects.trigger_renewals(workers=4), 40)
+        self.assertEqual(Subscription.objects.filter(state=State.RENEWING).count(), 40)
+
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    def test_trigger_renewals_worker_pool(self):
+        hours_ago = timezone.now() - timedelta(hours=6)
+        due = [Subscription.objects.create(state=State.ACTIVE, end=hours_ago) for _ in range(12)]
+        renewed = []
+
+        def handler(sender, **kwargs):
+            renewed.append(sender.pk)
+
+        signals.subscription_due.connect(handler)
+        try:
+            with self.settings(SUBSCRIPTIONS_CHUNK_SIZE=2):
+                self.assertEqual(Subscription.objects.trigger_renewals(workers=3), 12)
+        finally:
+            signals.subscription_due.disconnect(handler)
+
+        self.assertCountEqual(renewed, [sub.pk for sub in due])
+        self.assertEqual(Subscription.objects.filter(state=State.RENEWING).count(), 12)
+        self.assertEqual(StateLog.objects.filter(transition="renew").count(), 12)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+from subscriptions import signals, tasks
+from subscriptions.models import Subscription, SweepCursor
+from subscriptions.states import SubscriptionState as State
+from subscriptions.sweeps import pk_ranges
+
+
+class FanOutTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers
+        signals.subscription_due.receivers = []
+        self.hours_ago = timezone.now() - timedelta(hours=6)
+
+    def tearDown(self):
+        signals.subscription_due.receivers = self.receivers
+
+    def test_pk_ranges(self):
+        subs = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago) for _ in range(7)
+        ]
+        first, last = subs[0].pk, subs[-1].pk
+        ranges = pk_ranges(Subscription.objects.all(), 3)
+        self.assertEqual(
+            ranges,
+            [(first, first + 2), (first + 3, first + 5), (first + 6, last)],
+        )
+        self.assertEqual(pk_ranges(Subscription.objects.none(), 3), [])
+        self.assertEqual(pk_ranges(Subscription.objects.all(), 20)[-1], (last, last))
+
+    @mock.patch("subscriptions.tasks.chord")
+    def test_fan_out_renewals(self, mock_chord):
+        subs = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago) for _ in range(4)
+        ]
+        Subscription.objects.create(state=State.ACTIVE, end=timezone.now() + timedelta(days=1))
+
+        self.assertEqual(tasks.fan_out_renewals(shards=2), 2)
+        header = mock_chord.call_args[0][0]
+        self.assertEqual(
+            [sig.args for sig in header],
+            [(subs[0].pk, subs[1].pk), (subs[2].pk, subs[3].pk)],
+        )
+        mock_chord.return_value.assert_called_once_with(tasks.log_shards.s("renewals"))
+
+    @mock.patch("subscriptions.tasks.chord")
+    def test_fan_out_renewals_nothing_due(self, mock_chord):
+        self.assertEqual(tasks.fan_out_renewals(), 0)
+        mock_chord.assert_not_called()
+
+    def test_trigger_renewals_shard(self):
+        subs = [
+            Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago) for _ in range(3)
+        ]
+        self.assertEqual(tasks.trigger_renewals_shard(subs[0].pk, subs[1].pk), 2)
+        states = [Subscription.objects.get(pk=sub.pk).state for sub in subs]
+        self.assertEqual(states, [State.RENEWING, State.RENEWING, State.ACTIVE])
+        self.assertFalse(SweepCursor.objects.exists())
+
+    def test_log_shards(self):
+        with mock.patch("subscriptions.tasks.log_update") as mock_log:
+            self.assertEqual(tasks.log_shards([2, 0, 3], "renewals"), 5)
+        mock_log.assert_called_once_with("renewals", 5)
+
+    def test_log_update(self):
+        Subscription.objects.create(state=State.ACTIVE, end=self.hours_ago)
+        with self.assertLogs("subscriptions.tasks", "INFO") as logs:
+            self.assertEqual(tasks.trigger_renewals(), 1)
+        self.assertEqual(
+            logs.records[0].getMessage(), "subscriptions.trigger | trigger=renewals | count=1 |"
+        )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions import signals, throttle
+from subscriptions.models import Subscription, SweepCursor
+from subscriptions.states import SubscriptionState as State
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTestCase(TestCase):
+    def test_take(self):
+        clock = Clock()
+        bucket = throttle.TokenBucket(rate=2, burst=4, clock=clock, sleep=clock.sleep)
+        self.assertEqual(bucket.take(10, timeout=0), 4)
+        self.assertEqual(bucket.take(10, timeout=0), 0)
+        self.assertEqual(bucket.take(10, timeout=1), 1)
+        self.assertEqual(clock.now, 0.5)
+
+        clock.now += 10
+        bucket.put(3)
+        self.assertEqual(bucket.take(10, timeout=0), 4)
+
+    def test_jitter_is_deterministic(self):
+        with self.settings(SUBSCRIPTIONS_RENEWAL_JITTER=3600):
+            offsets = [throttle.jitter(pk) for pk in range(1, 200)]
+            self.assertEqual(offsets, [throttle.jitter(pk) for pk in range(1, 200)])
+        self.assertTrue(all(timedelta(0) <= offset < timedelta(hours=1) for offset in offsets))
+        self.assertGreater(len(set(offsets)), 190)
+
+
+class ThrottledTriggerTestCase(TestCase):
+    def setUp(self):
+        self.receivers = signals.subscription_due.receivers, signals.bulk_subscription_due.receivers
+        signals.subscription_due.receivers = []
+        signals.bulk_subscription_due.receivers = []
+        clock = Clock()
+        self.bucket = throttle.TokenBucket(rate=1, burst=2, clock=clock, sleep=clock.sleep)
+        patcher = mock.patch("subscriptions.throttle.bucket", return_value=self.bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        signals.subscription_due.receivers, signals.bulk_subscription_due.receivers = self.receivers
+
+    def renewing(self):
+        return Subscription.objects.filter(state=State.RENEWING).count()
+
+    @override_settings(SUBSCRIPTIONS_RENEWAL_RATE=1, SUBSCRIPTIONS_RENEWAL_MAX_WAIT=0)
+    def test_stops_early(self):
+        for _ in range(5):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+
+        progress = Subscription.objects.trigger_renewals()
+        self.assertEqual((progress, progress.remaining), (2, 3))
+        self.assertTrue(SweepCursor.objects.filter(name="renewals").exists())
+
+        self.bucket.put(10)
+        progress = Subscription.objects.trigger_renewals()
+        self.assertEqual((progress, progress.remaining), (2, 1))
+        self.assertEqual(self.renewing(), 4)
+
+    @override_settings(
+        SUBSCRIPTIONS_RENEWAL_RATE=1,
+        SUBSCRIPTIONS_RENEWAL_MAX_WAIT=0,
+        SUBSCRIPTIONS_RENEWAL_JITTER=3600,
+    )
+    def test_tick_only_throttles_renewals(self):
+        now = timezone.now()
+        for _ in range(3):
+            Subscription.objects.create(end=now - timedelta(days=1))
+        Subscription.objects.create(state=State.EXPIRING, end=now - timedelta(days=1))
+        # Just past its suspended timeout, well inside its jitter window
+        Subscription.objects.create(state=State.SUSPENDED, end=now - timedelta(hours=48, minutes=1))
+        self.bucket.take(2, timeout=0)
+
+        counts = Subscription.objects.tick()
+        self.assertEqual(
+            counts,
+            {
+                "renewals": 0,
+                "expiring": 1,
+                "suspended": 0,
+                "timeout": 1,
+                "stuck": 0,
+                "remaining": 3,
+            },
+        )
+        self.assertEqual(Subscription.objects.filter(state=State.ENDED).count(), 2)
+
+    @override_settings(SUBSCRIPTIONS_RENEWAL_RATE=1, SUBSCRIPTIONS_RENEWAL_MAX_WAIT=0)
+    def test_async_stops_early(self):
+        for _ in range(5):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+
+        progress = async_to_sync(Subscription.objects.atrigger_renewals)()
+        self.assertEqual((progress, progress.remaining), (2, 3))
+        self.assertEqual(self.renewing(), 2)
+
+    @override_settings(SUBSCRIPTIONS_RENEWAL_RATE=1, SUBSCRIPTIONS_RENEWAL_MAX_WAIT=2)
+    def test_paces(self):
+        for _ in range(5):
+            Subscription.objects.create(end=timezone.now() - timedelta(days=1))
+        progress = Subscription.objects.trigger_renewals(bulk=True)
+        self.assertEqual((progress, progress.remaining), (4, 1))
+        self.assertEqual(self.bucket.clock(), 2)
+
+    @override_settings(SUBSCRIPTIONS_RENEWAL_JITTER=3600)
+    def test_jitter(self):
+        end = timezone.now() - timedelta(minutes=30)
+        subs = [Subscription.objects.create(end=end) for _ in range(20)]
+        due = {sub.pk for sub in subs if throttle.jitter(sub.pk) < timedelta(minutes=30)}
+
+        self.assertEqual(Subscription.objects.trigger_renewals(), len(due))
+        renewed = Subscription.objects.filter(state=State.RENEWING).values_list("pk", flat=True)
+        self.assertEqual(set(renewed), due)
+        self.assertFalse(SweepCursor.objects.exists())
+
+    @override_settings(SUBSCRIPTIONS_RENEWAL_JITTER=3600)
+    def test_jitter_with_workers(self):
+        end = timezone.now() - timedelta(minutes=30)
+        subs = [Subscription.objects.create(end=end) for _ in range(20)]
+        due = {sub.pk for sub in subs if throttle.jitter(sub.pk) < timedelta(minutes=30)}
+
+        # SQLite ignores the row locks, but takes the SKIP LOCKED path through claim()
+        features = connection.features
+        with mock.patch.object(features, "has_select_for_update_skip_locked", True):
+            with override_settings(SUBSCRIPTIONS_CHUNK_SIZE=3):
+                self.assertEqual(Subscription.objects.trigger_renewals(workers=1), len(due))
+        renewed = Subscription.objects.filter(state=State.RENEWING).values_list("pk", flat=True)
+        self.assertEqual(set(renewed), due)